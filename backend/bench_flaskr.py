@@ -0,0 +1,305 @@
+"""
+Benchmarks the trivia API endpoints on synthetic datasets.
+
+Builds `create_app` (or `create_asgi_app`) against a local SQLite
+database, seeds it with a deterministic set of questions for each size,
+drives every route in-process and reports throughput and p50/p95/p99
+latency. Results are written as JSON; pass a previous result file with
+`--compare` to flag regressions.
+
+    python bench_flaskr.py --sizes 10000 100000 1000000 --output bench.json
+    python bench_flaskr.py --sizes 10000 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from flaskr import create_app
+
+CATEGORIES = ["Science", "Art", "Geography", "History", "Entertainment",
+              "Sports"]
+
+WORDS = ["which", "what", "who", "where", "when", "title", "country",
+         "river", "painter", "novel", "movie", "planet", "element", "king",
+         "queen", "war", "team", "cup", "mountain", "ocean", "city", "year",
+         "first", "largest", "oldest", "famous", "known", "named", "built",
+         "discovered", "invented", "wrote", "played", "won", "capital",
+         "language", "animal", "organ", "number", "color"]
+
+
+def seed_database(path, size, seed):
+    """
+    Creates a SQLite database with the categories and `size` questions
+    generated from `seed`.
+    """
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE categories (id INTEGER PRIMARY KEY, type VARCHAR);
+        CREATE TABLE questions (id INTEGER PRIMARY KEY, question VARCHAR,
+                                answer VARCHAR, difficulty INTEGER,
+                                category INTEGER CONSTRAINT category
+                                    REFERENCES categories (id));
+    """)
+    connection.executemany(
+        "INSERT INTO categories (id, type) VALUES (?, ?)",
+        enumerate(CATEGORIES, start=1)
+    )
+
+    def questions():
+        for _ in range(size):
+            yield (
+                " ".join(rng.choices(WORDS, k=rng.randint(5, 12))) + "?",
+                " ".join(rng.choices(WORDS, k=rng.randint(1, 3))),
+                rng.randint(1, len(CATEGORIES)),
+                rng.randint(1, 5)
+            )
+
+    connection.executemany(
+        "INSERT INTO questions (question, answer, category, difficulty) "
+        "VALUES (?, ?, ?, ?)",
+        questions()
+    )
+    connection.commit()
+    connection.close()
+
+
+def scenarios(size, rng):
+    """
+    Returns the benchmarked routes as (name, request factory) pairs. A
+    request factory returns the (method, path, json) of one request.
+    """
+    pages = max(size // 10, 1)
+    created = []
+
+    def create():
+        return ("POST", "/questions", {
+            "question": "Benchmark question?",
+            "answer": "Benchmark",
+            "difficulty": 1,
+            "category": 1
+        })
+
+    def delete():
+        # Deletes the questions made by "create", oldest first.
+        return ("DELETE", f"/questions/{created.pop(0)}", None)
+
+    return created, [
+        ("categories", lambda: ("GET", "/categories", None)),
+        ("questions_first_page", lambda: ("GET", "/questions?page=1", None)),
+        ("questions_deep_page", lambda: (
+            "GET", f"/questions?page={rng.randint(1, pages)}", None)),
+        ("questions_cursor", lambda: (
+            "GET", f"/questions?after={rng.randint(0, size)}", None)),
+        ("category_questions", lambda: (
+            "GET",
+            f"/categories/{rng.randint(1, len(CATEGORIES))}/questions"
+            f"?page={rng.randint(1, 5)}",
+            None)),
+        ("search", lambda: (
+            "POST", "/questions/search", {"searchTerm": rng.choice(WORDS)})),
+        ("suggest", lambda: (
+            "GET",
+            "/questions/suggest?prefix="
+            f"{rng.choice(WORDS)[:rng.randint(1, 4)]}",
+            None)),
+        ("quiz", lambda: ("POST", "/quizzes", {
+            "previous_questions": rng.sample(range(1, size + 1),
+                                             min(size, 10)),
+            "quiz_category": {"id": rng.randint(0, len(CATEGORIES))}
+        })),
+        ("quiz_deck", lambda: ("POST", "/quizzes/deck", {
+            "quiz_category": {"id": rng.randint(0, len(CATEGORIES))},
+            "size": 10
+        })),
+        ("create", create),
+        ("delete", delete),
+    ]
+
+
+def send(client, method, path, body):
+    """
+    Sends one request through the Flask or the ASGI test client.
+    """
+    return getattr(client, method.lower())(path, json=body)
+
+
+def summarize(timings, elapsed, cpu):
+    timings = sorted(timings)
+
+    def percentile(q):
+        return timings[min(int(q * len(timings)), len(timings) - 1)]
+
+    return {
+        "requests": len(timings),
+        "throughput_rps": round(len(timings) / elapsed, 1),
+        "cpu_ms": round(cpu / len(timings) * 1000, 3),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "p50_ms": round(percentile(0.50) * 1000, 3),
+        "p95_ms": round(percentile(0.95) * 1000, 3),
+        "p99_ms": round(percentile(0.99) * 1000, 3),
+    }
+
+
+def run_size(size, args):
+    """
+    Seeds a database of `size` questions and benchmarks every route.
+    """
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp(prefix="trivia-bench-")
+    path = os.path.join(directory, "trivia.db")
+
+    started = time.perf_counter()
+    seed_database(path, size, args.seed)
+    seeding = time.perf_counter() - started
+
+    config = {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}",
+        "SQLALCHEMY_ECHO": False,
+        "DEBUG": False,
+        **args.config
+    }
+    if args.mode == "asgi":
+        from flaskr.asgi import create_asgi_app
+        from test_flaskr import ASGITestClient
+        client = ASGITestClient(
+            create_asgi_app(config, database_path=config[
+                "SQLALCHEMY_DATABASE_URI"])
+        )
+    else:
+        client = create_app(config).test_client()
+
+    created, routes = scenarios(size, rng)
+    results = {"seeding_s": round(seeding, 3), "routes": {}}
+
+    for name, make_request in routes:
+        # Warm up: loads the in-memory indexes and the SQLite page cache.
+        for _ in range(args.warmup):
+            method, url, body = make_request()
+            response = send(client, method, url, body)
+            if name == "create":
+                created.append(json.loads(response.data)
+                               ["created_question_id"])
+
+        timings = []
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        for _ in range(args.requests):
+            method, url, body = make_request()
+            request_started = time.perf_counter()
+            response = send(client, method, url, body)
+            timings.append(time.perf_counter() - request_started)
+            if response.status_code >= 500:
+                raise RuntimeError(f"{name}: {method} {url} answered "
+                                   f"{response.status_code}")
+            if name == "create":
+                created.append(json.loads(response.data)
+                               ["created_question_id"])
+        results["routes"][name] = summarize(
+            timings,
+            time.perf_counter() - started,
+            time.process_time() - cpu_started
+        )
+
+        print(f"{size:>9} {name:<22} "
+              f"{results['routes'][name]['throughput_rps']:>9} req/s  "
+              f"cpu {results['routes'][name]['cpu_ms']:>8} ms  "
+              f"p50 {results['routes'][name]['p50_ms']:>8} ms  "
+              f"p95 {results['routes'][name]['p95_ms']:>8} ms  "
+              f"p99 {results['routes'][name]['p99_ms']:>8} ms",
+              flush=True)
+
+    os.remove(path)
+    os.rmdir(directory)
+
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current, tolerance):
+    """
+    Prints the p95 change of every route measured in both runs and
+    returns the routes slower than `tolerance` (e.g. 0.1 for 10%).
+    """
+    regressions = []
+    for size, result in current["results"].items():
+        for name, stats in result["routes"].items():
+            before = previous["results"].get(size, {}) \
+                                        .get("routes", {}).get(name)
+            if not before or not before["p95_ms"]:
+                continue
+            change = stats["p95_ms"] / before["p95_ms"] - 1
+            flag = " REGRESSION" if change > tolerance else ""
+            print(f"{size:>9} {name:<22} p95 {before['p95_ms']:>8} -> "
+                  f"{stats['p95_ms']:>8} ms ({change:+.1%}){flag}")
+            if flag:
+                regressions.append((size, name))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10000, 100000, 1000000])
+    parser.add_argument("--requests", type=int, default=200,
+                        help="timed requests per route and size")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", choices=["wsgi", "asgi"], default="wsgi")
+    parser.add_argument("--config", type=json.loads, default={},
+                        help="JSON object of create_app settings")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="a previous result file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="p95 slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    current = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mode": args.mode,
+            "requests": args.requests,
+            "seed": args.seed,
+            "config": args.config,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": {
+            str(size): run_size(size, args) for size in args.sizes
+        }
+    }
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(current, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as previous:
+            regressions = compare(json.load(previous), current,
+                                  args.tolerance)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
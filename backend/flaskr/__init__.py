@@ -1,27 +1,83 @@
-from flask import Flask, request, abort, jsonify
+from flask import Flask, request, abort, jsonify, g, stream_with_context
 from flask_cors import CORS
-import random
-
-from models import setup_db, Question, Category
-
-QUESTIONS_PER_PAGE = 10
-
-
-def paginate_questions(request, questions):
-    page = request.args.get("page", 1, type=int)
-    start = (page-1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-
-    questions = [question.format() for question in questions]
-    current_questions = questions[start:end]
-
-    return current_questions
+from werkzeug.exceptions import HTTPException
+
+from models import db, profile_settings, read_only, register_question_listener
+from .admission import AdmissionControl, DeadlineExceeded, Rejection
+from .batch import BATCH_ENDPOINTS, batch_body, request_key
+from .bulk import read_csv, read_ndjson
+from .caching import DataVersion
+from .compression import (
+    choose_encoding, compress, encoded_etag, etag_variants
+)
+from .config import load_config
+from .groupcommit import WriteQueueFull
+from .profiling import (
+    PROFILE_HEADER, PROFILE_MODES, TOKEN_HEADER, QueryLog, RequestProfiler,
+    authorized
+)
+from .metrics import (
+    Metrics, PROMETHEUS_CONTENT_TYPE, start_request, finish_request
+)
+from .serialization import FastJSONProvider
+from .sessions import MemoryQuizSessionStore
+from .storage import create_store
+from .validation import (
+    ValidationError, bool_argument, export_arguments, page_arguments,
+    question_fields, suggest_arguments, query_stats_arguments,
+    validate_search, validate_question, validate_ids, validate_quiz,
+    validate_quiz_session, validate_deck, validate_batch, wants_minimal,
+    wants_counts, categories_response, category_counts, error_response
+)
+
+NDJSON_MIMETYPES = {"application/x-ndjson", "application/jsonl"}
+CSV_MIMETYPES = {"text/csv"}
+
+# GET endpoints answered with an ETag and `304 Not Modified`.
+CONDITIONAL_ENDPOINTS = {
+    "bootstrap",
+    "retrieve_categories",
+    "retrieve_questions",
+    "retrieve_questions_by_category",
+    "suggest_questions"
+}
+
+
+def requested_fields(request):
+    """
+    Reads the `fields` argument, responding 400 to an unknown field.
+    """
+    try:
+        return question_fields(request.args)
+    except ValidationError:
+        abort(400)
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    # The settings of the DB_PROFILE replace Flask's own defaults, e.g.
+    # DEBUG, unless the test_config sets them.
+    app.config.from_mapping(load_config(test_config))
+    if app.config["JSON_FAST_ENCODER"]:
+        app.json = FastJSONProvider(app)
+    store = create_store(app)
+    quiz_sessions = app.config["QUIZ_SESSION_STORE"] or MemoryQuizSessionStore(
+        ttl=app.config["QUIZ_SESSION_TTL"],
+        max_sessions=app.config["QUIZ_SESSION_MAX"]
+    )
+
+    data_version = DataVersion(
+        max_staleness=app.config["ETAG_MAX_STALENESS"]
+    )
+    register_question_listener(app, data_version.question_changed)
+
+    metrics = Metrics() if app.config["METRICS_ENABLED"] else None
+    app.extensions["metrics"] = metrics
+    admission = AdmissionControl.from_config(app.config, metrics)
+    query_log = QueryLog.from_config(app.config,
+                                     profile_settings(app.config))
+    app.extensions["query_log"] = query_log
 
     """
     @DONE: Set up CORS. Allow '*' for origins.
@@ -29,6 +85,135 @@ def create_app(test_config=None):
     """
     CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+    @app.before_request
+    def start_metrics():
+        '''
+        Starts counting the queries and time of the request.
+        '''
+        if metrics is not None:
+            start_request()
+
+    def rejected(rejection):
+        """
+        Returns the response refusing a request, with its Retry-After.
+        """
+        response = jsonify(error_response(rejection.status))
+        response.status_code = rejection.status
+        response.headers["Retry-After"] = str(rejection.retry_after)
+        return response
+
+    @app.before_request
+    def watch_queries():
+        '''
+        Records the queries of the app's engines in the query log, and
+        applies the request deadline to them.
+        '''
+        if "sqlalchemy" in app.extensions:
+            for engine in db.engines.values():
+                query_log.attach(engine)
+                admission.attach(engine)
+
+    @app.before_request
+    def admit_request():
+        '''
+        Admission control: refuses the request when its client is over
+        the rate limit or its endpoint has too many requests in flight,
+        and starts its deadline otherwise.
+        '''
+        rejection = admission.admit(request.endpoint, request.remote_addr)
+        if rejection is not None:
+            return rejected(rejection)
+        g.admitted = request._get_current_object(), request.endpoint
+
+    @app.teardown_request
+    def release_request(error):
+        # The sub-requests of a batch share `g` with the batch, and are
+        # torn down before it: only the admitted request itself, not a
+        # sub-request to the same endpoint, frees its slot.
+        admitted = g.get("admitted")
+        if admitted and admitted[0] is request._get_current_object():
+            admission.release(g.pop("admitted")[1])
+
+    @app.before_request
+    def start_profile():
+        '''
+        On-demand profiling: a request with an `X-Profile` header
+        (`cprofile` or `sample`) and the PROFILE_TOKEN in
+        `X-Profile-Token` is profiled, and answered with the report.
+        '''
+        mode = request.headers.get(PROFILE_HEADER)
+        if mode is None:
+            return None
+        if not authorized(request.headers.get(TOKEN_HEADER),
+                          app.config["PROFILE_TOKEN"]):
+            abort(403)
+        if mode not in PROFILE_MODES:
+            abort(400)
+
+        profiler = RequestProfiler(
+            mode, interval=app.config["PROFILE_SAMPLE_INTERVAL_MS"] / 1000
+        )
+        if not profiler.start():
+            # Another request of this worker is being profiled.
+            return jsonify(error_response(429)), 429
+        g.profiler = profiler
+
+    def shared(key, load):
+        """
+        Returns `load()`, computed once per request: the sub-requests of
+        a batch share the results.
+        """
+        results = g.setdefault("shared_results", {})
+        if key not in results:
+            results[key] = load()
+        return results[key]
+
+    @app.before_request
+    def before_request():
+        '''
+        Conditional requests: answers `304 Not Modified` without running
+        the view when the client already has the current version.
+        '''
+        if not (app.config["ETAG_ENABLED"] and
+                request.method == "GET" and
+                request.endpoint in CONDITIONAL_ENDPOINTS):
+            return None
+
+        g.etag = data_version.etag(request.path, request.query_string)
+
+        # The client may hold any encoding of the current version.
+        for etag in etag_variants(g.etag):
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+                response.set_etag(etag)
+                response.headers["Cache-Control"] = \
+                    app.config["CACHE_CONTROL"]
+                if app.config["COMPRESS_ENABLED"]:
+                    response.vary.add("Accept-Encoding")
+                return response
+
+    def compress_response(response):
+        '''
+        Compresses a JSON body of at least COMPRESS_MIN_SIZE bytes with
+        the best encoding the client accepts, and returns the encoding
+        used (None when the body is sent as is).
+        '''
+        if not (app.config["COMPRESS_ENABLED"] and
+                response.mimetype == "application/json" and
+                not response.is_streamed):
+            return None
+
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+        if encoding is None or "Content-Encoding" in response.headers or \
+                response.calculate_content_length() < \
+                app.config["COMPRESS_MIN_SIZE"]:
+            return None
+
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers["Content-Encoding"] = encoding
+        return encoding
+
     """
     @DONE: Use the after_request decorator to set Access-Control-Allow
     """
@@ -46,30 +231,96 @@ def create_app(test_config=None):
             "GET,PUT,POST,DELETE,OPTIONS"
         )
 
+        encoding = compress_response(response)
+
+        if "etag" in g and response.status_code == 200:
+            response.set_etag(encoded_etag(g.etag, encoding))
+            response.headers["Cache-Control"] = app.config["CACHE_CONTROL"]
+
+        stats = finish_request() if metrics is not None else None
+        if stats is not None:
+            # Streamed bodies have no length yet and are not counted.
+            metrics.record(stats, request.endpoint, request.method,
+                           response.status_code,
+                           response.calculate_content_length())
+            response.headers["Server-Timing"] = stats.server_timing()
+
         return response
 
+    @app.after_request
+    def send_profile(response):
+        '''
+        Replaces the response of a profiled request with the report;
+        runs before the hooks above.
+        '''
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return response
+
+        g.pop("etag", None)
+        report = app.response_class(profiler.stop(), mimetype="text/plain")
+        report.headers["X-Profile-Status"] = str(response.status_code)
+        return report
+
+    @app.route("/metrics", methods=["GET"])
+    def retrieve_metrics():
+        """
+        Exposes the request metrics in the Prometheus text format.
+        """
+        if metrics is None:
+            abort(404)
+
+        return app.response_class(metrics.render(),
+                                  content_type=PROMETHEUS_CONTENT_TYPE)
+
+    @app.route("/admin/queries", methods=["GET"])
+    def retrieve_query_stats():
+        """
+        Lists the query fingerprints taking the most time, for the
+        holders of PROFILE_TOKEN.
+        """
+        if not authorized(request.headers.get(TOKEN_HEADER),
+                          app.config["PROFILE_TOKEN"]):
+            abort(403)
+        try:
+            limit, sort = query_stats_arguments(request.args)
+        except ValidationError:
+            abort(400)
+
+        return jsonify({
+            "success": True,
+            "slow_query_ms": query_log.slow_query_ms,
+            "untracked_calls": query_log.untracked_calls,
+            "queries": query_log.top(limit, sort)
+        })
+
     """
     @DONE:
     Create an endpoint to handle GET requests
     for all available categories.
     """
     @app.route("/categories", methods=["GET"])
+    @read_only
     def retrieve_categories():
         """
         Fetches a dictionary of categories in which the keys are the ids and
-        the value is the corresponding string of the category.
+        the value is the corresponding string of the category. With
+        `?counts=true` the number of questions of each category is added.
         """
-        categories = Category.query.order_by(Category.type).all()
+        categories = shared("categories", store.categories)
 
         if len(categories) == 0:
             abort(404)
 
-        return jsonify({
+        result = {
             "success": True,
-            "categories": {
-                category.id: category.type for category in categories
-            }
-        })
+            "categories": categories_response(categories)
+        }
+        if wants_counts(request.args):
+            result["counts"] = category_counts(categories,
+                                               store.category_counts())
+
+        return jsonify(result)
 
     """
     @DONE:
@@ -85,24 +336,48 @@ def create_app(test_config=None):
     Clicking on the page numbers should update the questions.
     """
     @app.route("/questions", methods=["GET"])
+    @read_only
     def retrieve_questions():
         """
         Fetches a list of questions paginated by 10 items per page.
+        `?fields=` picks the question fields to return, and
+        `?include_categories=false` leaves out the categories.
         """
-        questions = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, questions)
-        categories = Category.query.order_by(Category.type).all()
+        fields = requested_fields(request)
+        current_questions = store.page(page_arguments(request.args),
+                                       fields=fields)
 
-        if len(current_questions) == 0:
+        if len(current_questions["questions"]) == 0:
             abort(404)
 
+        result = {
+            "success": True,
+            **current_questions,
+            "current_category": None
+        }
+        if bool_argument(request.args, "include_categories", True):
+            result["categories"] = categories_response(
+                shared("categories", store.categories)
+            )
+
+        return jsonify(result)
+
+    @app.route("/bootstrap", methods=["GET"])
+    @read_only
+    def bootstrap():
+        """
+        Fetches what the frontend loads first in one response: the
+        categories with their question counts and a page of questions
+        (the first one unless paginated like GET /questions).
+        """
+        fields = requested_fields(request)
+        categories = shared("categories", store.categories)
+
         return jsonify({
             "success": True,
-            "questions": current_questions,
-            "total_questions": len(questions),
-            "categories": {
-                category.id: category.type for category in categories
-            },
+            "categories": categories_response(categories),
+            "counts": category_counts(categories, store.category_counts()),
+            **store.page(page_arguments(request.args), fields=fields),
             "current_category": None
         })
 
@@ -117,31 +392,60 @@ def create_app(test_config=None):
     @app.route("/questions/<int:question_id>", methods=["DELETE"])
     def delete_question(question_id):
         """
-        Delete the question using the question ID.
+        Delete the question using the question ID. With
+        `?return=minimal` the page of remaining questions is not sent.
         """
         try:
-            question = Question.query \
-                                .filter(Question.id == question_id) \
-                                .one_or_none()
-
-            if question is None:
+            if store.delete(question_id) is None:
                 abort(404)
 
-            question.delete()
+            if wants_minimal(request.args):
+                return jsonify({
+                    "success": True,
+                    "deleted_question_id": question_id
+                })
 
-            questions = Question.query.order_by(Question.id).all()
-            current_questions = paginate_questions(request, questions)
+            current_questions = store.page(page_arguments(request.args))
 
             return jsonify({
                 "success": True,
                 "deleted_question_id": question_id,
-                "questions": current_questions,
-                "total_questions": len(questions)
+                **current_questions
             })
 
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            abort(422)
+
+    @app.route("/questions/bulk", methods=["DELETE"])
+    def delete_many_questions():
+        """
+        Delete a list of questions in one transaction.
+        """
+        try:
+            question_ids = validate_ids(request.get_json(),
+                                        app.config["BULK_DELETE_MAX_IDS"])
+        except ValidationError:
+            abort(422)
+
+        try:
+            deleted = store.delete_many(question_ids)
+        except DeadlineExceeded:
+            raise
         except Exception:
             abort(422)
 
+        deleted_ids = {question["id"] for question in deleted}
+
+        return jsonify({
+            "success": True,
+            "deleted": [question_id for question_id in question_ids
+                        if question_id in deleted_ids],
+            "not_found": [question_id for question_id in question_ids
+                          if question_id not in deleted_ids]
+        })
+
     """
     @DONE:
     Create an endpoint to POST a new question,
@@ -156,42 +460,87 @@ def create_app(test_config=None):
     @app.route("/questions", methods=["POST"])
     def create_question():
         """
-        Create a new question.
+        Create a new question. With `?return=minimal` the total number
+        of questions is not sent.
         """
-        body = request.get_json()
-
-        if not ("question" in body and
-                "answer" in body and
-                "difficulty" in body and
-                "category" in body):
+        try:
+            fields = validate_question(request.get_json())
+        except ValidationError:
+            abort(422)
+        # SQLite does not enforce the foreign key.
+        if store.category(fields["category"]) is None:
             abort(422)
 
-        question = body.get("question", None)
-        answer = body.get("answer", None)
-        difficulty = body.get("difficulty", None)
-        category = body.get("category", None)
-
-        questions = Question.query.order_by(Question.id).all()
+        minimal = wants_minimal(request.args)
+        total_questions = store.total() if not minimal else None
 
         try:
-            question = Question(
-                            question=question,
-                            answer=answer,
-                            difficulty=difficulty,
-                            category=category
-                        )
-            question.insert()
+            question = store.insert(fields)
+
+            if minimal:
+                return jsonify({
+                    "success": True,
+                    "created_question_id": question["id"],
+                    "created_question_text": question["question"]
+                })
 
             return jsonify({
                 "success": True,
-                "created_question_id": question.id,
-                "created_question_text": question.question,
-                "total_questions": len(questions)
+                "created_question_id": question["id"],
+                "created_question_text": question["question"],
+                "total_questions": total_questions
             })
 
+        except (DeadlineExceeded, WriteQueueFull):
+            raise
         except Exception:
             abort(422)
 
+    @app.route("/questions/bulk", methods=["POST"])
+    def import_questions():
+        """
+        Create questions from a streamed NDJSON or CSV body.
+        """
+        lines = (line.decode("utf-8", "replace") for line in request.stream)
+
+        if request.mimetype in NDJSON_MIMETYPES:
+            rows = read_ndjson(lines)
+        elif request.mimetype in CSV_MIMETYPES:
+            rows = read_csv(lines)
+        else:
+            abort(415)
+
+        report = store.import_rows(rows)
+
+        return jsonify({
+            "success": True,
+            **report
+        })
+
+    @app.route("/questions/export", methods=["GET"])
+    @read_only
+    def export_all_questions():
+        """
+        Streams every question as NDJSON (default) or CSV, optionally
+        filtered by category and id range.
+        """
+        try:
+            export_format, category, min_id, max_id = \
+                export_arguments(request.args)
+        except ValidationError:
+            abort(400)
+
+        response = app.response_class(
+            stream_with_context(store.export(export_format, category,
+                                             min_id, max_id)),
+            mimetype=("text/csv" if export_format == "csv"
+                      else "application/x-ndjson")
+        )
+        response.headers["Content-Disposition"] = \
+            f"attachment; filename=questions.{export_format}"
+
+        return response
+
     """
     @DONE:
     Create a POST endpoint to get questions based on a search term.
@@ -203,32 +552,54 @@ def create_app(test_config=None):
     Try using the word "title" to start.
     """
     @app.route("/questions/search", methods=["POST"])
+    @read_only
     def search_questions():
         """
-        Search a question based on a search term.
+        Search a question based on a search term. Results are ranked by
+        relevance when served from the search index.
         """
-        body = request.get_json()
-        search = body.get("searchTerm", None)
+        try:
+            search = validate_search(request.get_json())
+        except ValidationError:
+            abort(422)
+        fields = requested_fields(request)
 
         try:
-            if search:
-                questions = Question.query \
-                                    .order_by(Question.id) \
-                                    .filter(
-                                        Question.question.ilike(f"%{search}%")
-                                    ).all()
-                current_questions = paginate_questions(request, questions)
+            current_questions = store.search(search,
+                                             page_arguments(request.args),
+                                             fields)
 
-                return jsonify({
-                    "success": True,
-                    "questions": current_questions,
-                    "total_questions": len(questions),
-                    "current_category": None
-                })
+            return jsonify({
+                "success": True,
+                **current_questions,
+                "current_category": None
+            })
 
+        except DeadlineExceeded:
+            raise
         except Exception:
             abort(404)
 
+    @app.route("/questions/suggest", methods=["GET"])
+    @read_only
+    def suggest_questions():
+        """
+        Suggest-as-you-type: completes the last word of `?prefix=` and
+        fetches the first questions matching it, from the prefix index.
+        """
+        try:
+            prefix, limit = suggest_arguments(request.args,
+                                              app.config["SUGGEST_LIMIT"],
+                                              app.config["SUGGEST_MAX_LIMIT"])
+        except ValidationError:
+            abort(400)
+
+        return jsonify({
+            "success": True,
+            "prefix": prefix,
+            **store.suggest(prefix, limit)
+        })
+
     """
     @DONE:
     Create a GET endpoint to get questions based on category.
@@ -238,34 +609,28 @@ def create_app(test_config=None):
     category to be shown.
     """
     @app.route("/categories/<int:category_id>/questions", methods=["GET"])
+    @read_only
     def retrieve_questions_by_category(category_id):
         """
         Fetches a list of questions paginated by 10 items per page
         based on the category.
         """
-        category = Category.query \
-                           .filter(Category.id == category_id) \
-                           .one_or_none()
-
-        if category is None:
-            abort(404)
+        fields = requested_fields(request)
 
-        questions_in_cat = Question.query \
-                                   .order_by(Question.id) \
-                                   .filter(
-                                    Question.category == str(category_id)
-                                    ).all()
+        category = shared(("category", category_id),
+                          lambda: store.category(category_id))
 
-        if questions_in_cat is None:
+        if category is None:
             abort(404)
 
-        current_questions = paginate_questions(request, questions_in_cat)
+        current_questions = store.page(page_arguments(request.args),
+                                       category_id,
+                                       fields)
 
         return jsonify({
             "success": True,
-            "category": category.type,
-            "questions": current_questions,
-            "total_questions": len(questions_in_cat)
+            "category": category,
+            **current_questions
         })
 
     """
@@ -280,53 +645,145 @@ def create_app(test_config=None):
     and shown whether they were correct or not.
     """
     @app.route("/quizzes", methods=["POST"])
+    @read_only
     def add_quiz():
         """
         Fetches a question to play the quiz.
         """
-        body = request.get_json()
+        try:
+            category, previous_questions = validate_quiz(request.get_json())
+        except ValidationError:
+            abort(422)
+
+        try:
+            question = store.sample(category, previous_questions)
+
+            return jsonify({
+                "success": True,
+                "question": question
+            })
+
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            abort(422)
+
+    @app.route("/quizzes/deck", methods=["POST"])
+    @read_only
+    def deal_quiz_deck():
+        """
+        Fetches a deck of distinct random questions to play a whole quiz
+        in one request.
+        """
+        try:
+            category, size, excluded, seed = validate_deck(
+                request.get_json(), app.config["QUIZ_DECK_MAX_SIZE"]
+            )
+        except ValidationError:
+            abort(422)
+
+        questions = store.deal(size, category, excluded, seed)
+
+        return jsonify({
+            "success": True,
+            "questions": questions,
+            "total_questions": len(questions),
+            "seed": seed
+        })
 
-        if not ("quiz_category" in body and "previous_questions" in body):
+    @app.route("/quizzes/sessions", methods=["POST"])
+    def start_quiz_session():
+        """
+        Starts a quiz game kept on the server and returns its token.
+        """
+        try:
+            category = validate_quiz_session(request.get_json())
+        except ValidationError:
             abort(422)
 
-        quiz_category = body.get("quiz_category", None)
-        previous_questions = body.get("previous_questions", None)
+        session = quiz_sessions.create(category)
 
+        return jsonify({
+            "success": True,
+            "session_token": session.token
+        })
+
+    @app.route("/quizzes/sessions/<token>/next", methods=["POST"])
+    @read_only
+    def next_quiz_session_question(token):
+        """
+        Fetches a question of the quiz game that has not been played yet.
+        """
         try:
-            if quiz_category["id"]:
-                quiz_questions = Question.query \
-                                         .filter_by(
-                                            category=quiz_category['id']
-                                         ) \
-                                         .filter(Question.id.not_in((
-                                                    previous_questions
-                                         ))).all()
-            else:
-                quiz_questions = Question.query \
-                                         .filter(Question.id.not_in((
-                                                    previous_questions
-                                         ))).all()
-
-            if len(quiz_questions) > 0:
-                question = quiz_questions[
-                            random.randrange(0,
-                                             len(quiz_questions))
-                            ].format()
+            question = quiz_sessions.draw_next(token, store.sample)
+        except KeyError:
+            abort(404)
 
-                return jsonify({
-                    "success": True,
-                    "question": question
-                })
+        return jsonify({
+            "success": True,
+            "question": question
+        })
 
-            else:
-                return jsonify({
-                    "success": True,
-                    "question": None
-                })
+    @app.route("/quizzes/sessions/<token>", methods=["DELETE"])
+    def end_quiz_session(token):
+        """
+        Ends a quiz game.
+        """
+        if quiz_sessions.get(token) is None:
+            abort(404)
 
-        except Exception:
+        quiz_sessions.delete(token)
+
+        return jsonify({
+            "success": True,
+            "session_token": token
+        })
+
+    def dispatch_sub_request(method, path, body):
+        """
+        Runs a sub-request of a batch and returns its status and JSON
+        body. It runs in the app context of the batch, so it uses the
+        same database session and shared results.
+        """
+        with app.test_request_context(path, method=method, json=body):
+            try:
+                if request.routing_exception is not None:
+                    raise request.routing_exception
+                # POST /batch is not a batch endpoint, so batches do not
+                # nest.
+                if request.endpoint not in BATCH_ENDPOINTS:
+                    abort(400)
+                response = app.make_response(app.dispatch_request())
+            except HTTPException as error:
+                response = app.make_response(
+                    app.handle_http_exception(error)
+                )
+            return response.status_code, response.get_data()
+
+    @app.route("/batch", methods=["POST"])
+    @read_only
+    def batch():
+        """
+        Runs several read sub-requests in one call, identical ones once.
+        """
+        try:
+            sub_requests = validate_batch(request.get_json(),
+                                          app.config["BATCH_MAX_REQUESTS"])
+        except ValidationError:
             abort(422)
 
+        responses = {}
+        for sub_request in sub_requests:
+            key = request_key(*sub_request)
+            if key not in responses:
+                responses[key] = dispatch_sub_request(*sub_request)
+
+        return app.response_class(
+            batch_body(responses[request_key(*sub_request)]
+                       for sub_request in sub_requests),
+            mimetype="application/json"
+        )
+
     """
     @DONE:
     Create error handlers for all expected errors
@@ -334,42 +791,40 @@ def create_app(test_config=None):
     """
     @app.errorhandler(400)
     def bad_request(error):
-        return jsonify({
-            "success": False,
-            "error": 400,
-            "message": "Bad Request"
-        }), 400
+        return jsonify(error_response(400)), 400
+
+    @app.errorhandler(403)
+    def forbidden(error):
+        return jsonify(error_response(403)), 403
 
     @app.errorhandler(404)
     def not_found(error):
-        return jsonify({
-            "success": False,
-            "error": 404,
-            "message": "Resource Not Found"
-        }), 404
+        return jsonify(error_response(404)), 404
 
     @app.errorhandler(405)
     def method_not_allowed(error):
-        return jsonify({
-            "success": False,
-            "error": 405,
-            "message": "Method Not Allowed"
-        }), 405
+        return jsonify(error_response(405)), 405
+
+    @app.errorhandler(415)
+    def unsupported_media_type(error):
+        return jsonify(error_response(415)), 415
 
     @app.errorhandler(422)
     def unprocessable(error):
-        return jsonify({
-            "success": False,
-            "error": 422,
-            "message": "Unprocessable resource"
-        }), 422
+        return jsonify(error_response(422)), 422
 
     @app.errorhandler(500)
     def internal_server(error):
-        return jsonify({
-            "success": False,
-            "error": 500,
-            "message": "Internal server error"
-        }), 500
+        return jsonify(error_response(500)), 500
+
+    @app.errorhandler(DeadlineExceeded)
+    def deadline_exceeded(error):
+        return rejected(admission.deadline_exceeded(request.endpoint))
+
+    @app.errorhandler(WriteQueueFull)
+    def write_queue_full(error):
+        return rejected(admission.shed(request.endpoint,
+                                       Rejection(503, "write_queue",
+                                                 admission.retry_after)))
 
     return app
@@ -0,0 +1,275 @@
+"""
+Admission control shared by the WSGI (Flask) and ASGI applications:
+when the server is overloaded, requests fail fast instead of queueing
+for a database connection.
+
+- `ConcurrencyLimits` caps the requests of an endpoint in flight at
+  once. The requests over the cap are answered `503`.
+- `RateLimiter` gives each client a token bucket. A request from a
+  client whose bucket is empty is answered `429`.
+- A request deadline bounds the time its queries may take. Each
+  transaction gets the time left as its PostgreSQL `statement_timeout`
+  (SQLite queries are interrupted instead), and a query that fails or
+  starts after the deadline raises `DeadlineExceeded`, answered `503`.
+  It only applies to the engines attached with `AdmissionControl.attach`,
+  and only when a deadline is configured.
+
+The rejections carry a `Retry-After` header and are counted in the
+metrics as shed requests.
+"""
+import math
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# SQLSTATE of a statement cancelled by statement_timeout.
+QUERY_CANCELED = "57014"
+
+# Endpoints admission control never refuses.
+EXEMPT_ENDPOINTS = frozenset({"retrieve_metrics", "retrieve_query_stats"})
+# Endpoints streaming the whole table, which get no deadline.
+STREAMING_ENDPOINTS = frozenset({"import_questions", "export_all_questions"})
+
+_deadline = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """
+    The request ran out of time for its queries (503).
+    """
+
+
+class Rejection:
+    """
+    Why a request was not admitted: the status to answer, the reason
+    counted in the metrics and the seconds to send in Retry-After.
+    """
+
+    __slots__ = ("status", "reason", "retry_after")
+
+    def __init__(self, status, reason, retry_after):
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+
+
+class ConcurrencyLimits:
+    """
+    Counts the requests in flight per endpoint, refusing a request once
+    its endpoint has reached its limit. Endpoints without a limit are
+    not counted.
+    """
+
+    def __init__(self, limits):
+        self.limits = dict(limits or {})
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint):
+        """
+        Takes a slot of the endpoint, or returns False when none is free.
+        """
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return True
+        with self._lock:
+            in_flight = self._in_flight.get(endpoint, 0)
+            if in_flight >= limit:
+                return False
+            self._in_flight[endpoint] = in_flight + 1
+            return True
+
+    def release(self, endpoint):
+        if endpoint not in self.limits:
+            return
+        with self._lock:
+            self._in_flight[endpoint] = \
+                max(self._in_flight.get(endpoint, 0) - 1, 0)
+
+    def in_flight(self, endpoint):
+        with self._lock:
+            return self._in_flight.get(endpoint, 0)
+
+
+class RateLimiter:
+    """
+    A token bucket per client, refilled at `rate` tokens per second up
+    to `burst` tokens.
+
+    At most `max_clients` buckets are kept; the least recently seen
+    client is forgotten first, and starts again with a full bucket.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """
+        Takes a token of the client. Returns 0 when it got one,
+        otherwise the seconds until the next token.
+        """
+        now = time.monotonic()
+        with self._lock:
+            # Popped and set again to keep the dict in LRU order.
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                del self._buckets[next(iter(self._buckets))]
+            return wait
+
+
+class AdmissionControl:
+    """
+    The admission checks of one application. `admit` is called before
+    the view with the endpoint name and the client address, and
+    `release` once the response is sent when the request was admitted.
+    """
+
+    def __init__(self, concurrency_limits=None, rate=None, burst=None,
+                 max_clients=10000, deadline_ms=None, retry_after=1,
+                 metrics=None):
+        self.concurrency = ConcurrencyLimits(concurrency_limits)
+        self.rate_limiter = RateLimiter(
+            rate, burst or max(rate, 1), max_clients
+        ) if rate else None
+        self.deadline_ms = deadline_ms
+        self.retry_after = retry_after
+        self.metrics = metrics
+
+    @classmethod
+    def from_config(cls, config, metrics=None):
+        return cls(concurrency_limits=config["ROUTE_CONCURRENCY_LIMITS"],
+                   rate=config["RATE_LIMIT_PER_SECOND"],
+                   burst=config["RATE_LIMIT_BURST"],
+                   max_clients=config["RATE_LIMIT_MAX_CLIENTS"],
+                   deadline_ms=config["REQUEST_DEADLINE_MS"],
+                   retry_after=config["SHED_RETRY_AFTER"],
+                   metrics=metrics)
+
+    def admit(self, endpoint, client):
+        """
+        Returns None when the request may run, and starts its deadline,
+        or returns its `Rejection`.
+        """
+        if endpoint in EXEMPT_ENDPOINTS:
+            return None
+
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.take(client)
+            if wait:
+                return self.shed(endpoint, Rejection(429, "rate_limit", wait))
+
+        if not self.concurrency.acquire(endpoint):
+            return self.shed(endpoint, Rejection(503, "concurrency",
+                                                 self.retry_after))
+
+        if endpoint not in STREAMING_ENDPOINTS:
+            start_deadline(self.deadline_ms)
+        return None
+
+    def attach(self, engine):
+        """
+        Applies the request deadline to the queries of an engine (once),
+        when a deadline is configured.
+        """
+        if not self.deadline_ms or \
+                event.contains(engine, "before_cursor_execute",
+                               _apply_deadline):
+            return
+        event.listen(engine, "before_cursor_execute", _apply_deadline)
+        event.listen(engine, "commit", _end_transaction)
+        event.listen(engine, "rollback", _end_transaction)
+        event.listen(engine, "handle_error", _raise_deadline_exceeded)
+        event.listen(engine.pool, "checkout", _interrupt_after_deadline)
+
+    def release(self, endpoint):
+        """
+        Frees the slot and ends the deadline of an admitted request.
+        """
+        clear_deadline()
+        if endpoint not in EXEMPT_ENDPOINTS:
+            self.concurrency.release(endpoint)
+
+    def deadline_exceeded(self, endpoint):
+        """
+        Returns the `Rejection` of a request that ran out of time.
+        """
+        return self.shed(endpoint, Rejection(503, "deadline",
+                                             self.retry_after))
+
+    def shed(self, endpoint, rejection):
+        if self.metrics is not None:
+            self.metrics.record_shed(endpoint, rejection.reason)
+        return rejection
+
+
+def start_deadline(timeout_ms):
+    """
+    Gives the current request `timeout_ms` milliseconds for its queries
+    (None: no deadline).
+    """
+    _deadline.set(time.monotonic() + timeout_ms / 1000
+                  if timeout_ms else None)
+
+
+def clear_deadline():
+    _deadline.set(None)
+
+
+def _deadline_passed():
+    deadline = _deadline.get()
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _apply_deadline(conn, cursor, statement, parameters, context,
+                    executemany):
+    deadline = _deadline.get()
+    if deadline is None:
+        return
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+
+    # Once per transaction: SET LOCAL lasts until it ends.
+    if conn.dialect.name == "postgresql" and \
+            conn.info.get("statement_deadline") != deadline:
+        cursor.execute("SET LOCAL statement_timeout = "
+                       f"{max(int(remaining * 1000), 1)}")
+        conn.info["statement_deadline"] = deadline
+
+
+def _end_transaction(conn):
+    conn.info.pop("statement_deadline", None)
+
+
+def _interrupt_after_deadline(dbapi_connection, connection_record,
+                              connection_proxy):
+    # SQLite has no statement timeout, but calls a progress handler
+    # every N virtual machine instructions and interrupts the query
+    # when it returns true. Set on checkout, so the connections opened
+    # before the engine was attached get it too.
+    if hasattr(dbapi_connection, "set_progress_handler"):
+        dbapi_connection.set_progress_handler(_deadline_passed, 1000)
+
+
+def _raise_deadline_exceeded(context):
+    error = context.original_exception
+    if _deadline.get() is None or isinstance(error, DeadlineExceeded):
+        return
+    sqlstate = getattr(error, "pgcode", None) or \
+        getattr(error, "sqlstate", None)
+    if sqlstate == QUERY_CANCELED or \
+            (str(error) == "interrupted" and _deadline_passed()):
+        raise DeadlineExceeded() from error
@@ -0,0 +1,1166 @@
+"""
+create_asgi_app(test_config)
+    an ASGI (Starlette) application serving the same routes and JSON
+    contracts as create_app, on SQLAlchemy async sessions over asyncpg
+    (PostgreSQL) or aiosqlite (SQLite). Run it with
+
+        uvicorn --factory flaskr.asgi:create_asgi_app
+
+    The views call the same `QuestionStore` (flaskr/storage.py) as the
+    Flask views, with the same request validation and error responses:
+    the database store runs its queries on the sync session of an async
+    session, in its `run_sync`, and the STORAGE_BACKEND "memory" needs
+    no database at all.
+"""
+import asyncio
+import csv
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Match, Route
+
+from migrations import migrate
+from models import (
+    DB_PATH, DB_REPLICA_PATH, engine_options, profile_settings
+)
+from .admission import AdmissionControl, DeadlineExceeded, Rejection
+from .batch import BATCH_ENDPOINTS, batch_body, request_key
+from .bulk import read_csv, read_ndjson
+from .caching import DataVersion
+from .compression import (
+    choose_encoding, compress, encoded_etag, etag_variants
+)
+from .config import load_config
+from .groupcommit import GroupCommitWriter, WriteQueueFull
+from .metrics import (
+    Metrics, PROMETHEUS_CONTENT_TYPE, start_request, finish_request
+)
+from .profiling import (
+    PROFILE_HEADER, PROFILE_MODES, TOKEN_HEADER, QueryLog, RequestProfiler,
+    authorized
+)
+from .serialization import dumps
+from .sessions import MemoryQuizSessionStore
+from .storage import (
+    DatabaseQuestionStore, create_memory_store, storage_backend
+)
+from .validation import (
+    ERROR_MESSAGES, ValidationError, bool_argument, export_arguments,
+    page_arguments, question_fields, suggest_arguments,
+    query_stats_arguments, validate_search, validate_question,
+    validate_ids, validate_quiz, validate_quiz_session, validate_deck,
+    validate_batch, wants_minimal, wants_counts, categories_response,
+    category_counts, error_response
+)
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MIMETYPES = {"application/x-ndjson", "application/jsonl"}
+CSV_MIMETYPES = {"text/csv"}
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite"
+}
+
+
+def async_database_url(database_path):
+    """
+    Switches a database URL to the async driver of its backend.
+    """
+    scheme, rest = database_path.split("://", 1)
+    backend = scheme.split("+")[0]
+    return f"{ASYNC_DRIVERS.get(backend, scheme)}://{rest}"
+
+
+def async_engine_options(database_path, settings):
+    """
+    Returns the create_async_engine arguments for a database and profile.
+    """
+    options = engine_options(database_path, settings)
+    if "connect_args" in options:
+        # asyncpg takes server settings instead of libpq options.
+        options["connect_args"] = {
+            "server_settings": {
+                "statement_timeout":
+                    str(int(settings["DB_STATEMENT_TIMEOUT_MS"]))
+            }
+        }
+    return options
+
+
+def json_response(content, status_code=200):
+    return Response(
+        dumps(content) + b"\n",
+        status_code=status_code,
+        media_type="application/json"
+    )
+
+
+def mimetype(request):
+    return request.headers.get("content-type", "").split(";")[0].strip()
+
+
+async def read_json(request):
+    """
+    Returns the JSON body of a request, or responds with 400 like
+    Flask's `request.get_json()`.
+    """
+    if mimetype(request) != "application/json":
+        raise HTTPException(400)
+    try:
+        return json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(400)
+
+
+async def request_lines(request):
+    """
+    Yields the lines of a streamed request body.
+    """
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield (line + b"\n").decode("utf-8", "replace")
+    if pending:
+        yield pending.decode("utf-8", "replace")
+
+
+def fields_argument(args):
+    """
+    Reads the `fields` argument, responding 400 to an unknown field.
+    """
+    try:
+        return question_fields(args)
+    except ValidationError:
+        raise HTTPException(400)
+
+
+def if_none_match(request):
+    """
+    Returns the strong entity tags of the If-None-Match header.
+    """
+    header = request.headers.get("if-none-match", "")
+    return {
+        tag.strip().strip('"')
+        for tag in header.split(",")
+        if tag.strip() and not tag.strip().startswith("W/")
+    }
+
+
+class CORSHeaders:
+    """
+    Adds the same Access-Control-Allow headers as create_app's
+    after_request hook.
+    """
+
+    HEADERS = [
+        (b"access-control-allow-headers", b"Content-Type,Authorization,true"),
+        (b"access-control-allow-methods", b"GET,PUT,POST,DELETE,OPTIONS")
+    ]
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + \
+                                     self.HEADERS
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+class CompressJSON:
+    """
+    Compresses JSON bodies of at least `min_size` bytes like create_app's
+    after_request hook, suffixing their ETag with the encoding.
+    """
+
+    def __init__(self, app, min_size=1024):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        accept_encoding = dict(scope["headers"]).get(b"accept-encoding", b"")
+        encoding = choose_encoding(accept_encoding.decode("latin-1"))
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", []))
+                if headers.get(b"content-type", b"") \
+                        .startswith(b"application/json"):
+                    # Held until the body shows whether to compress.
+                    start = message
+                    return
+            elif start is not None:
+                message = self.compress(start, message, encoding)
+                await send(start)
+                start = None
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+    def compress(self, start, message, encoding):
+        headers = dict(start["headers"])
+        vary = headers.get(b"vary")
+        headers[b"vary"] = vary + b", Accept-Encoding" if vary \
+            else b"Accept-Encoding"
+        body = message.get("body", b"")
+
+        if encoding is not None and not message.get("more_body") and \
+                len(body) >= self.min_size and \
+                b"content-encoding" not in headers:
+            body = compress(body, encoding)
+            message = {**message, "body": body}
+            headers[b"content-encoding"] = encoding.encode()
+            headers[b"content-length"] = str(len(body)).encode()
+            if b"etag" in headers:
+                etag = headers[b"etag"].decode().strip('"')
+                headers[b"etag"] = \
+                    f'"{encoded_etag(etag, encoding)}"'.encode()
+
+        start["headers"] = list(headers.items())
+        return message
+
+
+class Admission:
+    """
+    Admission control, like create_app's admit_request hook. The
+    endpoint is found by matching the routes, since the middleware runs
+    before the router.
+    """
+
+    def __init__(self, app, admission, routes):
+        self.app = app
+        self.admission = admission
+        self.routes = routes
+
+    def endpoint(self, scope):
+        for route in self.routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                return child_scope["endpoint"].__name__
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        endpoint = self.endpoint(scope)
+        client = scope.get("client")
+        rejection = self.admission.admit(endpoint,
+                                         client[0] if client else None)
+        if rejection is not None:
+            response = rejected(rejection)
+            return await response(scope, receive, send)
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release(endpoint)
+
+
+def rejected(rejection):
+    """
+    Returns the response refusing a request, with its Retry-After.
+    """
+    response = json_response(error_response(rejection.status),
+                             rejection.status)
+    response.headers["retry-after"] = str(rejection.retry_after)
+    return response
+
+
+class RequestMetrics:
+    """
+    Records the request metrics and adds the Server-Timing header, like
+    create_app's request hooks.
+    """
+
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = start_request()
+        response = {"status": 500, "bytes": 0}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", stats.server_timing().encode())
+                ]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            finish_request()
+            endpoint = scope.get("endpoint")
+            self.metrics.record(stats,
+                                getattr(endpoint, "__name__", None),
+                                scope["method"],
+                                response["status"],
+                                response["bytes"])
+
+
+class Profile:
+    """
+    On-demand profiling, like create_app's start_profile and send_profile
+    hooks: a request with an `X-Profile` header (`cprofile` or `sample`)
+    and the PROFILE_TOKEN in `X-Profile-Token` is answered with the
+    report. The profiler runs on the thread of the event loop, so the
+    report also shows the other requests the worker served meanwhile.
+    """
+
+    def __init__(self, app, token, interval):
+        self.app = app
+        self.token = token
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = Headers(scope=scope)
+        mode = headers.get(PROFILE_HEADER)
+        if mode is None:
+            return await self.app(scope, receive, send)
+
+        if not authorized(headers.get(TOKEN_HEADER), self.token):
+            response = json_response(error_response(403), 403)
+        elif mode not in PROFILE_MODES:
+            response = json_response(error_response(400), 400)
+        else:
+            response = await self.profile(mode, scope, receive)
+        await response(scope, receive, send)
+
+    async def profile(self, mode, scope, receive):
+        profiler = RequestProfiler(mode, interval=self.interval)
+        if not profiler.start():
+            # Another request of this worker is being profiled.
+            return json_response(error_response(429), 429)
+
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            report = profiler.stop()
+
+        response = Response(report, media_type="text/plain")
+        response.headers["x-profile-status"] = str(status)
+        return response
+
+
+def create_asgi_app(test_config=None, database_path=None):
+    started = time.perf_counter()
+    # create and configure the app
+    config = load_config(test_config)
+    settings = profile_settings(config)
+    database_path = database_path or DB_PATH
+    replica_path = config.get("DB_REPLICA_PATH", DB_REPLICA_PATH)
+    state = {"last_write": 0}
+
+    quiz_sessions = config["QUIZ_SESSION_STORE"] or MemoryQuizSessionStore(
+        ttl=config["QUIZ_SESSION_TTL"],
+        max_sessions=config["QUIZ_SESSION_MAX"]
+    )
+    data_version = DataVersion(max_staleness=config["ETAG_MAX_STALENESS"])
+    metrics = Metrics() if config["METRICS_ENABLED"] else None
+    admission = AdmissionControl.from_config(config, metrics)
+    query_log = QueryLog.from_config(config, settings)
+
+    listeners = [data_version.question_changed]
+
+    def question_changed(event, question=None):
+        state["last_write"] = time.monotonic()
+        for listener in listeners:
+            listener(event, question)
+
+    # The tasks left running after their request, kept until done.
+    background_tasks = set()
+
+    def run_in_background(coroutine):
+        task = asyncio.create_task(coroutine)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    def reload_in_background(reload):
+        """
+        Runs the `reload(session)` of an in-memory index in a task of its
+        own, so that no request waits for it.
+        """
+        async def run():
+            try:
+                async with Session() as session:
+                    await session.run_sync(reload)
+            except Exception:
+                logger.exception("index reload failed")
+
+        run_in_background(run())
+
+    engine = replica_engine = writer_engine = writer = None
+    Session = ReplicaSession = None
+
+    if storage_backend(config) == "memory":
+        store = create_memory_store(config, question_changed)
+    else:
+        engine = create_async_engine(
+            async_database_url(database_path),
+            echo=settings["SQLALCHEMY_ECHO"],
+            **async_engine_options(database_path, settings)
+        )
+        Session = sessionmaker(engine, class_=AsyncSession,
+                               expire_on_commit=False)
+        replica_engine = create_async_engine(
+            async_database_url(replica_path),
+            echo=settings["SQLALCHEMY_ECHO"],
+            **async_engine_options(replica_path, settings)
+        ) if replica_path else None
+        ReplicaSession = sessionmaker(
+            replica_engine, class_=AsyncSession, expire_on_commit=False
+        ) if replica_engine is not None else None
+
+        for async_engine in (engine, replica_engine):
+            if async_engine is not None:
+                query_log.attach(async_engine.sync_engine)
+                admission.attach(async_engine.sync_engine)
+
+        if config["GROUP_COMMIT_ENABLED"]:
+            # The writer thread runs outside the event loop, on a sync
+            # engine of its own.
+            writer_engine = create_engine(
+                database_path,
+                echo=settings["SQLALCHEMY_ECHO"],
+                **engine_options(database_path, settings)
+            )
+            query_log.attach(writer_engine)
+            writer = GroupCommitWriter.from_config(
+                config, sessionmaker(writer_engine), question_changed
+            )
+
+        store = DatabaseQuestionStore.from_config(
+            config, writer, question_changed, reload_in_background
+        )
+        listeners.extend(store.listeners)
+
+    def read_session():
+        """
+        Opens a session for a read-only request: on the replica if one is
+        configured, unless this worker wrote in the last
+        DB_REPLICA_STICKY_SECONDS.
+        """
+        sticky = settings["DB_REPLICA_STICKY_SECONDS"] or 0
+        if ReplicaSession is not None and \
+                time.monotonic() - state["last_write"] >= sticky:
+            return ReplicaSession()
+        return Session()
+
+    @asynccontextmanager
+    async def store_session(read=False):
+        """
+        Yields `call(method)`, which awaits `method(store)`: with the
+        database store, on the sync session of one async session (a read
+        session for `read`), in its `run_sync`; with the memory store,
+        directly.
+        """
+        if Session is None:
+            async def call(method):
+                return method(store)
+
+            yield call
+            return
+
+        async with (read_session() if read else Session()) as session:
+            async def call(method):
+                return await session.run_sync(
+                    lambda sync_session: method(store.using(sync_session))
+                )
+
+            yield call
+
+    async def run(method, read=False):
+        """
+        Awaits `method(store)` in a `store_session` of its own.
+        """
+        async with store_session(read) as call:
+            return await call(method)
+
+    # The results shared by the sub-requests of a batch.
+    shared_results = ContextVar("shared_results", default=None)
+
+    async def shared(key, call, method):
+        """
+        Returns `call(method)`, computed once per request: the
+        sub-requests of a batch share the results.
+        """
+        results = shared_results.get()
+        if results is None:
+            return await call(method)
+        if key not in results:
+            results[key] = await call(method)
+        return results[key]
+
+    async def insert_question(call, fields):
+        """
+        Creates a question, in the next batch of the group commit writer
+        when there is one, without blocking the event loop while waiting.
+        """
+        if writer is None:
+            return await call(lambda store: store.insert(fields))
+
+        future = await run_in_threadpool(writer.submit, fields)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future),
+                                          writer.result_timeout)
+        except asyncio.TimeoutError:
+            # The future is cancelled with its wrapper.
+            raise WriteQueueFull() from None
+
+    def conditional(view):
+        """
+        Answers `304 Not Modified` when the client already has the
+        current version, like create_app's before_request hook.
+        """
+        @wraps(view)
+        async def decorated(request):
+            if not config["ETAG_ENABLED"]:
+                return await view(request)
+
+            etag = data_version.etag(request.url.path, request.url.query)
+            headers = {
+                "ETag": f'"{etag}"',
+                "Cache-Control": config["CACHE_CONTROL"]
+            }
+            tags = if_none_match(request)
+
+            # The client may hold any encoding of the current version.
+            for variant in etag_variants(etag):
+                if variant in tags or "*" in tags:
+                    if config["COMPRESS_ENABLED"]:
+                        headers["Vary"] = "Accept-Encoding"
+                    return Response(status_code=304, headers={
+                        **headers, "ETag": f'"{variant}"'
+                    })
+
+            response = await view(request)
+            if response.status_code == 200:
+                response.headers.update(headers)
+            return response
+
+        return decorated
+
+    @conditional
+    async def retrieve_categories(request):
+        async with store_session(read=True) as call:
+            categories = await shared("categories", call,
+                                      lambda store: store.categories())
+
+            if len(categories) == 0:
+                raise HTTPException(404)
+
+            result = {
+                "success": True,
+                "categories": categories_response(categories)
+            }
+            if wants_counts(request.query_params):
+                result["counts"] = category_counts(
+                    categories,
+                    await call(lambda store: store.category_counts())
+                )
+
+        return json_response(result)
+
+    @conditional
+    async def retrieve_questions(request):
+        args = request.query_params
+        fields = fields_argument(args)
+
+        async with store_session(read=True) as call:
+            current_questions = await call(
+                lambda store: store.page(page_arguments(args), fields=fields)
+            )
+
+            if len(current_questions["questions"]) == 0:
+                raise HTTPException(404)
+
+            result = {
+                "success": True,
+                **current_questions,
+                "current_category": None
+            }
+            if bool_argument(args, "include_categories", True):
+                result["categories"] = categories_response(
+                    await shared("categories", call,
+                                 lambda store: store.categories())
+                )
+
+        return json_response(result)
+
+    @conditional
+    async def bootstrap(request):
+        args = request.query_params
+        fields = fields_argument(args)
+
+        async with store_session(read=True) as call:
+            categories = await shared("categories", call,
+                                      lambda store: store.categories())
+
+            return json_response({
+                "success": True,
+                "categories": categories_response(categories),
+                "counts": category_counts(
+                    categories,
+                    await call(lambda store: store.category_counts())
+                ),
+                **await call(lambda store: store.page(page_arguments(args),
+                                                      fields=fields)),
+                "current_category": None
+            })
+
+    async def delete_question(request):
+        question_id = request.path_params["question_id"]
+        args = request.query_params
+
+        try:
+            async with store_session() as call:
+                if await call(lambda store: store.delete(question_id)) \
+                        is None:
+                    raise HTTPException(404)
+
+                if wants_minimal(args):
+                    return json_response({
+                        "success": True,
+                        "deleted_question_id": question_id
+                    })
+
+                current_questions = await call(
+                    lambda store: store.page(page_arguments(args))
+                )
+
+            return json_response({
+                "success": True,
+                "deleted_question_id": question_id,
+                **current_questions
+            })
+
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            raise HTTPException(422)
+
+    async def delete_many_questions(request):
+        try:
+            question_ids = validate_ids(await read_json(request),
+                                        config["BULK_DELETE_MAX_IDS"])
+        except ValidationError:
+            raise HTTPException(422)
+
+        try:
+            deleted = await run(lambda store: store.delete_many(question_ids))
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            raise HTTPException(422)
+
+        deleted_ids = {question["id"] for question in deleted}
+
+        return json_response({
+            "success": True,
+            "deleted": [question_id for question_id in question_ids
+                        if question_id in deleted_ids],
+            "not_found": [question_id for question_id in question_ids
+                          if question_id not in deleted_ids]
+        })
+
+    async def create_question(request):
+        try:
+            fields = validate_question(await read_json(request))
+        except ValidationError:
+            raise HTTPException(422)
+
+        minimal = wants_minimal(request.query_params)
+
+        async with store_session() as call:
+            # SQLite does not enforce the foreign key.
+            if await call(lambda store: store.category(fields["category"])) \
+                    is None:
+                raise HTTPException(422)
+
+            total_questions = await call(lambda store: store.total()) \
+                if not minimal else None
+
+            try:
+                question = await insert_question(call, fields)
+            except (DeadlineExceeded, WriteQueueFull):
+                raise
+            except Exception:
+                raise HTTPException(422)
+
+        if minimal:
+            return json_response({
+                "success": True,
+                "created_question_id": question["id"],
+                "created_question_text": question["question"]
+            })
+
+        return json_response({
+            "success": True,
+            "created_question_id": question["id"],
+            "created_question_text": question["question"],
+            "total_questions": total_questions
+        })
+
+    async def import_questions(request):
+        if mimetype(request) in NDJSON_MIMETYPES:
+            is_csv = False
+        elif mimetype(request) in CSV_MIMETYPES:
+            is_csv = True
+        else:
+            raise HTTPException(415)
+
+        chunk_size = config["BULK_CHUNK_SIZE"]
+
+        async with store_session() as call:
+            importer = await call(lambda store: store.importer())
+            fieldnames = None
+            lines = []
+            quotes = 0
+
+            async def add(lines):
+                rows = read_csv(lines, fieldnames) if is_csv \
+                    else read_ndjson(lines)
+                await call(lambda store: importer.add(rows))
+
+            with importer:
+                async for line in request_lines(request):
+                    if is_csv and fieldnames is None:
+                        fieldnames = next(csv.reader([line]), [])
+                        continue
+                    lines.append(line)
+                    quotes += line.count('"')
+                    # Only split between CSV records, never inside a
+                    # quoted value spanning several lines.
+                    if len(lines) >= chunk_size and quotes % 2 == 0:
+                        await add(lines)
+                        lines = []
+                        quotes = 0
+
+                await add(lines)
+                report = await call(lambda store: importer.finish())
+
+        return json_response({
+            "success": True,
+            **report
+        })
+
+    async def export_all_questions(request):
+        try:
+            export_format, category, min_id, max_id = \
+                export_arguments(request.query_params)
+        except ValidationError:
+            raise HTTPException(400)
+
+        async def body():
+            # The store's chunks are read one at a time, on the session
+            # kept open while the response is streamed.
+            async with store_session(read=True) as call:
+                chunks = await call(
+                    lambda store: store.export(export_format, category,
+                                               min_id, max_id)
+                )
+                while True:
+                    chunk = await call(lambda store: next(chunks, None))
+                    if chunk is None:
+                        return
+                    yield chunk
+
+        return StreamingResponse(
+            body(),
+            media_type=("text/csv" if export_format == "csv"
+                        else "application/x-ndjson"),
+            headers={
+                "Content-Disposition":
+                    f"attachment; filename=questions.{export_format}"
+            }
+        )
+
+    async def search_questions(request):
+        try:
+            search = validate_search(await read_json(request))
+        except ValidationError:
+            raise HTTPException(422)
+        args = request.query_params
+        fields = fields_argument(args)
+
+        try:
+            current_questions = await run(
+                lambda store: store.search(search, page_arguments(args),
+                                           fields),
+                read=True
+            )
+
+            return json_response({
+                "success": True,
+                **current_questions,
+                "current_category": None
+            })
+
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            raise HTTPException(404)
+
+    @conditional
+    async def suggest_questions(request):
+        try:
+            prefix, limit = suggest_arguments(request.query_params,
+                                              config["SUGGEST_LIMIT"],
+                                              config["SUGGEST_MAX_LIMIT"])
+        except ValidationError:
+            raise HTTPException(400)
+
+        return json_response({
+            "success": True,
+            "prefix": prefix,
+            **await run(lambda store: store.suggest(prefix, limit),
+                        read=True)
+        })
+
+    @conditional
+    async def retrieve_questions_by_category(request):
+        category_id = request.path_params["category_id"]
+        args = request.query_params
+        fields = fields_argument(args)
+
+        async with store_session(read=True) as call:
+            category = await shared(("category", category_id), call,
+                                    lambda store: store.category(category_id))
+
+            if category is None:
+                raise HTTPException(404)
+
+            current_questions = await call(
+                lambda store: store.page(page_arguments(args), category_id,
+                                         fields)
+            )
+
+        return json_response({
+            "success": True,
+            "category": category,
+            **current_questions
+        })
+
+    async def add_quiz(request):
+        try:
+            category, previous_questions = validate_quiz(
+                                               await read_json(request)
+                                           )
+        except ValidationError:
+            raise HTTPException(422)
+
+        try:
+            question = await run(
+                lambda store: store.sample(category, previous_questions),
+                read=True
+            )
+
+            return json_response({
+                "success": True,
+                "question": question
+            })
+
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            raise HTTPException(422)
+
+    async def deal_quiz_deck(request):
+        try:
+            category, size, excluded, seed = validate_deck(
+                await read_json(request), config["QUIZ_DECK_MAX_SIZE"]
+            )
+        except ValidationError:
+            raise HTTPException(422)
+
+        questions = await run(
+            lambda store: store.deal(size, category, excluded, seed),
+            read=True
+        )
+
+        return json_response({
+            "success": True,
+            "questions": questions,
+            "total_questions": len(questions),
+            "seed": seed
+        })
+
+    async def start_quiz_session(request):
+        try:
+            category = validate_quiz_session(await read_json(request))
+        except ValidationError:
+            raise HTTPException(422)
+
+        session = quiz_sessions.create(category)
+
+        return json_response({
+            "success": True,
+            "session_token": session.token
+        })
+
+    async def next_quiz_session_question(request):
+        token = request.path_params["token"]
+
+        try:
+            question = await run(
+                lambda store: quiz_sessions.draw_next(token, store.sample),
+                read=True
+            )
+        except KeyError:
+            raise HTTPException(404)
+
+        return json_response({
+            "success": True,
+            "question": question
+        })
+
+    async def end_quiz_session(request):
+        token = request.path_params["token"]
+
+        if quiz_sessions.get(token) is None:
+            raise HTTPException(404)
+
+        quiz_sessions.delete(token)
+
+        return json_response({
+            "success": True,
+            "session_token": token
+        })
+
+    async def retrieve_metrics(request):
+        return Response(metrics.render(),
+                        headers={"content-type": PROMETHEUS_CONTENT_TYPE})
+
+    async def retrieve_query_stats(request):
+        if not authorized(request.headers.get(TOKEN_HEADER),
+                          config["PROFILE_TOKEN"]):
+            raise HTTPException(403)
+        try:
+            limit, sort = query_stats_arguments(request.query_params)
+        except ValidationError:
+            raise HTTPException(400)
+
+        return json_response({
+            "success": True,
+            "slow_query_ms": query_log.slow_query_ms,
+            "untracked_calls": query_log.untracked_calls,
+            "queries": query_log.top(limit, sort)
+        })
+
+    async def dispatch_sub_request(request, method, path, body):
+        """
+        Runs a sub-request of a batch through its route, like
+        create_app's dispatch_sub_request, and returns its status and
+        JSON body.
+        """
+        path, _, query = path.partition("?")
+        payload = json.dumps(body).encode() if body is not None else b""
+        scope = {
+            **request.scope,
+            "method": method,
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(payload)).encode())],
+            "path_params": {}
+        }
+
+        async def receive():
+            return {"type": "http.request", "body": payload,
+                    "more_body": False}
+
+        sub_request = Request(scope, receive)
+        try:
+            route, matched = None, set()
+            for candidate in routes:
+                match, child_scope = candidate.matches(scope)
+                if match == Match.FULL:
+                    route = candidate
+                    break
+                matched.add(match)
+            if route is None:
+                raise HTTPException(405 if Match.PARTIAL in matched else 404)
+            if route.endpoint.__name__ not in BATCH_ENDPOINTS:
+                raise HTTPException(400)
+
+            sub_request = Request({**scope, **child_scope}, receive)
+            response = await route.endpoint(sub_request)
+        except HTTPException as error:
+            response = await http_error(sub_request, error)
+        return response.status_code, response.body
+
+    async def batch(request):
+        try:
+            sub_requests = validate_batch(await read_json(request),
+                                          config["BATCH_MAX_REQUESTS"])
+        except ValidationError:
+            raise HTTPException(422)
+
+        token = shared_results.set({})
+        try:
+            responses = {}
+            for sub_request in sub_requests:
+                key = request_key(*sub_request)
+                if key not in responses:
+                    responses[key] = await dispatch_sub_request(
+                        request, *sub_request
+                    )
+        finally:
+            shared_results.reset(token)
+
+        return Response(batch_body(responses[request_key(*sub_request)]
+                                   for sub_request in sub_requests),
+                        media_type="application/json")
+
+    async def http_error(request, error):
+        if error.status_code in ERROR_MESSAGES:
+            return json_response(error_response(error.status_code),
+                                 error.status_code)
+        return json_response({
+            "success": False,
+            "error": error.status_code,
+            "message": error.detail
+        }, error.status_code)
+
+    async def internal_server(request, error):
+        return json_response(error_response(500), 500)
+
+    async def deadline_exceeded(request, error):
+        endpoint = request.scope.get("endpoint")
+        return rejected(admission.deadline_exceeded(
+            getattr(endpoint, "__name__", None)
+        ))
+
+    async def write_queue_full(request, error):
+        endpoint = request.scope.get("endpoint")
+        return rejected(admission.shed(getattr(endpoint, "__name__", None),
+                                       Rejection(503, "write_queue",
+                                                 admission.retry_after)))
+
+    async def migrate_schema():
+        async with engine.begin() as connection:
+            await connection.run_sync(migrate)
+
+    async def report_cold_start():
+        if metrics is not None:
+            metrics.record_cold_start(time.perf_counter() - started)
+
+    async def dispose_engines():
+        if writer is not None:
+            await run_in_threadpool(writer.close)
+            writer_engine.dispose()
+        for async_engine in (engine, replica_engine):
+            if async_engine is not None:
+                await async_engine.dispose()
+
+    routes = [
+        Route("/categories", retrieve_categories, methods=["GET"]),
+        Route("/questions", retrieve_questions, methods=["GET"]),
+        Route("/bootstrap", bootstrap, methods=["GET"]),
+        Route("/questions/{question_id:int}", delete_question,
+              methods=["DELETE"]),
+        Route("/questions", create_question, methods=["POST"]),
+        Route("/questions/bulk", import_questions, methods=["POST"]),
+        Route("/questions/bulk", delete_many_questions, methods=["DELETE"]),
+        Route("/questions/export", export_all_questions,
+              methods=["GET"]),
+        Route("/questions/search", search_questions, methods=["POST"]),
+        Route("/questions/suggest", suggest_questions, methods=["GET"]),
+        Route("/categories/{category_id:int}/questions",
+              retrieve_questions_by_category, methods=["GET"]),
+        Route("/quizzes", add_quiz, methods=["POST"]),
+        Route("/quizzes/deck", deal_quiz_deck, methods=["POST"]),
+        Route("/quizzes/sessions", start_quiz_session, methods=["POST"]),
+        Route("/quizzes/sessions/{token}/next",
+              next_quiz_session_question, methods=["POST"]),
+        Route("/quizzes/sessions/{token}", end_quiz_session,
+              methods=["DELETE"]),
+        Route("/batch", batch, methods=["POST"]),
+        Route("/admin/queries", retrieve_query_stats, methods=["GET"]),
+    ]
+    middleware = [Middleware(CORSHeaders)]
+    if metrics is not None:
+        routes.append(Route("/metrics", retrieve_metrics, methods=["GET"]))
+        middleware.append(Middleware(RequestMetrics, metrics=metrics))
+    middleware.append(Middleware(Admission, admission=admission,
+                                 routes=routes))
+    if config["COMPRESS_ENABLED"]:
+        middleware.append(Middleware(CompressJSON,
+                                     min_size=config["COMPRESS_MIN_SIZE"]))
+    middleware.append(Middleware(
+        Profile, token=config["PROFILE_TOKEN"],
+        interval=config["PROFILE_SAMPLE_INTERVAL_MS"] / 1000
+    ))
+
+    # Production workers leave the migrations to the deploy.
+    on_startup = [migrate_schema] \
+        if engine is not None and settings["DB_MIGRATE_ON_START"] else []
+    on_startup.append(report_cold_start)
+
+    app = Starlette(
+        debug=settings["DEBUG"],
+        routes=routes,
+        middleware=middleware,
+        exception_handlers={
+            HTTPException: http_error,
+            DeadlineExceeded: deadline_exceeded,
+            WriteQueueFull: write_queue_full,
+            Exception: internal_server
+        },
+        on_startup=on_startup,
+        on_shutdown=[dispose_engines]
+    )
+    app.state.config = config
+    app.state.engine = engine
+    app.state.store = store
+    app.state.group_commit = writer
+
+    return app
@@ -0,0 +1,37 @@
+"""
+Batched reads shared by the WSGI (Flask) and ASGI applications.
+
+`POST /batch` runs several read sub-requests in one HTTP call. The
+sub-requests are dispatched in-process, in order, and identical ones
+(same method, path and body) are run once. The responses are spliced
+into the batch response as the JSON bytes their views produced.
+"""
+import json
+
+# Endpoints a batch may call: the reads that neither change the data
+# nor draw at random.
+BATCH_ENDPOINTS = frozenset({
+    "bootstrap",
+    "retrieve_categories",
+    "retrieve_questions",
+    "retrieve_questions_by_category",
+    "search_questions",
+    "suggest_questions"
+})
+
+
+def request_key(method, path, body):
+    """
+    Identifies a sub-request of a batch.
+    """
+    return method, path, json.dumps(body, sort_keys=True)
+
+
+def batch_body(responses):
+    """
+    Returns the JSON body of a batch response from the (status, JSON
+    body) pairs of its sub-requests, without decoding their bodies.
+    """
+    parts = b",".join(b'{"body":%s,"status":%d}' % (body.strip(), status)
+                      for status, body in responses)
+    return b'{"responses":[' + parts + b'],"success":true}\n'
@@ -0,0 +1,283 @@
+import csv
+import io
+import json
+
+from sqlalchemy import select
+
+from models import db, Question, Category
+
+BULK_FIELDS = ("question", "answer", "difficulty", "category")
+EXPORT_FIELDS = ("id",) + BULK_FIELDS
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_ndjson(lines):
+    """
+    Yields the rows of a newline-delimited JSON stream, or a `RowError`
+    in place of a row that cannot be parsed.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield RowError(f"invalid JSON: {error}")
+            continue
+        if not isinstance(row, dict):
+            yield RowError("expected a JSON object")
+            continue
+        yield row
+
+
+def read_csv(lines, fieldnames=None):
+    """
+    Yields the rows of a CSV stream whose first line names the columns,
+    unless the column names are given.
+    """
+    yield from csv.DictReader(lines, fieldnames=fieldnames)
+
+
+def validate_row(row, category_ids):
+    """
+    Returns the column values of a question row, or raises `RowError`.
+    """
+    missing = [field for field in BULK_FIELDS if row.get(field) in (None, "")]
+    if missing:
+        raise RowError(f"missing {', '.join(missing)}")
+
+    question = str(row["question"]).strip()
+    answer = str(row["answer"]).strip()
+    if not question or not answer:
+        raise RowError("question and answer must not be blank")
+
+    try:
+        difficulty = int(row["difficulty"])
+        category = int(row["category"])
+    except (TypeError, ValueError):
+        raise RowError("difficulty and category must be integers")
+
+    if not 1 <= difficulty <= 5:
+        raise RowError("difficulty must be between 1 and 5")
+    if category not in category_ids:
+        raise RowError(f"unknown category {category}")
+
+    return {
+        "question": question,
+        "answer": answer,
+        "difficulty": difficulty,
+        "category": category
+    }
+
+
+class BulkImport:
+    """
+    Inserts a stream of question rows in chunks.
+
+    Rows are validated and buffered `chunk_size` at a time; each chunk
+    is written with one multi-row INSERT (or COPY on PostgreSQL when
+    `use_copy` is set) and committed on its own, so memory use does not
+    grow with the size of the upload. When a chunk fails it is retried
+    row by row inside savepoints to find the offending rows, and the
+    rest of the chunk is kept.
+
+    Feed the rows with `add` (as many times as needed), then call
+    `finish`. Uses the app's `db.session` unless another session is
+    given.
+    """
+
+    def __init__(self, chunk_size=1000, use_copy=False, max_errors=100,
+                 session=None):
+        self.chunk_size = chunk_size
+        self.use_copy = use_copy
+        self.max_errors = max_errors
+        self.session = session or db.session
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self._rows = 0
+        self._chunk = []
+        self._category_ids = None
+
+    def _error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row_number, "message": message})
+
+    def _copy(self, values):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in values:
+            writer.writerow([row[field] for field in BULK_FIELDS])
+        buffer.seek(0)
+
+        cursor = self.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {Question.__tablename__} ({', '.join(BULK_FIELDS)}) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+        finally:
+            cursor.close()
+
+    def _insert_many(self, values):
+        dialect = self.session.get_bind().dialect
+        if self.use_copy and dialect.driver == "psycopg2":
+            self._copy(values)
+        else:
+            self.session.execute(Question.__table__.insert(), values)
+
+    def _flush(self):
+        chunk, self._chunk = self._chunk, []
+        if not chunk:
+            return
+
+        try:
+            self._insert_many([values for _, values in chunk])
+            self.session.commit()
+            self.inserted += len(chunk)
+            return
+        except Exception:
+            self.session.rollback()
+
+        for row_number, values in chunk:
+            try:
+                with self.session.begin_nested():
+                    self.session.execute(Question.__table__.insert(), values)
+                self.inserted += 1
+            except Exception as error:
+                self._error(row_number, str(getattr(error, "orig", error)))
+        self.session.commit()
+
+    def add(self, rows):
+        """
+        Validates the rows and writes every full chunk.
+        """
+        if self._category_ids is None:
+            self._category_ids = {
+                category_id
+                for category_id, in self.session.query(Category.id)
+            }
+
+        for row in rows:
+            self._rows += 1
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                self._chunk.append((self._rows,
+                                    validate_row(row, self._category_ids)))
+            except RowError as error:
+                self._error(self._rows, str(error))
+
+            if len(self._chunk) >= self.chunk_size:
+                self._flush()
+
+    def finish(self):
+        """
+        Writes the last chunk and returns the report.
+        """
+        self._flush()
+        return self.report()
+
+    def report(self):
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors
+        }
+
+
+def delete_questions(question_ids, session=None):
+    """
+    Deletes the questions with the given ids in one statement and one
+    transaction, and returns the deleted questions (formatted).
+
+    On databases supporting `DELETE ... RETURNING` (PostgreSQL) that is
+    the only statement; elsewhere the rows are read first, inside the
+    same transaction. Uses the app's `db.session` unless another session
+    is given.
+    """
+    session = session or db.session
+    table = Question.__table__
+    columns = [table.c[field] for field in EXPORT_FIELDS]
+    statement = table.delete().where(table.c.id.in_(question_ids))
+
+    try:
+        if session.get_bind().dialect.full_returning:
+            rows = session.execute(statement.returning(*columns)).all()
+        else:
+            rows = session.execute(
+                select(*columns).where(table.c.id.in_(question_ids))
+                                .with_for_update()
+            ).all()
+            session.execute(statement)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    return [dict(zip(EXPORT_FIELDS, row)) for row in rows]
+
+
+class ExportFormatter:
+    """
+    Formats rows of `EXPORT_FIELDS` columns as NDJSON or CSV text.
+    """
+
+    def __init__(self, format="ndjson"):
+        self.format = format
+
+    def header(self):
+        if self.format != "csv":
+            return ""
+        return self.rows([EXPORT_FIELDS])
+
+    def rows(self, rows):
+        buffer = io.StringIO()
+        if self.format == "csv":
+            csv.writer(buffer).writerows(rows)
+        else:
+            for row in rows:
+                buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, row))))
+                buffer.write("\n")
+        return buffer.getvalue()
+
+
+def export_questions(selection, format="ndjson", batch_size=1000):
+    """
+    Yields the questions of a query of `EXPORT_FIELDS` columns as NDJSON
+    or CSV text, one batch of rows per chunk.
+
+    The query is executed with a server-side cursor fetching
+    `batch_size` rows at a time, so memory use does not depend on the
+    number of questions and the first chunk is sent as soon as the first
+    batch is read.
+    """
+    return export_rows(selection.yield_per(batch_size), format, batch_size)
+
+
+def export_rows(rows, format="ndjson", batch_size=1000):
+    """
+    Yields rows of `EXPORT_FIELDS` values as NDJSON or CSV text, one
+    batch of rows per chunk.
+    """
+    formatter = ExportFormatter(format)
+    batch = []
+
+    header = formatter.header()
+    if header:
+        yield header
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield formatter.rows(batch)
+            batch = []
+
+    if batch:
+        yield formatter.rows(batch)
@@ -0,0 +1,50 @@
+import hashlib
+import secrets
+import threading
+import time
+
+
+class DataVersion:
+    """
+    A counter bumped on every change of the questions, used to derive
+    ETags without querying the database.
+
+    The version includes a random per-process prefix, so tags issued by
+    different workers never match each other. When `max_staleness` is
+    set, the version also changes every `max_staleness` seconds, which
+    bounds how long a worker keeps confirming a tag for data changed by
+    another worker.
+    """
+
+    def __init__(self, max_staleness=None):
+        self.max_staleness = max_staleness
+        self._prefix = secrets.token_hex(4)
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self._counter += 1
+
+    def question_changed(self, event, question):
+        """
+        Question listener bumping the version.
+        """
+        self.bump()
+
+    def current(self):
+        version = f"{self._prefix}.{self._counter}"
+        if self.max_staleness:
+            version += f".{int(time.time() // self.max_staleness)}"
+        return version
+
+    def etag(self, *parts):
+        """
+        Returns a strong ETag (without quotes) for the current version of
+        the data and the given request parts.
+        """
+        digest = hashlib.sha1(self.current().encode())
+        for part in parts:
+            digest.update(b"\0" + (part if isinstance(part, bytes)
+                                   else str(part).encode()))
+        return digest.hexdigest()
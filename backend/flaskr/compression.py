@@ -0,0 +1,79 @@
+"""
+Compression of JSON responses negotiated with `Accept-Encoding`, shared
+by the WSGI (Flask) and ASGI applications.
+
+Brotli is offered when the `brotli` package is installed, gzip always.
+A compressed response is another representation of the resource, so
+its ETag gets the encoding as a suffix (`<tag>-gzip`) and every
+compressible response says `Vary: Accept-Encoding`.
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# In order of preference when the client accepts several equally.
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+GZIP_LEVEL = 6
+# Brotli's quality 4 compresses about as fast as gzip level 6, and
+# smaller; the higher qualities are meant for static files.
+BROTLI_QUALITY = 4
+
+
+def accepted_encodings(header):
+    """
+    Returns the quality of each coding of an Accept-Encoding header.
+    """
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def choose_encoding(header):
+    """
+    Returns the content coding to use for an Accept-Encoding header, or
+    None to send the body as is.
+    """
+    accepted = accepted_encodings(header)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def encoded_etag(etag, encoding):
+    """
+    Returns the ETag of a representation in the given encoding.
+    """
+    return f"{etag}-{encoding}" if encoding else etag
+
+
+def etag_variants(etag):
+    """
+    Returns the ETags of every representation of a resource version.
+    """
+    return [etag] + [encoded_etag(etag, encoding) for encoding in ENCODINGS]
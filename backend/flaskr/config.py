@@ -0,0 +1,123 @@
+"""
+Default settings of the trivia API, overridden by the `test_config`
+passed to the application factories.
+"""
+import os
+
+from models import profile_settings
+
+DEFAULT_CONFIG = {
+    # "database" keeps the questions in the SQLAlchemy database,
+    # "memory" in an embedded in-memory store (either application), loaded
+    # from the pg_dump file MEMORY_STORE_DUMP when it is set.
+    "STORAGE_BACKEND": "database",
+    "MEMORY_STORE_DUMP": None,
+    # Seconds after which the quiz index is reloaded from the database
+    # to pick up writes made by other workers (None disables reloads).
+    "QUIZ_INDEX_MAX_AGE": 60,
+    # Quiz sessions: idle lifetime in seconds and bounds of the
+    # in-process store. QUIZ_SESSION_STORE may be set to any
+    # QuizSessionStore, e.g. one backed by a shared cache.
+    "QUIZ_SESSION_TTL": 3600,
+    "QUIZ_SESSION_MAX": 10000,
+    "QUIZ_SESSION_STORE": None,
+    # Most questions POST /quizzes/deck deals in one response.
+    "QUIZ_DECK_MAX_SIZE": 50,
+    # "index" serves /questions/search from the in-memory trigram
+    # index, "database" runs an ILIKE query instead.
+    "SEARCH_BACKEND": "index",
+    "SEARCH_INCLUDE_ANSWERS": False,
+    "SEARCH_INDEX_MAX_AGE": 60,
+    # GET /questions/suggest: default and largest number of
+    # suggestions, question ids kept per word by the prefix index
+    # (its memory budget; None keeps them all) and seconds after which
+    # the index is reloaded.
+    "SUGGEST_LIMIT": 10,
+    "SUGGEST_MAX_LIMIT": 25,
+    "SUGGEST_MAX_POSTINGS": 1000,
+    "SUGGEST_INDEX_MAX_AGE": 60,
+    # Most sub-requests POST /batch runs in one call.
+    "BATCH_MAX_REQUESTS": 20,
+    # Serve the GET endpoints from an in-memory snapshot, reloaded
+    # after READ_MODEL_MAX_STALENESS seconds (None: never).
+    "READ_MODEL_ENABLED": False,
+    "READ_MODEL_MAX_STALENESS": 5,
+    # ETags of the GET endpoints change whenever a question is
+    # created or deleted, and at least every ETAG_MAX_STALENESS
+    # seconds to cover changes made by other workers.
+    "ETAG_ENABLED": True,
+    "ETAG_MAX_STALENESS": 5,
+    "CACHE_CONTROL": "no-cache",
+    # Seconds after which the in-memory question counts backing
+    # total_questions are reconciled with the database (None: never).
+    "COUNTS_RECONCILE_INTERVAL": 60,
+    # Bulk import: rows per transaction, use COPY on PostgreSQL and
+    # how many row errors to report.
+    "BULK_CHUNK_SIZE": 1000,
+    "BULK_USE_COPY": True,
+    "BULK_MAX_ERRORS": 100,
+    # Group commit (either application, with the database backend): questions
+    # created are queued and inserted by a writer thread, one
+    # transaction per batch of at most GROUP_COMMIT_MAX_BATCH questions
+    # or GROUP_COMMIT_MAX_DELAY_MS milliseconds. A create waits up to
+    # GROUP_COMMIT_ENQUEUE_TIMEOUT_MS (None: for ever) for room in the
+    # queue of GROUP_COMMIT_MAX_QUEUE questions, and is answered 503
+    # after that, or when its question is not written within
+    # GROUP_COMMIT_RESULT_TIMEOUT_MS. "sync" durability answers once
+    # the commit is on disk, "async" (PostgreSQL synchronous_commit
+    # off) before.
+    "GROUP_COMMIT_ENABLED": False,
+    "GROUP_COMMIT_MAX_BATCH": 100,
+    "GROUP_COMMIT_MAX_DELAY_MS": 5,
+    "GROUP_COMMIT_MAX_QUEUE": 1000,
+    "GROUP_COMMIT_ENQUEUE_TIMEOUT_MS": 100,
+    "GROUP_COMMIT_RESULT_TIMEOUT_MS": 5000,
+    "GROUP_COMMIT_DURABILITY": "sync",
+    # Most ids DELETE /questions/bulk accepts in one request.
+    "BULK_DELETE_MAX_IDS": 10000,
+    "EXPORT_BATCH_SIZE": 1000,
+    # Encode the JSON responses with orjson when it is installed; the
+    # bytes sent are the same as with the standard library.
+    "JSON_FAST_ENCODER": True,
+    # Compress JSON responses of at least COMPRESS_MIN_SIZE bytes with
+    # brotli or gzip, as accepted by the client.
+    "COMPRESS_ENABLED": True,
+    "COMPRESS_MIN_SIZE": 1024,
+    # Request latency, SQL query and response size metrics, exposed
+    # at /metrics and in a Server-Timing header.
+    "METRICS_ENABLED": True,
+    # Profiling: the secret to send in X-Profile-Token to profile a
+    # request or read GET /admin/queries (None disables both), the
+    # sampling interval of the statistical profile, the query
+    # fingerprints kept and the seconds between two EXPLAINs of a slow
+    # query. The slow query threshold is in the DB_PROFILE settings.
+    "PROFILE_TOKEN": os.getenv("PROFILE_TOKEN"),
+    "PROFILE_SAMPLE_INTERVAL_MS": 1,
+    "QUERY_LOG_MAX_FINGERPRINTS": 1000,
+    "QUERY_EXPLAIN_INTERVAL": 300,
+    # Admission control: the most requests in flight per endpoint
+    # (view name -> limit, answered 503 over it), a token bucket per
+    # client address (answered 429 when empty; None disables it) and
+    # the milliseconds a request may spend before its queries are
+    # cancelled (None: no deadline).
+    "ROUTE_CONCURRENCY_LIMITS": {},
+    "RATE_LIMIT_PER_SECOND": None,
+    "RATE_LIMIT_BURST": 20,
+    "RATE_LIMIT_MAX_CLIENTS": 10000,
+    "REQUEST_DEADLINE_MS": None,
+    # Seconds sent in Retry-After with a 503.
+    "SHED_RETRY_AFTER": 1,
+}
+
+
+def load_config(test_config=None):
+    """
+    Returns DEFAULT_CONFIG overridden by the test_config, completed with
+    the settings of its DB_PROFILE (see models.ENGINE_PROFILES) that it
+    does not set itself.
+    """
+    config = dict(DEFAULT_CONFIG)
+    if test_config is not None:
+        config.update(test_config)
+    config.update(profile_settings(config))
+    return config
@@ -0,0 +1,95 @@
+import time
+
+from sqlalchemy import func
+
+from models import Question
+from .quiz import category_key
+from .snapshot import Snapshot
+
+
+class QuestionCounts(Snapshot):
+    """
+    The number of questions, in total and per category, kept in memory
+    so the `total_questions` of a response needs no COUNT query.
+
+    The counts are loaded with one GROUP BY query and then maintained by
+    `question_changed`: +1 on insert, -1 on delete. Every
+    `reconcile_interval` seconds they are reconciled with the database
+    on the next read, which corrects any drift and picks up writes made
+    by other workers.
+    """
+
+    def __init__(self, reconcile_interval=None):
+        super().__init__()
+        self.reconcile_interval = reconcile_interval
+        self._counts = None
+        self._total = 0
+        self._loaded_at = 0
+
+    def _is_loaded(self):
+        return self._counts is not None
+
+    def _is_stale(self):
+        if self.reconcile_interval is None:
+            return False
+        return time.monotonic() - self._loaded_at > self.reconcile_interval
+
+    def _read(self, session):
+        rows = session.query(Question.category, func.count(Question.id)) \
+                      .group_by(Question.category)
+
+        counts = {}
+        for category, count in rows:
+            category = category_key(category)
+            counts[category] = counts.get(category, 0) + count
+        return counts
+
+    def _install(self, counts):
+        self._counts = counts
+        self._total = sum(counts.values())
+        self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._changed()
+            self._counts = None
+
+    def question_changed(self, event, question):
+        """
+        Question listener keeping the counts current.
+        """
+        with self._lock:
+            self._changed()
+            if self._counts is None:
+                return
+            if event in ("insert", "delete"):
+                change = 1 if event == "insert" else -1
+                category = category_key(question["category"])
+                self._counts[category] = \
+                    max(self._counts.get(category, 0) + change, 0)
+                self._total = max(self._total + change, 0)
+            else:
+                # An update may have moved the question to another
+                # category, which the event does not tell.
+                self._counts = None
+
+    def total(self, session=None):
+        """
+        Returns the number of questions.
+        """
+        with self._current(session):
+            return self._total
+
+    def category(self, category_id, session=None):
+        """
+        Returns the number of questions of a category.
+        """
+        with self._current(session):
+            return self._counts.get(category_key(category_id), 0)
+
+    def categories(self, session=None):
+        """
+        Returns the number of questions of each category, by category id.
+        """
+        with self._current(session):
+            return dict(self._counts)
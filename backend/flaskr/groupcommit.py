@@ -0,0 +1,248 @@
+"""
+Group commit of the questions created by create_app and
+create_asgi_app.
+
+Every `POST /questions` otherwise commits its own transaction, and so
+waits for its own flush of the database log. With GROUP_COMMIT_ENABLED
+the creates are put in a bounded queue instead. A writer thread takes
+them off the queue in batches, closed when GROUP_COMMIT_MAX_BATCH
+questions are waiting or GROUP_COMMIT_MAX_DELAY_MS milliseconds after
+the first one, and inserts each batch in one transaction. Each caller
+waits on its own future for its question, with its id, or its error,
+for at most GROUP_COMMIT_RESULT_TIMEOUT_MS.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future, TimeoutError
+
+from sqlalchemy import text
+
+from models import notify_question_listeners, Question
+
+logger = logging.getLogger(__name__)
+
+DURABILITIES = ("sync", "async")
+
+# The writers of the process, closed at exit.
+_writers = weakref.WeakSet()
+
+
+class WriteQueueFull(Exception):
+    """
+    The group commit writer is overloaded: its queue stayed full for the
+    enqueue timeout, or the question was not written within the result
+    timeout (503).
+    """
+
+
+class GroupCommitWriter:
+    """
+    Inserts the questions submitted from any thread in batches, one
+    transaction per batch, from a writer thread of its own.
+
+    `durability` is "sync" to answer once the commit is flushed to disk,
+    or "async" to answer once it is committed but before the flush
+    (PostgreSQL `synchronous_commit = off`): a crash may then lose the
+    last questions answered, but never leaves a batch half written.
+    The queue holds at most `max_queue` questions; `submit` waits up to
+    `enqueue_timeout` seconds for a free slot (None: for ever) and
+    raises `WriteQueueFull` after that. `insert` waits up to
+    `result_timeout` seconds for the question to be written, and raises
+    `WriteQueueFull` after that too.
+
+    Each batch is written in a `session_scope()`, a context manager
+    yielding the session to use (such as `app_session(app)` of
+    flaskr/storage.py or a sessionmaker), and the questions created are
+    passed to `notify` inside it.
+    """
+
+    def __init__(self, session_scope, notify=notify_question_listeners,
+                 max_batch=100, max_delay=0.005, max_queue=1000,
+                 enqueue_timeout=0.1, result_timeout=5.0,
+                 durability="sync"):
+        if durability not in DURABILITIES:
+            raise ValueError(f"unknown GROUP_COMMIT_DURABILITY {durability!r}")
+
+        self.session_scope = session_scope
+        self.notify = notify
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.enqueue_timeout = enqueue_timeout
+        self.result_timeout = result_timeout
+        self.durability = durability
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        _writers.add(self)
+
+    @classmethod
+    def from_config(cls, config, session_scope,
+                    notify=notify_question_listeners):
+        timeout_ms = config["GROUP_COMMIT_ENQUEUE_TIMEOUT_MS"]
+        return cls(session_scope, notify,
+                   max_batch=config["GROUP_COMMIT_MAX_BATCH"],
+                   max_delay=config["GROUP_COMMIT_MAX_DELAY_MS"] / 1000,
+                   max_queue=config["GROUP_COMMIT_MAX_QUEUE"],
+                   enqueue_timeout=timeout_ms / 1000
+                   if timeout_ms is not None else None,
+                   result_timeout=config["GROUP_COMMIT_RESULT_TIMEOUT_MS"]
+                   / 1000,
+                   durability=config["GROUP_COMMIT_DURABILITY"])
+
+    def _start(self):
+        # Called with the lock held. A process forked from this one has
+        # no writer thread: it starts its own, with its own queue.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._queue = queue.Queue(self.max_queue)
+        self._thread = threading.Thread(target=self._run,
+                                        args=(self._queue,),
+                                        name="group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, fields):
+        """
+        Queues a question to create from the fields of
+        `validate_question`, and returns the future of the created
+        question.
+        """
+        with self._lock:
+            self._start()
+            pending = self._queue
+
+        future = Future()
+        try:
+            pending.put((fields, future), timeout=self.enqueue_timeout)
+        except queue.Full:
+            raise WriteQueueFull() from None
+        return future
+
+    def insert(self, fields):
+        """
+        Creates a question in the next batch and returns it, or raises
+        `WriteQueueFull` when it is not written in time. A question
+        still waiting in the queue then is dropped; one already being
+        written may still be created.
+        """
+        future = self.submit(fields)
+        try:
+            return future.result(timeout=self.result_timeout)
+        except TimeoutError:
+            future.cancel()
+            raise WriteQueueFull() from None
+
+    def pending(self):
+        """
+        Returns the number of questions waiting in the queue.
+        """
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    def close(self):
+        """
+        Commits the questions already queued and stops the writer,
+        waiting at most `result_timeout` seconds for it.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._pid = None
+            pending, thread = self._queue, self._thread
+
+        deadline = time.monotonic() + self.result_timeout
+        try:
+            pending.put(None, timeout=self.result_timeout)
+        except queue.Full:
+            # The writer is stuck; it is a daemon thread.
+            return
+        thread.join(max(deadline - time.monotonic(), 0))
+
+    def _run(self, pending):
+        stopping = False
+        while not stopping:
+            item = pending.get()
+            if item is None:
+                return
+
+            batch = [item]
+            closes_at = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = closes_at - time.monotonic()
+                try:
+                    # Past the delay, only take the questions already
+                    # waiting.
+                    item = pending.get(timeout=remaining) \
+                        if remaining > 0 else pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            # Questions whose caller stopped waiting are dropped.
+            batch = [(fields, future) for fields, future in batch
+                     if future.set_running_or_notify_cancel()]
+            try:
+                self._commit(batch)
+            except Exception as error:
+                logger.exception("group commit failed")
+                failure = error
+            else:
+                failure = None
+            finally:
+                # No caller is left waiting, whatever failed.
+                for fields, future in batch:
+                    if not future.done():
+                        future.set_exception(
+                            failure or RuntimeError("group commit failed")
+                        )
+
+    def _insert(self, session, batch):
+        if self.durability == "async" and \
+                session.get_bind().dialect.name == "postgresql":
+            session.execute(text("SET LOCAL synchronous_commit = off"))
+
+        questions = [Question(**fields) for fields, future in batch]
+        session.add_all(questions)
+        session.flush()
+        created = [question.format() for question in questions]
+        session.commit()
+        return created
+
+    def _commit(self, batch):
+        with self.session_scope() as session:
+            try:
+                created = self._insert(session, batch)
+            except Exception as error:
+                session.rollback()
+                if len(batch) == 1:
+                    batch[0][1].set_exception(error)
+                    return
+                created = None
+            else:
+                try:
+                    for question in created:
+                        self.notify("insert", question)
+                finally:
+                    for (fields, future), question in zip(batch, created):
+                        future.set_result(question)
+
+        if created is None:
+            # One bad question fails the whole transaction: insert them
+            # one at a time so each caller gets its own result.
+            for item in batch:
+                self._commit([item])
+
+
+@atexit.register
+def _close_writers():
+    for writer in list(_writers):
+        writer.close()
@@ -0,0 +1,363 @@
+"""
+An embedded in-memory `QuestionStore`, for tests and experiments that
+should not need a database server:
+
+    create_app({"STORAGE_BACKEND": "memory",
+                "MEMORY_STORE_DUMP": "trivia.psql"})
+
+Questions are kept as `QuestionRecord`s by id, with a sorted id array
+for all questions and one per category (a page is a slice and a cursor
+a binary search), an `IdPool` per category for the quiz draws, a
+`SearchIndex` for the searches and a `SuggestIndex` for the
+suggestions. Nothing is persisted: the data lives as
+long as the app.
+"""
+import random
+import re
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+from models import notify_question_listeners
+from .bulk import EXPORT_FIELDS, RowError, export_rows, validate_row
+from .quiz import IdPool, category_key
+from .readmodel import QuestionRecord
+from .search import SearchIndex
+from .storage import QuestionStore
+from .suggest import SuggestIndex
+from .validation import (
+    ROW_FIELDS, page_slice, page_response, sorted_page
+)
+
+COPY_STATEMENT = re.compile(r"COPY (?:\w+\.)?(\w+) \(([^)]*)\) FROM stdin;")
+COPY_ESCAPE = re.compile(r"\\(.)")
+COPY_ESCAPES = {"t": "\t", "n": "\n", "r": "\r"}
+
+
+def copy_value(value):
+    """
+    Decodes a column of a COPY text row.
+    """
+    if value == "\\N":
+        return None
+    return COPY_ESCAPE.sub(
+        lambda match: COPY_ESCAPES.get(match.group(1), match.group(1)),
+        value
+    )
+
+
+def read_dump(lines):
+    """
+    Returns the rows of the COPY blocks of a pg_dump file, as column
+    dictionaries by table name.
+    """
+    tables = {}
+    rows = None
+
+    for line in lines:
+        line = line.rstrip("\n")
+        if rows is None:
+            match = COPY_STATEMENT.match(line)
+            if match:
+                columns = [column.strip()
+                           for column in match.group(2).split(",")]
+                rows = tables.setdefault(match.group(1), [])
+        elif line == "\\.":
+            rows = None
+        else:
+            rows.append(dict(zip(columns,
+                                 map(copy_value, line.split("\t")))))
+
+    return tables
+
+
+def optional_int(value):
+    return int(value) if value not in (None, "") else None
+
+
+class MemoryQuestionStore(QuestionStore):
+    """
+    Keeps the categories and questions in process memory.
+
+    New questions get the next id after the highest one seen, and must
+    belong to an existing category (or none), like the foreign key of
+    the database. Writes are passed to `notify`.
+    """
+
+    def __init__(self, include_answers=False, max_errors=100,
+                 export_batch_size=1000, rng=None,
+                 notify=notify_question_listeners):
+        self.max_errors = max_errors
+        self.export_batch_size = export_batch_size
+        self.notify = notify
+        self._lock = threading.RLock()
+        self._rng = rng or random.Random()
+        self._categories = {}
+        self._records = {}
+        self._ids = []
+        self._category_ids = {}
+        self._pools = {None: IdPool()}
+        self._search_index = SearchIndex(include_answers=include_answers)
+        self._search_index.load(())
+        self._suggest_index = SuggestIndex(max_postings=None)
+        self._suggest_index.load(())
+        self._next_id = 1
+
+    def load(self, categories=(), questions=()):
+        """
+        Adds categories, as (id, type) pairs, and questions, as
+        `Question.format()` dictionaries, keeping their ids.
+        """
+        with self._lock:
+            for category_id, type in categories:
+                self._categories[category_id] = type
+            for question in questions:
+                self._add(QuestionRecord(*(question.get(field)
+                                           for field in ROW_FIELDS)))
+
+    def load_dump(self, path):
+        """
+        Loads the categories and questions of a pg_dump file such as
+        trivia.psql.
+        """
+        with open(path, encoding="utf-8") as dump:
+            tables = read_dump(dump)
+
+        self.load(
+            ((int(row["id"]), row["type"])
+             for row in tables.get("categories", ())),
+            ({"id": int(row["id"]),
+              "question": row["question"],
+              "answer": row["answer"],
+              "category": optional_int(row["category"]),
+              "difficulty": optional_int(row["difficulty"])}
+             for row in tables.get("questions", ()))
+        )
+
+    def _add(self, record):
+        category = category_key(record.category)
+        self._records[record.id] = record
+        for ids in (self._ids, self._category_ids.setdefault(category, [])):
+            if not ids or ids[-1] < record.id:
+                ids.append(record.id)
+            else:
+                insort(ids, record.id)
+        self._pools[None].add(record.id)
+        if category is not None:
+            self._pools.setdefault(category, IdPool()).add(record.id)
+        self._search_index.add(record.id, record.question, record.answer)
+        self._suggest_index.add(record.id, record.question)
+        self._next_id = max(self._next_id, record.id + 1)
+
+    def _remove(self, question_id):
+        record = self._records.pop(question_id, None)
+        if record is None:
+            return None
+
+        category = category_key(record.category)
+        for ids in (self._ids, self._category_ids.get(category, [])):
+            position = bisect_left(ids, question_id)
+            if position < len(ids) and ids[position] == question_id:
+                del ids[position]
+        for pool in (self._pools[None], self._pools.get(category)):
+            if pool is not None:
+                pool.remove(question_id)
+        self._search_index.remove(question_id)
+        self._suggest_index.remove(question_id, record.question)
+        return record.format()
+
+    def _record(self, fields):
+        category = fields["category"]
+        if category is not None:
+            category = int(category)
+            if category not in self._categories:
+                raise ValueError(f"unknown category {category}")
+        return QuestionRecord(self._next_id, fields["question"],
+                              fields["answer"], category,
+                              int(fields["difficulty"]))
+
+    def categories(self):
+        with self._lock:
+            return sorted(self._categories.items(),
+                          key=lambda category: category[1])
+
+    def category(self, category_id):
+        with self._lock:
+            return self._categories.get(category_id)
+
+    def total(self):
+        with self._lock:
+            return len(self._records)
+
+    def category_counts(self):
+        with self._lock:
+            return {category: len(ids)
+                    for category, ids in self._category_ids.items() if ids}
+
+    def page(self, page_arguments, category=None, fields=ROW_FIELDS):
+        with self._lock:
+            if category is None:
+                ids = self._ids
+            else:
+                ids = self._category_ids.get(category_key(category), [])
+            page_ids, next_cursor = sorted_page(page_arguments, ids)
+
+            return page_response(page_arguments,
+                                 [self._records[question_id].format(fields)
+                                  for question_id in page_ids],
+                                 len(ids),
+                                 next_cursor)
+
+    def search(self, term, page_arguments, fields=ROW_FIELDS):
+        with self._lock:
+            question_ids = self._search_index.search(term)
+            page_ids, next_cursor = page_slice(page_arguments, question_ids)
+
+            return page_response(page_arguments,
+                                 [self._records[question_id].format(fields)
+                                  for question_id in page_ids],
+                                 len(question_ids),
+                                 next_cursor)
+
+    def suggest(self, prefix, limit):
+        with self._lock:
+            completions, question_ids = self._suggest_index.suggest(prefix,
+                                                                    limit)
+            return {
+                "completions": completions,
+                "questions": [self._records[question_id].format(("id",
+                                                                 "question"))
+                              for question_id in question_ids]
+            }
+
+    def insert(self, fields):
+        with self._lock:
+            record = self._record(fields)
+            self._add(record)
+
+        question = record.format()
+        self.notify("insert", question)
+        return question
+
+    def delete(self, question_id):
+        with self._lock:
+            question = self._remove(question_id)
+
+        if question is not None:
+            self.notify("delete", question)
+        return question
+
+    def delete_many(self, question_ids):
+        with self._lock:
+            deleted = [question for question in map(self._remove,
+                                                    question_ids)
+                       if question is not None]
+
+        for question in deleted:
+            self.notify("delete", question)
+        return deleted
+
+    def importer(self):
+        return MemoryImport(self)
+
+    def export(self, export_format, category=None, min_id=None,
+               max_id=None):
+        return export_rows(self._export_rows(category, min_id, max_id),
+                           export_format, self.export_batch_size)
+
+    def _export_rows(self, category, min_id, max_id):
+        # Reads `export_batch_size` rows at a time from the id index,
+        # holding the lock only while reading them, like a server-side
+        # cursor: a question created or deleted past the last row read is
+        # exported as it is by then.
+        after = None
+        while True:
+            with self._lock:
+                if category is None:
+                    ids = self._ids
+                else:
+                    ids = self._category_ids.get(category_key(category), [])
+                if after is not None:
+                    start = bisect_right(ids, after)
+                else:
+                    start = bisect_left(ids, min_id) \
+                        if min_id is not None else 0
+                end = bisect_right(ids, max_id) if max_id is not None \
+                    else len(ids)
+                rows = [tuple(getattr(self._records[question_id], field)
+                              for field in EXPORT_FIELDS)
+                        for question_id in
+                        ids[start:min(end, start + self.export_batch_size)]]
+
+            if not rows:
+                return
+            yield from rows
+            after = rows[-1][0]
+
+    def sample(self, category=None, excluded=()):
+        with self._lock:
+            pool = self._pools.get(category_key(category) or None)
+            if pool is None:
+                return None
+            question_id = pool.draw(self._rng, excluded)
+            if question_id is None:
+                return None
+            return self._records[question_id].format()
+
+    def deal(self, size, category=None, excluded=(), seed=None):
+        with self._lock:
+            pool = self._pools.get(category_key(category) or None)
+            if pool is None:
+                return []
+            if seed is None:
+                question_ids = pool.draw_many(self._rng, size, excluded)
+            else:
+                question_ids = pool.draw_sorted(random.Random(seed), size,
+                                                excluded)
+            return [self._records[question_id].format()
+                    for question_id in question_ids]
+
+
+class MemoryImport:
+    """
+    The import of `MemoryQuestionStore.importer`: adds the valid rows as
+    they come, and asks the question listeners to reload once it is left
+    if it added anything.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self._rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.inserted:
+            self.store.notify("reset")
+
+    def add(self, rows):
+        store = self.store
+        for row in rows:
+            self._rows += 1
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                with store._lock:
+                    store._add(store._record(validate_row(row,
+                                                          store._categories)))
+                self.inserted += 1
+            except RowError as error:
+                self.failed += 1
+                if len(self.errors) < store.max_errors:
+                    self.errors.append({"row": self._rows,
+                                        "message": str(error)})
+
+    def finish(self):
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors
+        }
@@ -0,0 +1,272 @@
+"""
+Request metrics shared by the WSGI (Flask) and ASGI applications.
+
+Each request gets a `RequestStats` in a context variable, which the
+SQLAlchemy engine events fill with the number of queries, the time
+spent in them and the rows the driver reports. When the request ends,
+its stats go into the `Metrics` histograms and counters, rendered in
+the Prometheus text format by `/metrics`, and into a `Server-Timing`
+header.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the histogram buckets (seconds, and queries).
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_request_stats = ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    """
+    What one request did, filled in while it runs.
+    """
+
+    __slots__ = ("started", "queries", "query_time", "rows",
+                 "_query_started")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.rows = 0
+        self._query_started = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """
+        Returns the value of the Server-Timing header.
+        """
+        return (f'db;dur={self.query_time * 1000:.2f};'
+                f'desc="{self.queries} queries", '
+                f'total;dur={self.elapsed() * 1000:.2f}')
+
+
+def start_request():
+    """
+    Starts collecting the stats of the current request.
+    """
+    stats = RequestStats()
+    _request_stats.set(stats)
+    return stats
+
+
+def current_request():
+    return _request_stats.get()
+
+
+def finish_request():
+    """
+    Stops collecting and returns the stats of the current request.
+    """
+    stats = _request_stats.get()
+    _request_stats.set(None)
+    return stats
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = _request_stats.get()
+    if stats is None or stats._query_started is None:
+        return
+    stats.queries += 1
+    stats.query_time += time.perf_counter() - stats._query_started
+    stats._query_started = None
+    # psycopg2 reports the rows of a SELECT, SQLite only written rows.
+    if cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+
+
+class Histogram:
+    """
+    Counts observations per bucket, plus their sum, for each label set.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series.setdefault(
+                labels, [[0] * (len(self.buckets) + 1), 0.0]
+            )
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self, name):
+        for labels, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield (f"{name}_bucket",
+                       labels + (("le", format_value(bound)),),
+                       cumulative)
+            yield f"{name}_sum", labels, total
+            yield f"{name}_count", labels, cumulative
+
+
+class Counter:
+    """
+    A total for each label set.
+    """
+
+    def __init__(self):
+        self.series = {}
+
+    def inc(self, labels, value=1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def samples(self, name):
+        for labels, value in sorted(self.series.items()):
+            yield name, labels, value
+
+
+class Gauge:
+    """
+    A current value for each label set.
+    """
+
+    def __init__(self):
+        self.series = {}
+
+    def set(self, labels, value):
+        self.series[labels] = value
+
+    def samples(self, name):
+        for labels, value in sorted(self.series.items()):
+            yield name, labels, value
+
+
+def format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        f'{name}="{escape_label(value)}"' for name, value in labels
+    ) + "}"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\") \
+                     .replace('"', '\\"') \
+                     .replace("\n", "\\n")
+
+
+class Metrics:
+    """
+    The request metrics of one application, labelled by endpoint (the
+    view name, which keeps the number of series bounded) and method.
+    """
+
+    def __init__(self, prefix="trivia"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.families = {
+            "http_request_duration_seconds": (
+                "histogram", "Request latency.",
+                Histogram(LATENCY_BUCKETS)),
+            "http_requests_total": (
+                "counter", "Requests by status code.", Counter()),
+            "http_response_bytes_total": (
+                "counter", "Bytes of the response bodies serialized.",
+                Counter()),
+            "db_queries_per_request": (
+                "histogram", "SQL queries run by a request.",
+                Histogram(QUERY_BUCKETS)),
+            "db_query_duration_seconds": (
+                "histogram", "Time a request spent in SQL queries.",
+                Histogram(LATENCY_BUCKETS)),
+            "db_rows_total": (
+                "counter", "Rows reported by the database driver.",
+                Counter()),
+            "http_requests_shed_total": (
+                "counter", "Requests refused by admission control.",
+                Counter()),
+            "cold_start_seconds": (
+                "gauge", "Time taken to start the application.",
+                Gauge()),
+        }
+
+    def _family(self, name):
+        return self.families[name][2]
+
+    def record(self, stats, endpoint, method, status, response_bytes=None):
+        """
+        Adds the stats of a finished request.
+        """
+        labels = (("endpoint", endpoint or "unmatched"), ("method", method))
+        elapsed = stats.elapsed()
+        with self._lock:
+            self._family("http_request_duration_seconds") \
+                .observe(labels, elapsed)
+            self._family("http_requests_total") \
+                .inc(labels + (("status", str(status)),))
+            self._family("db_queries_per_request") \
+                .observe(labels, stats.queries)
+            self._family("db_query_duration_seconds") \
+                .observe(labels, stats.query_time)
+            if stats.rows:
+                self._family("db_rows_total").inc(labels, stats.rows)
+            if response_bytes:
+                self._family("http_response_bytes_total") \
+                    .inc(labels, response_bytes)
+
+    def record_shed(self, endpoint, reason):
+        """
+        Counts a request refused by admission control.
+        """
+        with self._lock:
+            self._family("http_requests_shed_total").inc(
+                (("endpoint", endpoint or "unmatched"), ("reason", reason))
+            )
+
+    def record_cold_start(self, seconds):
+        """
+        Sets the time the application took to start.
+        """
+        with self._lock:
+            self._family("cold_start_seconds").set((), seconds)
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, (kind, help, family) in self.families.items():
+                name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for sample, labels, value in family.samples(name):
+                    lines.append(f"{sample}{format_labels(labels)} "
+                                 f"{format_value(value)}")
+        return "\n".join(lines) + "\n"
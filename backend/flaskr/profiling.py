@@ -0,0 +1,398 @@
+"""
+Profiling shared by the WSGI (Flask) and ASGI applications, to debug
+production latency without echoing every query or redeploying.
+
+- `QueryLog` aggregates the queries run on the engines it is attached
+  to by fingerprint: the statement with its literals and bound
+  parameters replaced by `?`, and its IN lists collapsed. A query
+  slower than DB_SLOW_QUERY_MS is logged with its fingerprint and the
+  types of its parameters (never their values), and on PostgreSQL with
+  its `EXPLAIN` plan, captured at most once per QUERY_EXPLAIN_INTERVAL
+  for each fingerprint.
+- `RequestProfiler` profiles one request, with cProfile or by sampling
+  the stack of its thread, and returns the report as text.
+
+Both are reserved to the holders of PROFILE_TOKEN (see `authorized`).
+"""
+import cProfile
+import hashlib
+import hmac
+import io
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+TOKEN_HEADER = "X-Profile-Token"
+PROFILE_MODES = ("cprofile", "sample")
+
+# Statements EXPLAIN accepts; without ANALYZE it runs none of them.
+EXPLAINABLE = re.compile(r"\s*(select|with|insert|update|delete)\b", re.I)
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMETERS = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+|\?")
+_IN_LISTS = re.compile(r"\bIN \((?:\?, )*\?\)", re.I)
+_ROWS = re.compile(r"(\((?:\?, )*\?\))(?:, \1)+")
+
+# The queries of the request being profiled, if any.
+_profiled_queries = ContextVar("profiled_queries", default=None)
+
+
+def fingerprint(statement):
+    """
+    Returns the normalized text of a statement: queries differing only
+    in their values have the same fingerprint.
+    """
+    text = " ".join(statement.split())
+    text = _STRINGS.sub("?", text)
+    text = _PARAMETERS.sub("?", text)
+    text = _NUMBERS.sub("?", text)
+    text = _IN_LISTS.sub("IN (...)", text)
+    return _ROWS.sub(r"\1, ...", text)
+
+
+def fingerprint_id(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def parameter_shape(parameters, executemany=False):
+    """
+    Describes the bound parameters of a query by their types, e.g.
+    `(int, str)`, with runs of the same type counted (`int*50`).
+    """
+    if executemany:
+        rows = list(parameters)
+        first = parameter_shape(rows[0]) if rows else "()"
+        return f"{len(rows)} x {first}"
+
+    values = parameters.values() if isinstance(parameters, dict) \
+        else parameters or ()
+    runs = []
+    for value in values:
+        name = type(value).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return "(" + ", ".join(name if count == 1 else f"{name}*{count}"
+                           for name, count in runs) + ")"
+
+
+def explain(connection, statement, parameters):
+    """
+    Returns the PostgreSQL plan of a statement, or None. It runs in a
+    savepoint on a cursor of its own, so a failure leaves the
+    transaction and the results of the statement intact.
+    """
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT explain_query")
+        try:
+            cursor.execute("EXPLAIN " + statement, parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        except Exception:
+            cursor.execute("ROLLBACK TO SAVEPOINT explain_query")
+            plan = None
+        cursor.execute("RELEASE SAVEPOINT explain_query")
+        return plan
+    except Exception:
+        return None
+    finally:
+        cursor.close()
+
+
+class QueryStats:
+    """
+    The calls of one query fingerprint.
+    """
+
+    __slots__ = ("fingerprint", "calls", "total", "max", "slow_calls",
+                 "rows", "parameters", "plan", "explained_at")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow_calls = 0
+        self.rows = 0
+        self.parameters = None
+        self.plan = None
+        self.explained_at = None
+
+    def format(self):
+        return {
+            "id": fingerprint_id(self.fingerprint),
+            "fingerprint": self.fingerprint,
+            "calls": self.calls,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.calls, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "slow_calls": self.slow_calls,
+            "rows": self.rows,
+            "parameters": self.parameters,
+            "plan": self.plan
+        }
+
+
+class QueryLog:
+    """
+    Aggregates the queries of the attached engines by fingerprint and
+    logs the slow ones.
+
+    `slow_query_ms` is the threshold of the slow query log (None: no
+    log), `explain` captures the plans of slow queries on PostgreSQL,
+    once per `explain_interval` seconds for each fingerprint, and at
+    most `max_fingerprints` fingerprints are kept: the queries of the
+    others are only counted in `untracked_calls`.
+    """
+
+    def __init__(self, slow_query_ms=None, explain=True,
+                 explain_interval=300, max_fingerprints=1000):
+        self.slow_query_ms = slow_query_ms
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.max_fingerprints = max_fingerprints
+        self.untracked_calls = 0
+        self._lock = threading.Lock()
+        self._queries = {}
+        self._fingerprints = {}
+        self._engines = weakref.WeakSet()
+
+    @classmethod
+    def from_config(cls, config, settings):
+        return cls(slow_query_ms=settings["DB_SLOW_QUERY_MS"],
+                   explain=settings["DB_EXPLAIN_SLOW_QUERIES"],
+                   explain_interval=config["QUERY_EXPLAIN_INTERVAL"],
+                   max_fingerprints=config["QUERY_LOG_MAX_FINGERPRINTS"])
+
+    def attach(self, engine):
+        """
+        Starts recording the queries of an engine (once).
+        """
+        if engine in self._engines:
+            return
+        self._engines.add(engine)
+        event.listen(engine, "before_cursor_execute", self._started)
+        event.listen(engine, "after_cursor_execute", self._finished)
+
+    def _started(self, conn, cursor, statement, parameters, context,
+                 executemany):
+        if context is not None:
+            context._query_log_started = time.perf_counter()
+
+    def _finished(self, conn, cursor, statement, parameters, context,
+                  executemany):
+        started = getattr(context, "_query_log_started", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+
+        # The statements are few: remember their fingerprints.
+        text = self._fingerprints.get(statement)
+        if text is None:
+            text = fingerprint(statement)
+            if len(self._fingerprints) < self.max_fingerprints * 4:
+                self._fingerprints[statement] = text
+
+        slow = self.slow_query_ms is not None and \
+            duration * 1000 >= self.slow_query_ms
+        shape = parameter_shape(parameters, executemany)
+
+        with self._lock:
+            stats = self._queries.get(text)
+            if stats is None:
+                if len(self._queries) >= self.max_fingerprints:
+                    self.untracked_calls += 1
+                    stats = QueryStats(text)
+                else:
+                    stats = self._queries[text] = QueryStats(text)
+            stats.calls += 1
+            stats.total += duration
+            stats.max = max(stats.max, duration)
+            stats.parameters = shape
+            if cursor.rowcount > 0:
+                stats.rows += cursor.rowcount
+            explain_now = slow and self._explains(conn, statement,
+                                                  executemany, stats)
+            if slow:
+                stats.slow_calls += 1
+
+        queries = _profiled_queries.get()
+        if queries is not None:
+            queries.append((duration, text))
+
+        if not slow:
+            return
+        if explain_now:
+            stats.plan = explain(conn, statement, parameters)
+        logger.warning("slow query %.1f ms [%s] %s %s%s",
+                       duration * 1000, fingerprint_id(text), text, shape,
+                       "\n" + stats.plan if explain_now and stats.plan
+                       else "")
+
+    def _explains(self, conn, statement, executemany, stats):
+        # Called with the lock held.
+        if not (self.explain and not executemany and
+                conn.dialect.name == "postgresql" and
+                EXPLAINABLE.match(statement)):
+            return False
+        now = time.monotonic()
+        if stats.explained_at is not None and \
+                now - stats.explained_at < self.explain_interval:
+            return False
+        stats.explained_at = now
+        return True
+
+    def top(self, limit=10, sort="total"):
+        """
+        Returns the `limit` fingerprints with the highest total, mean or
+        max time, or the most calls.
+        """
+        key = {
+            "total": lambda stats: stats.total,
+            "mean": lambda stats: stats.total / stats.calls,
+            "max": lambda stats: stats.max,
+            "calls": lambda stats: stats.calls
+        }[sort]
+        with self._lock:
+            queries = sorted(self._queries.values(), key=key, reverse=True)
+            return [stats.format() for stats in queries[:limit]]
+
+
+def authorized(token, expected):
+    """
+    Whether a request's profile token is the configured PROFILE_TOKEN;
+    without one, profiling is disabled.
+    """
+    return bool(expected and token) and \
+        hmac.compare_digest(token.encode(), expected.encode())
+
+
+def frame_name(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}" \
+           f"({code.co_name})"
+
+
+class StackSampler:
+    """
+    A statistical profiler: samples the stack of one thread every
+    `interval` seconds from a thread of its own.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="stack-sampler")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def report(self, limit):
+        samples = sum(self.stacks.values())
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                total[name] += count
+
+        lines = [f"{samples} samples, one every "
+                 f"{self.interval * 1000:g} ms", "",
+                 "   own  total  function"]
+        for name, count in total.most_common(limit):
+            lines.append(f"{own[name] * 100 / samples:5.1f}% "
+                         f"{count * 100 / samples:5.1f}%  {name}")
+        lines += ["", "Folded stacks:"]
+        lines += [";".join(stack) + f" {count}"
+                  for stack, count in self.stacks.most_common(limit)]
+        return "\n".join(lines)
+
+
+class RequestProfiler:
+    """
+    Profiles one request, from `start` to `stop`, which returns the
+    report: the `limit` busiest functions and the queries of the
+    request. A process profiles one request at a time; `start` returns
+    False while another one is profiled.
+    """
+
+    _running = threading.Lock()
+
+    def __init__(self, mode="cprofile", interval=0.001, limit=40):
+        self.mode = mode
+        self.interval = interval
+        self.limit = limit
+        self._profiler = None
+        self._queries = None
+        self._token = None
+        self._started = None
+
+    def start(self):
+        if not self._running.acquire(blocking=False):
+            return False
+        if self.mode == "sample":
+            self._profiler = StackSampler(threading.get_ident(),
+                                          self.interval)
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._queries = []
+        self._token = _profiled_queries.set(self._queries)
+        self._started = time.perf_counter()
+        return True
+
+    def stop(self):
+        if self._profiler is None:
+            return None
+        elapsed = time.perf_counter() - self._started
+        if self.mode == "sample":
+            self._profiler.stop()
+            functions = self._profiler.report(self.limit)
+        else:
+            self._profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(self._profiler, stream=output) \
+                  .sort_stats("cumulative") \
+                  .print_stats(self.limit)
+            functions = output.getvalue().strip()
+        _profiled_queries.reset(self._token)
+        self._profiler = None
+        self._running.release()
+
+        query_time = sum(duration for duration, text in self._queries)
+        queries = [f"{len(self._queries)} queries, "
+                   f"{query_time * 1000:.2f} ms"]
+        queries += [f"{duration * 1000:8.2f} ms  {text}"
+                    for duration, text in self._queries]
+        return "\n".join([f"{self.mode} profile of {elapsed * 1000:.2f} ms",
+                          "", functions, "", *queries]) + "\n"
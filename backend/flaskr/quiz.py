@@ -0,0 +1,291 @@
+import random
+import time
+from bisect import bisect_left, insort
+
+from models import db, Question
+from .serialization import ROW_COLUMNS, format_row
+from .snapshot import Snapshot
+
+
+def category_key(category):
+    """
+    Normalizes a category value to the key used by the quiz index.
+    """
+    if category is None:
+        return None
+    try:
+        return int(category)
+    except (TypeError, ValueError):
+        return category
+
+
+class IdPool:
+    """
+    An unordered array of question ids with O(1) add, remove and
+    membership, used as the population of a random draw, and the same
+    ids in sorted order for the seeded draws.
+    """
+
+    __slots__ = ("ids", "positions", "sorted_ids")
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+        self.sorted_ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, question_id):
+        return question_id in self.positions
+
+    def add(self, question_id):
+        if question_id in self.positions:
+            return
+        self.positions[question_id] = len(self.ids)
+        self.ids.append(question_id)
+        if not self.sorted_ids or self.sorted_ids[-1] < question_id:
+            self.sorted_ids.append(question_id)
+        else:
+            insort(self.sorted_ids, question_id)
+
+    def remove(self, question_id):
+        position = self.positions.pop(question_id, None)
+        if position is None:
+            return
+        del self.sorted_ids[bisect_left(self.sorted_ids, question_id)]
+        last = self.ids.pop()
+        if position < len(self.ids):
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def draw(self, rng, excluded=()):
+        """
+        Returns a random id that is not in `excluded`, or None.
+        """
+        drawn = self.draw_many(rng, 1, excluded)
+        return drawn[0] if drawn else None
+
+    def draw_many(self, rng, count, excluded=()):
+        """
+        Returns up to `count` distinct random ids that are not in
+        `excluded`.
+
+        Runs a partial Fisher-Yates shuffle in place and stops once
+        enough ids that are not excluded came up, so only the excluded
+        ids that happen to come up are visited and every id is visited
+        at most once per draw.
+        """
+        ids = self.ids
+        positions = self.positions
+        size = len(ids)
+        drawn = []
+
+        for i in range(size):
+            if len(drawn) == count:
+                break
+            j = rng.randrange(i, size)
+            ids[i], ids[j] = ids[j], ids[i]
+            positions[ids[i]] = i
+            positions[ids[j]] = j
+            if ids[i] not in excluded:
+                drawn.append(ids[i])
+
+        return drawn
+
+    def draw_sorted(self, rng, count, excluded=()):
+        """
+        Returns up to `count` distinct random ids that are not in
+        `excluded`, drawn from the ids in sorted order: the same `rng`
+        state draws the same ids whatever order the pool is in.
+
+        Runs the partial Fisher-Yates shuffle of `draw_many` over the
+        positions of the sorted ids, without moving them: the positions
+        swapped so far are kept in a dictionary.
+        """
+        ids = self.sorted_ids
+        size = len(ids)
+        swapped = {}
+        drawn = []
+
+        for i in range(size):
+            if len(drawn) == count:
+                break
+            j = rng.randrange(i, size)
+            position = swapped.get(j, j)
+            swapped[j] = swapped.get(i, i)
+            if ids[position] not in excluded:
+                drawn.append(ids[position])
+
+        return drawn
+
+
+class QuizSampler(Snapshot):
+    """
+    Picks random quiz questions from an in-memory index of question ids
+    grouped by category.
+
+    The index is loaded lazily with a single query over (id, category)
+    and kept current by `question_changed`. It is reloaded once it is
+    older than `max_age` seconds so that writes made by other processes
+    are eventually picked up. A draw only loads the chosen question.
+    """
+
+    def __init__(self, max_age=None, rng=None):
+        super().__init__()
+        self.max_age = max_age
+        self._rng = rng or random.Random()
+        self._pools = None
+        self._categories = None
+        self._loaded_at = 0
+
+    def _is_loaded(self):
+        return self._pools is not None
+
+    def _is_stale(self):
+        if self.max_age is None:
+            return False
+        return time.monotonic() - self._loaded_at > self.max_age
+
+    def _read(self, session):
+        pools = {None: IdPool()}
+        categories = {}
+        rows = session.query(Question.id, Question.category) \
+                      .order_by(Question.id)
+
+        for question_id, category in rows:
+            category = category_key(category)
+            categories[question_id] = category
+            pools[None].add(question_id)
+            if category is not None:
+                pools.setdefault(category, IdPool()).add(question_id)
+
+        return pools, categories
+
+    def _install(self, index):
+        self._pools, self._categories = index
+        self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """
+        Drops the index; it is reloaded on the next draw.
+        """
+        with self._lock:
+            self._changed()
+            self._pools = None
+            self._categories = None
+
+    def add(self, question_id, category):
+        with self._lock:
+            self._changed()
+            if self._pools is None:
+                return
+            category = category_key(category)
+            self._categories[question_id] = category
+            self._pools[None].add(question_id)
+            if category is not None:
+                self._pools.setdefault(category, IdPool()).add(question_id)
+
+    def remove(self, question_id):
+        with self._lock:
+            self._changed()
+            if self._pools is None:
+                return
+            category = self._categories.pop(question_id, None)
+            self._pools[None].remove(question_id)
+            if category in self._pools:
+                self._pools[category].remove(question_id)
+
+    def question_changed(self, event, question):
+        """
+        Question listener keeping the index current.
+        """
+        if event == "reset":
+            self.invalidate()
+            return
+        if event in ("update", "delete"):
+            self.remove(question["id"])
+        if event in ("insert", "update"):
+            self.add(question["id"], question["category"])
+
+    def draw_id(self, category=None, excluded=(), session=None):
+        """
+        Returns a random question id of the category (all categories
+        when `category` is falsy) that is not in `excluded`, or None.
+        """
+        with self._current(session):
+            pool = self._pools.get(category_key(category) or None)
+            if pool is None:
+                return None
+            return pool.draw(self._rng, excluded)
+
+    def draw_ids(self, count, category=None, excluded=(), rng=None,
+                 session=None):
+        """
+        Returns up to `count` distinct random question ids of the
+        category that are not in `excluded`.
+
+        With an `rng` of its own (a seeded deck) the ids are drawn from
+        the sorted candidates, so the same seed deals the same ids for
+        the same questions whatever order the index is in.
+        """
+        with self._current(session):
+            pool = self._pools.get(category_key(category) or None)
+            if pool is None:
+                return []
+            if rng is None:
+                return pool.draw_many(self._rng, count, excluded)
+            return pool.draw_sorted(rng, count, excluded)
+
+    def deal(self, size, category=None, excluded=(), seed=None,
+             session=None):
+        """
+        Returns a deck of up to `size` distinct random questions of the
+        category that are not in `excluded`, as `Question.format()`
+        dictionaries loaded with a single query. The same `seed` deals
+        the same deck for the same questions.
+        """
+        session = session or db.session
+        rng = random.Random(seed) if seed is not None else None
+        excluded = set(excluded)
+        deck = []
+
+        while len(deck) < size:
+            ids = self.draw_ids(size - len(deck), category, excluded, rng,
+                                session)
+            if not ids:
+                break
+
+            rows = session.query(*ROW_COLUMNS) \
+                          .filter(Question.id.in_(ids))
+            questions = {row.id: format_row(row) for row in rows}
+            for question_id in ids:
+                excluded.add(question_id)
+                if question_id in questions:
+                    deck.append(questions[question_id])
+                else:
+                    # Deleted by another process since the index was
+                    # loaded; the next round draws a replacement.
+                    self.remove(question_id)
+
+        return deck
+
+    def sample(self, category=None, excluded=(), session=None):
+        """
+        Returns a random question of the category that is not in
+        `excluded`, or None when there is none left.
+
+        Uses the app's `db.session` unless another session is given.
+        """
+        session = session or db.session
+        while True:
+            question_id = self.draw_id(category, excluded, session)
+            if question_id is None:
+                return None
+
+            question = session.get(Question, question_id)
+            if question is not None:
+                return question
+
+            # Deleted by another process since the index was loaded.
+            self.remove(question_id)
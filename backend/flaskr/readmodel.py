@@ -0,0 +1,166 @@
+import time
+from bisect import bisect_left, insort
+
+from models import Question, Category
+from .snapshot import Snapshot
+from .validation import ROW_FIELDS, page_response, sorted_page
+
+
+class QuestionRecord:
+    """
+    A read-only question, lighter than a `Question` instance.
+    """
+
+    __slots__ = ("id", "question", "answer", "category", "difficulty")
+
+    def __init__(self, id, question, answer, category, difficulty):
+        self.id = id
+        self.question = question
+        self.answer = answer
+        self.category = category
+        self.difficulty = difficulty
+
+    def format(self, fields=ROW_FIELDS):
+        return {field: getattr(self, field) for field in fields}
+
+
+class ReadModel(Snapshot):
+    """
+    An in-memory snapshot of the categories and questions serving the
+    GET endpoints without querying the database.
+
+    Questions are kept as `QuestionRecord`s by id together with sorted id
+    arrays, one for all questions and one per category, so a page is a
+    slice and a cursor is a binary search. The snapshot follows the
+    question listeners and is reloaded once it is older than
+    `max_staleness` seconds, which bounds how long writes made by other
+    workers can go unseen.
+    """
+
+    def __init__(self, max_staleness=None):
+        super().__init__()
+        self.max_staleness = max_staleness
+        self._loaded_at = 0
+        self._categories = None
+        self._records = None
+        self._ids = None
+        self._category_ids = None
+
+    def _is_loaded(self):
+        return self._records is not None
+
+    def _is_stale(self):
+        if self.max_staleness is None:
+            return False
+        return time.monotonic() - self._loaded_at > self.max_staleness
+
+    def _read(self, session):
+        categories = session.query(Category.id, Category.type) \
+                            .order_by(Category.type) \
+                            .all()
+        rows = session.query(Question.id,
+                             Question.question,
+                             Question.answer,
+                             Question.category,
+                             Question.difficulty) \
+                      .order_by(Question.id)
+
+        records = {}
+        ids = []
+        category_ids = {}
+        for row in rows:
+            record = QuestionRecord(*row)
+            records[record.id] = record
+            ids.append(record.id)
+            category_ids.setdefault(self._category_key(record.category),
+                                    []).append(record.id)
+        return ([tuple(category) for category in categories], records, ids,
+                category_ids)
+
+    def _install(self, snapshot):
+        self._categories, self._records, self._ids, self._category_ids = \
+            snapshot
+        self._loaded_at = time.monotonic()
+
+    def _category_key(self, category):
+        return str(category) if category is not None else None
+
+    def _add(self, record):
+        self._records[record.id] = record
+        for ids in (self._ids, self._category_ids.setdefault(
+                self._category_key(record.category), [])):
+            if not ids or ids[-1] < record.id:
+                ids.append(record.id)
+            else:
+                insort(ids, record.id)
+
+    def _remove(self, question_id):
+        record = self._records.pop(question_id, None)
+        if record is None:
+            return
+        for ids in (self._ids, self._category_ids.get(
+                self._category_key(record.category), [])):
+            position = bisect_left(ids, question_id)
+            if position < len(ids) and ids[position] == question_id:
+                del ids[position]
+
+    def invalidate(self):
+        with self._lock:
+            self._changed()
+            self._records = None
+
+    def question_changed(self, event, question):
+        """
+        Question listener keeping the snapshot current.
+        """
+        with self._lock:
+            self._changed()
+            if self._records is None:
+                return
+            if event == "reset":
+                self._records = None
+                return
+            if event in ("update", "delete"):
+                self._remove(question["id"])
+            if event in ("insert", "update"):
+                self._add(QuestionRecord(**question))
+
+    def categories(self, session=None):
+        """
+        Returns the (id, type) pairs of the categories ordered by type.
+        The snapshot is loaded with the app's `db.session` unless another
+        session is given.
+        """
+        with self._current(session):
+            return self._categories
+
+    def category(self, category_id, session=None):
+        """
+        Returns the type of the category, or None.
+        """
+        for id, type in self.categories(session):
+            if id == category_id:
+                return type
+        return None
+
+    def paginate(self, page_arguments, category=None, fields=ROW_FIELDS,
+                 session=None):
+        """
+        Returns a page of questions (of one category if given) with the
+        given fields, in the shape of `storage.paginate_questions`.
+        """
+        with self._current(session):
+            if category is None:
+                ids = self._ids
+            else:
+                ids = self._category_ids.get(self._category_key(category), [])
+
+            page_ids, next_cursor = sorted_page(page_arguments, ids)
+
+            return page_response(
+                page_arguments,
+                [self._records[question_id].format(fields)
+                 for question_id in page_ids],
+                len(ids),
+                next_cursor
+            )
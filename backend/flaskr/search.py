@@ -0,0 +1,194 @@
+import time
+
+from models import Question
+from .snapshot import Snapshot
+
+# Separates the question from the answer in the indexed text; it never
+# occurs in a normalized search term, so no match spans both fields.
+FIELD_SEPARATOR = "\x00"
+
+
+def normalize(text):
+    """
+    Case folds a text and collapses its whitespace.
+    """
+    return " ".join((text or "").casefold().split())
+
+
+def trigrams(text):
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+
+def _is_word_char(char):
+    return char.isalnum()
+
+
+class SearchIndex(Snapshot):
+    """
+    An in-memory trigram index over question texts (and optionally
+    answers) for substring search.
+
+    A term of three or more characters is looked up by intersecting the
+    posting lists of its trigrams, so only questions containing every
+    trigram are checked for the actual substring. Shorter terms fall
+    back to checking every indexed text in memory.
+
+    Like `QuizSampler`, the index is loaded lazily, kept current by
+    `question_changed`, and reloaded once older than `max_age` seconds.
+    """
+
+    def __init__(self, include_answers=False, max_age=None):
+        super().__init__()
+        self.include_answers = include_answers
+        self.max_age = max_age
+        self._texts = None
+        self._postings = None
+        self._loaded_at = 0
+
+    def _is_loaded(self):
+        return self._texts is not None
+
+    def _is_stale(self):
+        if self.max_age is None:
+            return False
+        return time.monotonic() - self._loaded_at > self.max_age
+
+    def _document(self, question, answer):
+        text = normalize(question)
+        if self.include_answers:
+            text += FIELD_SEPARATOR + normalize(answer)
+        return text
+
+    @staticmethod
+    def _index(texts, postings, question_id, text):
+        texts[question_id] = text
+        for trigram in trigrams(text):
+            postings.setdefault(trigram, set()).add(question_id)
+
+    def _unindex(self, question_id):
+        text = self._texts.pop(question_id, None)
+        if text is None:
+            return
+        for trigram in trigrams(text):
+            postings = self._postings.get(trigram)
+            if postings is not None:
+                postings.discard(question_id)
+                if not postings:
+                    del self._postings[trigram]
+
+    def _read(self, session):
+        return self._index_rows(session.query(Question.id,
+                                              Question.question,
+                                              Question.answer))
+
+    def _index_rows(self, rows):
+        texts = {}
+        postings = {}
+        for question_id, question, answer in rows:
+            self._index(texts, postings, question_id,
+                        self._document(question, answer))
+        return texts, postings
+
+    def _install(self, index):
+        self._texts, self._postings = index
+        self._loaded_at = time.monotonic()
+
+    def load(self, rows):
+        """
+        Indexes (id, question, answer) rows in place of the current
+        index, for an index that is not loaded from the database.
+        """
+        index = self._index_rows(rows)
+        with self._lock:
+            self._changed()
+            self._install(index)
+
+    def invalidate(self):
+        """
+        Drops the index; it is reloaded on the next search.
+        """
+        with self._lock:
+            self._changed()
+            self._texts = None
+            self._postings = None
+
+    def add(self, question_id, question, answer=None):
+        with self._lock:
+            self._changed()
+            if self._texts is None:
+                return
+            self._unindex(question_id)
+            self._index(self._texts, self._postings, question_id,
+                        self._document(question, answer))
+
+    def remove(self, question_id):
+        with self._lock:
+            self._changed()
+            if self._texts is None:
+                return
+            self._unindex(question_id)
+
+    def question_changed(self, event, question):
+        """
+        Question listener keeping the index current.
+        """
+        if event == "reset":
+            self.invalidate()
+        elif event == "delete":
+            self.remove(question["id"])
+        else:
+            self.add(question["id"], question["question"], question["answer"])
+
+    @staticmethod
+    def _rank(question_id, text, term):
+        """
+        Orders matches: whole words before word prefixes before other
+        substrings, matches in the question before matches in the
+        answer, earlier matches first, then by id.
+        """
+        position = text.find(term)
+        end = position + len(term)
+        starts_word = position == 0 or not _is_word_char(text[position-1])
+        ends_word = end == len(text) or not _is_word_char(text[end])
+
+        if starts_word and ends_word:
+            kind = 0
+        elif starts_word:
+            kind = 1
+        else:
+            kind = 2
+
+        in_answer = FIELD_SEPARATOR in text[:position]
+
+        return (in_answer, kind, position, question_id)
+
+    def search(self, term, session=None):
+        """
+        Returns the ids of the questions containing the term, most
+        relevant first. The index is loaded with the app's `db.session`
+        unless another session is given.
+        """
+        term = normalize(term)
+        if not term:
+            return []
+
+        with self._current(session):
+            if len(term) < 3:
+                candidates = self._texts.keys()
+            else:
+                postings = sorted(
+                    (self._postings.get(trigram, ())
+                     for trigram in trigrams(term)),
+                    key=len
+                )
+                candidates = set(postings[0]).intersection(*postings[1:])
+
+            matches = [
+                self._rank(question_id, self._texts[question_id], term)
+                for question_id in candidates
+                if term in self._texts[question_id]
+            ]
+
+        matches.sort()
+
+        return [match[-1] for match in matches]
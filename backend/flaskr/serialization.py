@@ -0,0 +1,96 @@
+"""
+Fast paths for listing questions: reading them as plain rows of columns
+instead of `Question` instances, and encoding JSON with orjson when it
+is installed.
+
+`dumps` returns exactly the bytes of
+`json.dumps(obj, sort_keys=True, separators=(",", ":"))`, the compact
+output of Flask's `jsonify`: whenever orjson would encode a value
+differently (non-ASCII text, which the standard library escapes, or a
+type orjson does not handle the same way) the standard library is used.
+The responses hold no floats, which orjson would also write differently
+in exponent notation (1e+20 is 1e20).
+"""
+import json
+import re
+
+from flask.json.provider import DefaultJSONProvider
+
+from models import Question
+from .validation import ROW_FIELDS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ROW_COLUMNS = tuple(getattr(Question, field) for field in ROW_FIELDS)
+
+# Bytes the standard library escapes (ensure_ascii) and orjson does not.
+_UNESCAPED = re.compile(rb"[\x7f-\xff]")
+
+
+def row_columns(fields=ROW_FIELDS):
+    """
+    Returns the columns to select for the given question fields.
+    """
+    if fields == ROW_FIELDS:
+        return ROW_COLUMNS
+    return tuple(getattr(Question, field) for field in fields)
+
+
+def format_row(row, fields=ROW_FIELDS):
+    """
+    Returns the `Question.format()` dictionary of a row of the columns
+    of `fields` (all of them by default).
+    """
+    return dict(zip(fields, row))
+
+
+def _unsupported(value):
+    raise TypeError
+
+
+def dumps(obj):
+    """
+    Encodes a value as compact JSON with sorted keys, as bytes.
+    """
+    if orjson is not None:
+        try:
+            data = orjson.dumps(
+                obj,
+                default=_unsupported,
+                option=(orjson.OPT_SORT_KEYS |
+                        orjson.OPT_PASSTHROUGH_DATETIME |
+                        orjson.OPT_PASSTHROUGH_DATACLASS |
+                        orjson.OPT_PASSTHROUGH_SUBCLASS)
+            )
+        except TypeError:
+            pass
+        else:
+            if not _UNESCAPED.search(data):
+                return data
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider encoding compact responses with `dumps`. Pretty
+    printed responses (debug mode) and values the standard library needs
+    Flask's `default` for are encoded as before.
+    """
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or \
+                (self.compact is None and self._app.debug) or \
+                not self.sort_keys or not self.ensure_ascii:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            data = dumps(obj)
+        except TypeError:
+            return super().response(*args, **kwargs)
+
+        return self._app.response_class(data + b"\n",
+                                        mimetype=self.mimetype)
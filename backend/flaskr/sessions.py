@@ -0,0 +1,217 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+class SeenSet:
+    """
+    A compact set of question ids stored as a bitmap.
+
+    Bit `n` stands for question id `offset + n`. The offset is set by the
+    first id added, so a session that only sees high ids does not pay for
+    the low ones.
+    """
+
+    __slots__ = ("offset", "bits")
+
+    def __init__(self, offset=0, bits=b""):
+        self.offset = offset
+        self.bits = bytearray(bits)
+
+    def __contains__(self, question_id):
+        index = question_id - self.offset
+        if index < 0 or index >= len(self.bits) * 8:
+            return False
+        return bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def __len__(self):
+        return sum(bin(byte).count("1") for byte in self.bits)
+
+    def __iter__(self):
+        for position, byte in enumerate(self.bits):
+            for bit in range(8):
+                if byte & (1 << bit):
+                    yield self.offset + position * 8 + bit
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+    def add(self, question_id):
+        if not self.bits:
+            self.offset = question_id - question_id % 8
+        elif question_id < self.offset:
+            offset = question_id - question_id % 8
+            self.bits[0:0] = bytes((self.offset - offset) // 8)
+            self.offset = offset
+
+        index = question_id - self.offset
+        if index >= len(self.bits) * 8:
+            self.bits.extend(bytes((index >> 3) + 1 - len(self.bits)))
+        self.bits[index >> 3] |= 1 << (index & 7)
+
+    def to_bytes(self):
+        return self.offset.to_bytes(8, "big") + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(int.from_bytes(data[:8], "big"), data[8:])
+
+
+class QuizSession:
+    """
+    The state of one quiz game: its category and the questions already
+    played.
+    """
+
+    __slots__ = ("token", "category", "seen", "expires_at")
+
+    def __init__(self, token, category, seen=None, expires_at=None):
+        self.token = token
+        self.category = category
+        self.seen = seen if seen is not None else SeenSet()
+        self.expires_at = expires_at
+
+
+class QuizSessionStore:
+    """
+    Interface of the quiz session storage.
+
+    The in-process implementation is `MemoryQuizSessionStore`. A shared
+    store (e.g. Redis) can implement the same methods, persisting
+    `QuizSession.seen` with `SeenSet.to_bytes`.
+    """
+
+    def create(self, category):
+        """
+        Starts a session for the category and returns it.
+        """
+        raise NotImplementedError
+
+    def get(self, token):
+        """
+        Returns the live session with the token, or None.
+        """
+        raise NotImplementedError
+
+    def save(self, session):
+        """
+        Persists the changes made to a session and extends its lifetime.
+        """
+        raise NotImplementedError
+
+    def claim(self, token, question_id):
+        """
+        Marks a question as played in a session and extends its lifetime,
+        atomically. Returns True, False when the session already played
+        it, or None when there is no such session.
+        """
+        raise NotImplementedError
+
+    def draw_next(self, token, draw):
+        """
+        Draws the next question of a session with `draw(category,
+        excluded)` and marks it as played: concurrent draws of a session
+        never return the same question. Returns the question, or None
+        when the session has played them all; raises `KeyError` when
+        there is no such session.
+        """
+        while True:
+            session = self.get(token)
+            if session is None:
+                raise KeyError(token)
+            question = draw(session.category, session.seen)
+            # Drawn again when a concurrent draw claimed it first.
+            if question is None or self.claim(token, question["id"]):
+                return question
+
+    def delete(self, token):
+        """
+        Ends a session.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def new_token():
+        return secrets.token_urlsafe(16)
+
+
+class MemoryQuizSessionStore(QuizSessionStore):
+    """
+    Keeps quiz sessions in process memory.
+
+    Sessions expire `ttl` seconds after their last use. The store holds
+    at most `max_sessions` sessions and `max_bytes` bytes of bitmaps; the
+    least recently used sessions are evicted first when a bound is hit.
+    """
+
+    def __init__(self, ttl=3600, max_sessions=10000, max_bytes=64 << 20):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._sizes = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _drop(self, token):
+        self._sessions.pop(token, None)
+        self._nbytes -= self._sizes.pop(token, 0)
+
+    def _evict(self, now):
+        while self._sessions:
+            token, session = next(iter(self._sessions.items()))
+            if (session.expires_at > now and
+                    len(self._sessions) <= self.max_sessions and
+                    self._nbytes <= self.max_bytes):
+                break
+            self._drop(token)
+
+    def create(self, category):
+        session = QuizSession(self.new_token(), category)
+        self.save(session)
+        return session
+
+    def get(self, token):
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            if session.expires_at <= time.monotonic():
+                self._drop(token)
+                return None
+            return session
+
+    def _store(self, session, now):
+        session.expires_at = now + self.ttl
+        self._sessions[session.token] = session
+        self._sessions.move_to_end(session.token)
+        size = session.seen.nbytes
+        self._nbytes += size - self._sizes.get(session.token, 0)
+        self._sizes[session.token] = size
+        self._evict(now)
+
+    def save(self, session):
+        with self._lock:
+            self._store(session, time.monotonic())
+
+    def claim(self, token, question_id):
+        with self._lock:
+            now = time.monotonic()
+            session = self._sessions.get(token)
+            if session is None or session.expires_at <= now:
+                self._drop(token)
+                return None
+            if question_id in session.seen:
+                return False
+            session.seen.add(question_id)
+            self._store(session, now)
+            return True
+
+    def delete(self, token):
+        with self._lock:
+            self._drop(token)
@@ -0,0 +1,70 @@
+import threading
+from contextlib import contextmanager
+
+from models import db
+
+
+class Snapshot:
+    """
+    Base of the in-memory structures loaded from the database and then
+    kept current by the question listeners.
+
+    The rows are read without holding the lock, so a query waiting on the
+    database never blocks the requests using the structure meanwhile: in
+    create_asgi_app these run on the same thread, as the greenlets of
+    `run_sync`, where waiting for the lock would stall the event loop. A
+    stale structure keeps serving while one request reloads it, and a
+    load overtaken by a change is dropped: the next request loads again.
+
+    Subclasses implement `_is_loaded`, `_is_stale`, `_read(session)`,
+    returning what `_install` takes, and `_install`; they call `_changed`
+    with the lock held on every change, loaded or not.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._reloading = False
+
+    def _changed(self):
+        self._version += 1
+
+    @contextmanager
+    def _current(self, session=None):
+        """
+        Holds the lock over the loaded structure, loading it first when
+        missing or stale, with the app's `db.session` unless another
+        session is given.
+        """
+        while True:
+            with self._lock:
+                loaded = self._is_loaded()
+                if loaded and (self._reloading or not self._is_stale()):
+                    yield
+                    return
+                # A structure being loaded for the first time has nothing
+                # to serve meanwhile: every request waiting for it loads.
+                self._reloading = loaded
+                version = self._version
+
+            try:
+                snapshot = self._read(session or db.session)
+            except Exception:
+                if loaded:
+                    with self._lock:
+                        self._reloading = False
+                raise
+
+            with self._lock:
+                if loaded:
+                    self._reloading = False
+                if self._version == version:
+                    self._install(snapshot)
+                    self._changed()
+                    yield
+                    return
+                if self._is_loaded():
+                    # Overtaken by a change: the current structure, kept
+                    # up to date, serves until the next reload.
+                    yield
+                    return
@@ -0,0 +1,531 @@
+"""
+Storage behind the views of create_app. The views only call a
+`QuestionStore`, picked with the STORAGE_BACKEND setting:
+
+- "database" (the default): `DatabaseQuestionStore`, SQLAlchemy queries
+  on the app's `db.session`.
+- "memory": `MemoryQuestionStore` (flaskr/memory.py), an embedded
+  in-memory engine needing no database server.
+
+The views of create_asgi_app call the same stores: the database store
+runs on the sync session of an async one, in its `run_sync`.
+"""
+import copy
+import threading
+from contextlib import contextmanager
+
+from models import (
+    DB_PATH, db, setup_db, register_question_listener,
+    notify_question_listeners, Question, Category
+)
+from .bulk import (
+    BulkImport, EXPORT_FIELDS, delete_questions, export_questions
+)
+from .counters import QuestionCounts
+from .groupcommit import GroupCommitWriter
+from .quiz import QuizSampler
+from .readmodel import ReadModel
+from .search import SearchIndex
+from .serialization import row_columns, format_row
+from .suggest import SuggestIndex
+from .validation import ROW_FIELDS, page_slice, page_response
+
+
+class QuestionStore:
+    """
+    Interface of the question storage.
+
+    Questions are returned as `Question.format()` dictionaries (limited
+    to `fields` where a method takes them) and pages in the shape of
+    `page_response`. Writes notify the question listeners.
+    """
+
+    def categories(self):
+        """
+        Returns the (id, type) pairs of the categories ordered by type.
+        """
+        raise NotImplementedError
+
+    def category(self, category_id):
+        """
+        Returns the type of the category, or None.
+        """
+        raise NotImplementedError
+
+    def total(self):
+        """
+        Returns the number of questions.
+        """
+        raise NotImplementedError
+
+    def category_counts(self):
+        """
+        Returns the number of questions of each category, by category id.
+        """
+        raise NotImplementedError
+
+    def page(self, page_arguments, category=None, fields=ROW_FIELDS):
+        """
+        Returns a page of questions in id order, of one category if
+        given.
+        """
+        raise NotImplementedError
+
+    def search(self, term, page_arguments, fields=ROW_FIELDS):
+        """
+        Returns a page of the questions containing the term.
+        """
+        raise NotImplementedError
+
+    def suggest(self, prefix, limit):
+        """
+        Returns the `completions` of the last word of the prefix and the
+        `questions` (id and text) matching it, at most `limit` of each.
+        """
+        raise NotImplementedError
+
+    def insert(self, fields):
+        """
+        Creates a question from the fields of `validate_question` and
+        returns it.
+        """
+        raise NotImplementedError
+
+    def delete(self, question_id):
+        """
+        Deletes a question and returns it, or returns None when there is
+        no such question.
+        """
+        raise NotImplementedError
+
+    def delete_many(self, question_ids):
+        """
+        Deletes the questions with the given ids at once and returns the
+        deleted questions.
+        """
+        raise NotImplementedError
+
+    def importer(self):
+        """
+        Returns an import of `read_ndjson` or `read_csv` rows, fed with
+        `add(rows)` as many times as needed; `finish()` returns the
+        import report. It is a context manager notifying the question
+        listeners when it is left.
+        """
+        raise NotImplementedError
+
+    def import_rows(self, rows):
+        """
+        Creates questions from `read_ndjson` or `read_csv` rows and
+        returns the import report.
+        """
+        with self.importer() as importer:
+            importer.add(rows)
+            return importer.finish()
+
+    def export(self, export_format, category=None, min_id=None,
+               max_id=None):
+        """
+        Returns an iterator over the NDJSON or CSV text of the questions
+        in id order, optionally filtered by category and id range.
+        """
+        raise NotImplementedError
+
+    def sample(self, category=None, excluded=()):
+        """
+        Returns a random question of the category (all categories when
+        falsy) that is not in `excluded`, or None.
+        """
+        raise NotImplementedError
+
+    def deal(self, size, category=None, excluded=(), seed=None):
+        """
+        Returns up to `size` distinct random questions of the category
+        that are not in `excluded`; the same seed deals the same deck.
+        """
+        raise NotImplementedError
+
+
+def paginate_questions(page_arguments, selection, total_questions=None,
+                       fields=ROW_FIELDS):
+    """
+    Reads one page of questions from a (not yet executed) query.
+
+    Only the requested page is loaded: the page is pushed down to the
+    database as LIMIT/OFFSET and the total comes from a separate COUNT,
+    unless it is already known and passed as `total_questions`.
+    Passing `after=<id>` switches to keyset pagination, which reads the
+    questions with an id greater than the cursor and returns the cursor
+    of the next page in `next_cursor`. The questions are read as rows of
+    the columns of `fields`, without building `Question` instances.
+    """
+    page, limit, after = page_arguments
+    if total_questions is None:
+        total_questions = selection.order_by(None).count()
+    next_cursor = None
+    selection = selection.with_entities(*row_columns(fields))
+
+    if after is None:
+        questions = selection.order_by(Question.id) \
+                             .offset((page-1) * limit) \
+                             .limit(limit) \
+                             .all() if page >= 1 else []
+    else:
+        questions = selection.filter(Question.id > after) \
+                             .order_by(Question.id) \
+                             .limit(limit + 1) \
+                             .all()
+        if len(questions) > limit:
+            questions = questions[:limit]
+            next_cursor = questions[-1].id
+
+    return page_response(page_arguments,
+                         [format_row(question, fields)
+                          for question in questions],
+                         total_questions,
+                         next_cursor)
+
+
+def paginate_question_ids(page_arguments, question_ids, fields=ROW_FIELDS,
+                          session=None):
+    """
+    Reads one page of questions from an already ranked list of ids,
+    keeping the order of the list.
+
+    Takes the same arguments as `paginate_questions`; with `after=<id>`
+    the page starts after that id's position in the list. Uses the app's
+    `db.session` unless another session is given.
+    """
+    page_ids, next_cursor = page_slice(page_arguments, question_ids)
+    session = session or db.session
+
+    questions = {
+        question.id: question
+        for question in session.query(*row_columns(fields))
+                               .filter(Question.id.in_(page_ids))
+    } if page_ids else {}
+
+    return page_response(page_arguments,
+                         [format_row(questions[question_id], fields)
+                          for question_id in page_ids
+                          if question_id in questions],
+                         len(question_ids),
+                         next_cursor)
+
+
+class DatabaseImport(BulkImport):
+    """
+    The `BulkImport` of `DatabaseQuestionStore.importer`, asking the
+    question listeners to reload once it is left if it wrote anything.
+    """
+
+    def __init__(self, notify, **options):
+        super().__init__(**options)
+        self.notify = notify
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.inserted:
+            self.notify("reset")
+
+
+class DatabaseQuestionStore(QuestionStore):
+    """
+    Stores the questions in the app's database, through SQLAlchemy.
+
+    Reads are served by the in-memory structures derived from the
+    database where they apply: the question counts back the totals, the
+    quiz index draws the quiz questions, the search index (unless
+    SEARCH_BACKEND is "database") ranks the searches, the prefix index
+    finds the suggestions and the read model (READ_MODEL_ENABLED) serves
+    the categories and pages. They follow the writes through the
+    question `listeners`. With a group commit `writer`, the questions
+    created are inserted in its batches.
+
+    Queries run on the app's `db.session`; `using(session)` returns the
+    same store on another session. Writes are passed to `notify`, and
+    `background(reload)` runs the `reload(session)` of the prefix index
+    off the request (inline when not given).
+    """
+
+    def __init__(self, quiz_sampler, question_counts, suggest_index,
+                 search_index=None, read_model=None, bulk_options=None,
+                 export_batch_size=1000, writer=None,
+                 notify=notify_question_listeners, background=None):
+        self.quiz_sampler = quiz_sampler
+        self.question_counts = question_counts
+        self.suggest_index = suggest_index
+        self.search_index = search_index
+        self.read_model = read_model
+        self.bulk_options = bulk_options or {}
+        self.export_batch_size = export_batch_size
+        self.writer = writer
+        self.notify = notify
+        self.background = background
+        self._session = None
+
+    @classmethod
+    def from_config(cls, config, writer=None,
+                    notify=notify_question_listeners, background=None):
+        return cls(
+            quiz_sampler=QuizSampler(max_age=config["QUIZ_INDEX_MAX_AGE"]),
+            question_counts=QuestionCounts(
+                reconcile_interval=config["COUNTS_RECONCILE_INTERVAL"]
+            ),
+            suggest_index=SuggestIndex(
+                max_postings=config["SUGGEST_MAX_POSTINGS"],
+                max_age=config["SUGGEST_INDEX_MAX_AGE"]
+            ),
+            search_index=SearchIndex(
+                include_answers=config["SEARCH_INCLUDE_ANSWERS"],
+                max_age=config["SEARCH_INDEX_MAX_AGE"]
+            ) if config["SEARCH_BACKEND"] == "index" else None,
+            read_model=ReadModel(
+                max_staleness=config["READ_MODEL_MAX_STALENESS"]
+            ) if config["READ_MODEL_ENABLED"] else None,
+            bulk_options={
+                "chunk_size": config["BULK_CHUNK_SIZE"],
+                "use_copy": config["BULK_USE_COPY"],
+                "max_errors": config["BULK_MAX_ERRORS"]
+            },
+            export_batch_size=config["EXPORT_BATCH_SIZE"],
+            writer=writer,
+            notify=notify,
+            background=background
+        )
+
+    @property
+    def session(self):
+        """
+        The session of the queries: the one given to `using`, or the
+        app's `db.session`.
+        """
+        return self._session if self._session is not None else db.session
+
+    def using(self, session):
+        """
+        Returns the store running its queries on the given session,
+        sharing the in-memory structures of this one.
+        """
+        store = copy.copy(self)
+        store._session = session
+        return store
+
+    @property
+    def listeners(self):
+        """
+        The question listeners keeping the in-memory structures current.
+        """
+        return [structure.question_changed
+                for structure in (self.quiz_sampler, self.question_counts,
+                                  self.suggest_index, self.search_index,
+                                  self.read_model)
+                if structure is not None]
+
+    def categories(self):
+        if self.read_model is not None:
+            return self.read_model.categories(self.session)
+        return self.session.query(Category.id, Category.type) \
+                           .order_by(Category.type) \
+                           .all()
+
+    def category(self, category_id):
+        if self.read_model is not None:
+            return self.read_model.category(category_id, self.session)
+        return self.session.query(Category.type) \
+                           .filter(Category.id == category_id) \
+                           .scalar()
+
+    def total(self):
+        return self.question_counts.total(self.session)
+
+    def category_counts(self):
+        return self.question_counts.categories(self.session)
+
+    def page(self, page_arguments, category=None, fields=ROW_FIELDS):
+        if self.read_model is not None:
+            return self.read_model.paginate(page_arguments, category, fields,
+                                            self.session)
+        selection = self.session.query(Question)
+        if category is None:
+            return paginate_questions(page_arguments,
+                                      selection,
+                                      self.total(),
+                                      fields)
+        return paginate_questions(page_arguments,
+                                  selection.filter(
+                                      Question.category == category
+                                  ),
+                                  self.question_counts.category(
+                                      category, self.session
+                                  ),
+                                  fields)
+
+    def search(self, term, page_arguments, fields=ROW_FIELDS):
+        if self.search_index is not None:
+            return paginate_question_ids(page_arguments,
+                                         self.search_index.search(
+                                             term, self.session
+                                         ),
+                                         fields,
+                                         self.session)
+        return paginate_questions(page_arguments,
+                                  self.session.query(Question).filter(
+                                      Question.question.ilike(f"%{term}%")
+                                  ),
+                                  fields=fields)
+
+    def suggest(self, prefix, limit):
+        completions, question_ids = self.suggest_index.suggest(prefix, limit,
+                                                               self.session)
+        if self.suggest_index.begin_reload():
+            if self.background is not None:
+                self.background(self.suggest_index.reload)
+            else:
+                self.suggest_index.reload(self.session)
+
+        questions = dict(
+            self.session.query(Question.id, Question.question)
+                .filter(Question.id.in_(question_ids))
+        ) if question_ids else {}
+
+        return {
+            "completions": completions,
+            "questions": [{"id": question_id,
+                           "question": questions[question_id]}
+                          for question_id in question_ids
+                          if question_id in questions]
+        }
+
+    def insert(self, fields):
+        if self.writer is not None:
+            return self.writer.insert(fields)
+
+        question = Question(**fields)
+        self.session.add(question)
+        self.session.flush()
+        created = question.format()
+        self.session.commit()
+        self.notify("insert", created)
+        return created
+
+    def delete(self, question_id):
+        question = self.session.get(Question, question_id)
+        if question is None:
+            return None
+
+        deleted = question.format()
+        self.session.delete(question)
+        self.session.commit()
+        self.notify("delete", deleted)
+        return deleted
+
+    def delete_many(self, question_ids):
+        deleted = delete_questions(question_ids, self.session)
+        for question in deleted:
+            self.notify("delete", question)
+        return deleted
+
+    def importer(self):
+        return DatabaseImport(self.notify, session=self.session,
+                              **self.bulk_options)
+
+    def export(self, export_format, category=None, min_id=None,
+               max_id=None):
+        selection = self.session.query(
+            *(getattr(Question, field) for field in EXPORT_FIELDS)
+        ).order_by(Question.id)
+        if category is not None:
+            selection = selection.filter(Question.category == category)
+        if min_id is not None:
+            selection = selection.filter(Question.id >= min_id)
+        if max_id is not None:
+            selection = selection.filter(Question.id <= max_id)
+
+        return export_questions(selection, export_format,
+                                self.export_batch_size)
+
+    def sample(self, category=None, excluded=()):
+        question = self.quiz_sampler.sample(category, excluded, self.session)
+        return question.format() if question is not None else None
+
+    def deal(self, size, category=None, excluded=(), seed=None):
+        return self.quiz_sampler.deal(size, category, excluded, seed,
+                                      self.session)
+
+
+def reload_in_background(reload, app):
+    """
+    Runs the `reload(session)` of an in-memory index on a thread of its
+    own, in an app context, so that no request waits for it.
+    """
+    def run():
+        with app.app_context():
+            try:
+                reload(db.session)
+            except Exception:
+                app.logger.exception("index reload failed")
+
+    threading.Thread(target=run, name="index-reload", daemon=True).start()
+
+
+@contextmanager
+def app_session(app):
+    """
+    Yields the app's `db.session`, in an app context of its own.
+    """
+    with app.app_context():
+        yield db.session
+
+
+def storage_backend(config):
+    """
+    Returns the STORAGE_BACKEND setting, "database" or "memory".
+    """
+    backend = config["STORAGE_BACKEND"]
+    if backend not in ("database", "memory"):
+        raise ValueError(f"unknown STORAGE_BACKEND {backend!r}")
+    return backend
+
+
+def create_memory_store(config, notify=notify_question_listeners):
+    """
+    Returns the `MemoryQuestionStore` of the settings, loaded with the
+    MEMORY_STORE_DUMP file if one is set.
+    """
+    from .memory import MemoryQuestionStore
+
+    store = MemoryQuestionStore(
+        include_answers=config["SEARCH_INCLUDE_ANSWERS"],
+        max_errors=config["BULK_MAX_ERRORS"],
+        export_batch_size=config["EXPORT_BATCH_SIZE"],
+        notify=notify
+    )
+    if config["MEMORY_STORE_DUMP"]:
+        store.load_dump(config["MEMORY_STORE_DUMP"])
+    return store
+
+
+def create_store(app):
+    """
+    Returns the `QuestionStore` of the app's STORAGE_BACKEND setting,
+    setting up the database when it is used.
+    """
+    config = app.config
+    if storage_backend(config) == "memory":
+        return create_memory_store(config)
+
+    setup_db(app, config.get("SQLALCHEMY_DATABASE_URI", DB_PATH))
+    writer = GroupCommitWriter.from_config(
+        config, lambda: app_session(app)
+    ) if config["GROUP_COMMIT_ENABLED"] else None
+    app.extensions["group_commit"] = writer
+    store = DatabaseQuestionStore.from_config(
+        config, writer,
+        background=lambda reload: reload_in_background(reload, app)
+    )
+    for listener in store.listeners:
+        register_question_listener(app, listener)
+    return store
@@ -0,0 +1,266 @@
+import heapq
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from models import db, Question
+from .search import normalize
+
+WORD = re.compile(r"\w+")
+# Sorts after every word starting with a given prefix.
+PREFIX_END = "\U0010ffff"
+
+
+def words(text):
+    """
+    Returns the distinct normalized words of a text, in order.
+    """
+    return list(dict.fromkeys(WORD.findall(normalize(text))))
+
+
+def contains(ids, question_id):
+    """
+    Tells whether a sorted array of ids contains the id.
+    """
+    position = bisect_left(ids, question_id)
+    return position < len(ids) and ids[position] == question_id
+
+
+class SuggestIndex:
+    """
+    An in-memory sorted-prefix index of the words of the question texts,
+    for suggest-as-you-type.
+
+    The distinct words are kept in a sorted array, so the words starting
+    with a prefix are the range between two binary searches. Each word
+    has the number of questions containing it and the ids of the first
+    `max_postings` of them in ascending order, as a compact array: the
+    memory used is bounded by the vocabulary times `max_postings`,
+    however many questions share a word.
+
+    A word's ids always are all of its ids up to the last one kept, so
+    the questions suggested are exact up to the last id kept for each
+    word of the prefix, and none past it are suggested: a prefix made of
+    common words may get fewer than `limit` questions. A word whose ids
+    fall to half of `max_postings` through deletes while more questions
+    contain it marks the index due for a reload.
+
+    Like `SearchIndex`, the index is loaded lazily on the first suggest
+    and kept current by `question_changed`. Once older than `max_age`
+    seconds, or due, it is rebuilt by `reload`, which the caller runs
+    off the request path (see `begin_reload`); the current index serves
+    the suggestions meanwhile.
+    """
+
+    def __init__(self, max_postings=1000, max_age=None):
+        self.max_postings = max_postings
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._words = None
+        self._postings = None
+        self._counts = None
+        self._short = False
+        self._loaded_at = 0
+        # Counts the changes, so a reload started before one is dropped.
+        self._version = 0
+        self._reloading = False
+
+    def _is_stale(self):
+        if self._short:
+            return True
+        if self.max_age is None:
+            return False
+        return time.monotonic() - self._loaded_at > self.max_age
+
+    def _query(self, session):
+        return session.query(Question.id, Question.question) \
+                      .order_by(Question.id)
+
+    def _index_rows(self, rows):
+        postings = {}
+        counts = {}
+        for question_id, question in rows:
+            for word in words(question):
+                ids = postings.get(word)
+                if ids is None:
+                    ids = postings[word] = array("q")
+                if self.max_postings is None or \
+                        len(ids) < self.max_postings:
+                    ids.append(question_id)
+                counts[word] = counts.get(word, 0) + 1
+        return sorted(postings), postings, counts
+
+    def _install(self, index):
+        self._words, self._postings, self._counts = index
+        self._short = False
+        self._loaded_at = time.monotonic()
+        self._version += 1
+
+    def load(self, rows):
+        """
+        Indexes (id, question) rows, in id order, in place of the current
+        index, for an index that is not loaded from the database.
+        """
+        index = self._index_rows(rows)
+        with self._lock:
+            self._install(index)
+
+    def begin_reload(self):
+        """
+        Tells whether the index is due for a reload that nobody started
+        yet; the caller then owes a call to `reload`.
+        """
+        with self._lock:
+            if self._words is None or self._reloading or \
+                    not self._is_stale():
+                return False
+            self._reloading = True
+            return True
+
+    def reload(self, session):
+        """
+        Rebuilds the index from the database with the given session. The
+        suggestions are served from the current index until the new one
+        is installed; a reload overtaken by a question change is dropped
+        and left to the next one.
+        """
+        try:
+            with self._lock:
+                version = self._version
+            index = self._index_rows(self._query(session))
+            with self._lock:
+                if self._version == version:
+                    self._install(index)
+        finally:
+            with self._lock:
+                self._reloading = False
+
+    def invalidate(self):
+        """
+        Drops the index; it is reloaded on the next suggest.
+        """
+        with self._lock:
+            self._words = None
+            self._postings = None
+            self._counts = None
+            self._version += 1
+
+    def add(self, question_id, question):
+        with self._lock:
+            self._version += 1
+            if self._words is None:
+                return
+            for word in words(question):
+                postings = self._postings.get(word)
+                if postings is None:
+                    postings = self._postings[word] = array("q")
+                    insort(self._words, word)
+                self._counts[word] = self._counts.get(word, 0) + 1
+                if self.max_postings is not None and \
+                        len(postings) >= self.max_postings:
+                    # Only kept when among the first max_postings ids.
+                    if question_id > postings[-1]:
+                        continue
+                    postings.pop()
+                insort(postings, question_id)
+
+    def remove(self, question_id, question):
+        with self._lock:
+            self._version += 1
+            if self._words is None:
+                return
+            for word in words(question):
+                count = self._counts.get(word)
+                if count is None:
+                    continue
+                if count == 1:
+                    del self._counts[word]
+                    del self._postings[word]
+                    del self._words[bisect_left(self._words, word)]
+                    continue
+
+                self._counts[word] = count - 1
+                postings = self._postings[word]
+                if contains(postings, question_id):
+                    del postings[bisect_left(postings, question_id)]
+                if self.max_postings is not None and \
+                        len(postings) < count - 1 and \
+                        len(postings) <= self.max_postings // 2:
+                    self._short = True
+
+    def _horizon(self, words):
+        # The last id up to which the ids of all the words are complete
+        # (None: all of them are).
+        return min((self._postings[word][-1]
+                    if self._postings[word] else 0
+                    for word in words
+                    if len(self._postings[word]) < self._counts[word]),
+                   default=None)
+
+    def question_changed(self, event, question):
+        """
+        Question listener keeping the index current.
+        """
+        if event == "reset":
+            self.invalidate()
+        elif event == "delete":
+            self.remove(question["id"], question["question"])
+        else:
+            self.add(question["id"], question["question"])
+
+    def suggest(self, prefix, limit, session=None):
+        """
+        Returns the completions of the last word of the prefix, the
+        words contained in the most questions first, and the ids of the
+        first questions (in id order) containing the other words of the
+        prefix and a word starting with its last word; at most `limit`
+        of each, and only questions up to the last id kept for each of
+        these words. An index that is not loaded yet is loaded with the
+        app's `db.session` unless another session is given.
+        """
+        terms = WORD.findall(normalize(prefix))
+        if not terms:
+            return [], []
+        *complete, partial = terms
+
+        while True:
+            with self._lock:
+                if self._words is not None:
+                    return self._suggest(complete, partial, limit)
+                version = self._version
+
+            # Loaded without holding the lock, like `reload`.
+            index = self._index_rows(self._query(session or db.session))
+            with self._lock:
+                if self._version == version:
+                    self._install(index)
+
+    def _suggest(self, complete, partial, limit):
+        # Called with the lock held.
+        start = bisect_left(self._words, partial)
+        end = bisect_left(self._words, partial + PREFIX_END, start)
+        matches = self._words[start:end]
+
+        completions = heapq.nlargest(limit, matches,
+                                     key=self._counts.__getitem__)
+
+        if not all(word in self._postings for word in complete):
+            return completions, []
+        required = [self._postings[word] for word in complete]
+        horizon = self._horizon(complete + matches)
+
+        question_ids = []
+        for question_id in heapq.merge(*(self._postings[word]
+                                         for word in matches)):
+            if horizon is not None and question_id > horizon:
+                break
+            if question_ids and question_ids[-1] == question_id:
+                continue
+            if all(contains(ids, question_id) for ids in required):
+                question_ids.append(question_id)
+                if len(question_ids) == limit:
+                    break
+
+        return completions, question_ids
@@ -0,0 +1,375 @@
+"""
+Request validation and response shapes shared by the WSGI (Flask) and
+ASGI applications. Nothing here depends on the web framework.
+"""
+from bisect import bisect_right
+
+QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+
+QUESTION_FIELDS = ("question", "answer", "difficulty", "category")
+# The fields of a question in a response, in the order of
+# Question.format().
+ROW_FIELDS = ("id", "question", "answer", "category", "difficulty")
+
+ERROR_MESSAGES = {
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Resource Not Found",
+    405: "Method Not Allowed",
+    415: "Unsupported Media Type",
+    422: "Unprocessable resource",
+    429: "Too Many Requests",
+    500: "Internal server error",
+    503: "Service Unavailable"
+}
+
+
+class ValidationError(ValueError):
+    """
+    The request body cannot be processed (422).
+    """
+
+
+def int_argument(args, name, default=None):
+    """
+    Reads an integer query string argument, falling back to the default
+    when it is missing or not an integer.
+    """
+    try:
+        return int(args[name])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+def bool_argument(args, name, default=False):
+    """
+    Reads a boolean query string argument (`true`/`false`, `1`/`0`).
+    """
+    value = args.get(name, "").lower()
+    if value in ("true", "1"):
+        return True
+    if value in ("false", "0"):
+        return False
+    return default
+
+
+def question_fields(args):
+    """
+    Reads the `fields` argument of a list request: the comma separated
+    question fields to return. Returns them in ROW_FIELDS order, with
+    `id` always included, or raises `ValidationError` for an unknown
+    field. Without the argument every field is returned.
+    """
+    value = args.get("fields")
+    if not value:
+        return ROW_FIELDS
+
+    fields = {field.strip() for field in value.split(",") if field.strip()}
+    if not fields <= set(ROW_FIELDS):
+        raise ValidationError("unknown fields: " +
+                              ", ".join(sorted(fields - set(ROW_FIELDS))))
+
+    return tuple(field for field in ROW_FIELDS
+                 if field in fields or field == "id")
+
+
+def page_arguments(args):
+    """
+    Reads the `page`, `limit` and `after` arguments of a list request.
+    """
+    limit = int_argument(args, "limit", QUESTIONS_PER_PAGE)
+    limit = min(max(limit, 1), MAX_QUESTIONS_PER_PAGE)
+    after = int_argument(args, "after")
+    page = int_argument(args, "page", 1)
+
+    return page, limit, after
+
+
+def validate_search(body):
+    """
+    Returns the search term of a search request, or raises
+    `ValidationError` when there is none.
+    """
+    term = body.get("searchTerm") if isinstance(body, dict) else None
+    if not (isinstance(term, str) and term):
+        raise ValidationError("searchTerm must be a non-empty string")
+
+    return term
+
+
+def suggest_arguments(args, default_limit, max_limit):
+    """
+    Reads the `prefix` and `limit` arguments of a suggest request, or
+    raises `ValidationError` when there is no prefix.
+    """
+    prefix = args.get("prefix", "")
+    if not prefix.strip():
+        raise ValidationError("missing prefix")
+
+    limit = int_argument(args, "limit", default_limit)
+    return prefix, min(max(limit, 1), max_limit)
+
+
+def export_arguments(args):
+    """
+    Reads the `format`, `category`, `min_id` and `max_id` arguments of
+    an export request, or raises `ValidationError` for an unknown format
+    or a filter that is not an integer.
+    """
+    export_format = args.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv"):
+        raise ValidationError("format must be ndjson or csv")
+
+    filters = []
+    for name in ("category", "min_id", "max_id"):
+        value = int_argument(args, name)
+        if value is None and args.get(name) is not None:
+            raise ValidationError(f"{name} must be an integer")
+        filters.append(value)
+
+    return (export_format, *filters)
+
+
+def page_slice(page_arguments, question_ids):
+    """
+    Picks the page of an ordered list of ids.
+
+    Returns the ids of the page and the `next_cursor` (None on the last
+    page, and only meaningful in cursor mode); with `after=<id>` the page
+    starts after that id's position in the list.
+    """
+    page, limit, after = page_arguments
+
+    if after is None:
+        start = (page-1) * limit if page >= 1 else len(question_ids)
+    else:
+        try:
+            start = question_ids.index(after) + 1
+        except ValueError:
+            start = len(question_ids)
+
+    page_ids = question_ids[start:start + limit]
+    has_next = start + limit < len(question_ids)
+
+    return page_ids, page_ids[-1] if has_next else None
+
+
+def sorted_page(page_arguments, question_ids):
+    """
+    Picks the page of a sorted list of ids, like `page_slice`, finding
+    the cursor with a binary search.
+    """
+    page, limit, after = page_arguments
+
+    if after is None:
+        start = (page-1) * limit if page >= 1 else len(question_ids)
+    else:
+        start = bisect_right(question_ids, after)
+
+    page_ids = question_ids[start:start + limit]
+    has_next = start + limit < len(question_ids)
+
+    return page_ids, page_ids[-1] if has_next else None
+
+
+def page_response(page_arguments, questions, total_questions, next_cursor):
+    """
+    Returns the list fields of a paginated response; `next_cursor` is
+    only included in cursor mode.
+    """
+    result = {
+        "questions": questions,
+        "total_questions": total_questions
+    }
+    if page_arguments[2] is not None:
+        result["next_cursor"] = next_cursor
+    return result
+
+
+def validate_question(body):
+    """
+    Returns the fields of a new question, or raises `ValidationError`.
+    The category is returned as an integer; the form sends it as a
+    string of digits. Whether the category exists is for the caller to
+    check.
+    """
+    if not (isinstance(body, dict) and
+            all(field in body for field in QUESTION_FIELDS)):
+        raise ValidationError("question, answer, difficulty and category "
+                              "are required")
+
+    fields = {field: body.get(field, None) for field in QUESTION_FIELDS}
+    category = fields["category"]
+    if isinstance(category, str) and category.isdigit():
+        category = int(category)
+    if not (isinstance(category, int) and not isinstance(category, bool)):
+        raise ValidationError("category must be a category id")
+
+    fields["category"] = category
+    return fields
+
+
+def validate_ids(body, max_ids=None):
+    """
+    Returns the distinct question ids of a batch request, in the order
+    given, or raises `ValidationError`.
+    """
+    ids = body.get("ids") if isinstance(body, dict) else None
+
+    if not (isinstance(ids, list) and ids and
+            all(isinstance(id, int) and not isinstance(id, bool)
+                for id in ids)):
+        raise ValidationError("ids must be a non-empty list of question ids")
+
+    ids = list(dict.fromkeys(ids))
+    if max_ids is not None and len(ids) > max_ids:
+        raise ValidationError(f"at most {max_ids} ids can be deleted at once")
+
+    return ids
+
+
+def query_stats_arguments(args):
+    """
+    Reads the `limit` and `sort` arguments of a query statistics
+    request, or raises `ValidationError` for an unknown sort.
+    """
+    sort = args.get("sort", "total")
+    if sort not in ("total", "mean", "max", "calls"):
+        raise ValidationError("sort must be total, mean, max or calls")
+
+    limit = int_argument(args, "limit", QUESTIONS_PER_PAGE)
+    return min(max(limit, 1), MAX_QUESTIONS_PER_PAGE), sort
+
+
+def wants_minimal(args):
+    """
+    Whether a write request asked for `?return=minimal`, a response
+    without the reloaded listing or totals.
+    """
+    return args.get("return") == "minimal"
+
+
+def wants_counts(args):
+    """
+    Whether a categories request asked for `?counts=true`.
+    """
+    return bool_argument(args, "counts")
+
+
+def validate_quiz(body):
+    """
+    Returns the category id (falsy for all categories) and the set of
+    previous question ids of a quiz request, or raises
+    `ValidationError`.
+    """
+    if not (isinstance(body, dict) and
+            "quiz_category" in body and "previous_questions" in body):
+        raise ValidationError("quiz_category and previous_questions "
+                              "are required")
+
+    try:
+        return (body["quiz_category"]["id"],
+                set(body["previous_questions"]))
+    except (KeyError, TypeError):
+        raise ValidationError("quiz_category must have an id and "
+                              "previous_questions must be a list of ids")
+
+
+def validate_quiz_session(body):
+    """
+    Returns the category id (falsy for all categories) of a quiz session
+    request, or raises `ValidationError`.
+    """
+    category = body.get("quiz_category") if isinstance(body, dict) else None
+    if not isinstance(category, dict):
+        raise ValidationError("quiz_category must be an object with an id")
+
+    id = category.get("id")
+    if id and not (isinstance(id, int) and not isinstance(id, bool)):
+        raise ValidationError("the id of quiz_category must be an integer")
+    return id
+
+
+def validate_deck(body, max_size):
+    """
+    Returns the category id (falsy for all categories), the deck size,
+    the set of excluded question ids and the seed (or None) of a quiz
+    deck request, or raises `ValidationError`.
+    """
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        raise ValidationError("the body must be a JSON object")
+
+    category = body.get("quiz_category") or {}
+    if not isinstance(category, dict):
+        raise ValidationError("quiz_category must be an object with an id")
+
+    size = body.get("size", QUESTIONS_PER_PAGE)
+    if not (isinstance(size, int) and not isinstance(size, bool) and
+            1 <= size <= max_size):
+        raise ValidationError(f"size must be an integer from 1 to {max_size}")
+
+    excluded = body.get("previous_questions") or []
+    if not (isinstance(excluded, list) and
+            all(isinstance(id, int) and not isinstance(id, bool)
+                for id in excluded)):
+        raise ValidationError("previous_questions must be a list of ids")
+
+    seed = body.get("seed")
+    if not (seed is None or isinstance(seed, str) or
+            (isinstance(seed, int) and not isinstance(seed, bool))):
+        raise ValidationError("seed must be an integer or a string")
+
+    return category.get("id"), size, set(excluded), seed
+
+
+def validate_batch(body, max_requests):
+    """
+    Returns the (method, path, body) of the sub-requests of a batch, or
+    raises `ValidationError`.
+    """
+    requests = body.get("requests") if isinstance(body, dict) else None
+    if not (isinstance(requests, list) and
+            1 <= len(requests) <= max_requests):
+        raise ValidationError("requests must be a list of 1 to "
+                              f"{max_requests} requests")
+
+    sub_requests = []
+    for sub_request in requests:
+        if not isinstance(sub_request, dict):
+            raise ValidationError("a request must be an object")
+        method = sub_request.get("method", "GET")
+        path = sub_request.get("path")
+        if method not in ("GET", "POST"):
+            raise ValidationError("method must be GET or POST")
+        if not (isinstance(path, str) and path.startswith("/")):
+            raise ValidationError("path must be an absolute path")
+        sub_requests.append((method, path, sub_request.get("body")))
+
+    return sub_requests
+
+
+def categories_response(categories):
+    """
+    Returns the `categories` field of a response from (id, type) pairs,
+    keyed by the id as a string like the JSON object it becomes.
+    """
+    return {str(id): type for id, type in categories}
+
+
+def category_counts(categories, counts):
+    """
+    Returns the `counts` field of a response: the number of questions of
+    each of the (id, type) pairs, by category id.
+    """
+    return {str(id): counts.get(id, 0) for id, type in categories}
+
+
+def error_response(status):
+    return {
+        "success": False,
+        "error": status,
+        "message": ERROR_MESSAGES[status]
+    }
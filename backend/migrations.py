@@ -0,0 +1,189 @@
+"""
+Schema migrations
+    versioned steps bringing a database to the schema of models.py. The
+    versions applied are recorded in the schema_migrations table, so
+    `migrate` only runs the pending steps and can be called on every
+    start; an existing database (created from trivia.psql or by an older
+    version of the app) is upgraded in place.
+
+    A new step is a function taking a connection, appended to MIGRATIONS
+    with the next version number. Steps must not import the models:
+    they describe the schema as it was at their version.
+
+    Run the pending migrations of a database with
+
+        python migrations.py [database_url]
+"""
+import sys
+
+from sqlalchemy import (
+    Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table,
+    create_engine, func, inspect, select, text
+)
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False, server_default=func.now())
+)
+
+# Serializes migrations started at the same time by several workers.
+ADVISORY_LOCK_ID = 6_152_033
+
+
+def create_tables(connection):
+    """
+    The schema of trivia.psql, for an empty database.
+    """
+    metadata = MetaData()
+    Table("categories", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("type", String))
+    Table("questions", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("question", String),
+          Column("answer", String),
+          Column("difficulty", Integer),
+          Column("category", Integer,
+                 ForeignKey("categories.id", name="category",
+                            onupdate="CASCADE", ondelete="SET NULL")))
+    metadata.create_all(connection, checkfirst=True)
+
+
+def integer_category(connection):
+    """
+    Makes questions.category an integer foreign key to categories.id.
+
+    Databases created by the app before this version have a VARCHAR
+    column without the constraint. Categories that do not exist are set
+    to NULL, as deleting the category would have done, and so are the
+    values that are not a number ('', 'abc', '1x'): casting them would
+    fail on PostgreSQL and give 0 or a prefix on SQLite.
+    """
+    inspector = inspect(connection)
+    column = next(column for column in inspector.get_columns("questions")
+                  if column["name"] == "category")
+    has_foreign_key = any(
+        key["constrained_columns"] == ["category"]
+        for key in inspector.get_foreign_keys("questions")
+    )
+    if isinstance(column["type"], Integer) and has_foreign_key:
+        return
+
+    if connection.dialect.name == "sqlite":
+        # SQLite cannot alter a column: the table is rebuilt.
+        connection.execute(text("""
+            CREATE TABLE questions_migrated (
+                id INTEGER NOT NULL PRIMARY KEY,
+                question VARCHAR,
+                answer VARCHAR,
+                difficulty INTEGER,
+                category INTEGER,
+                CONSTRAINT category FOREIGN KEY (category)
+                    REFERENCES categories (id)
+                    ON UPDATE CASCADE ON DELETE SET NULL
+            )
+        """))
+        connection.execute(text("""
+            INSERT INTO questions_migrated
+                (id, question, answer, difficulty, category)
+            SELECT q.id, q.question, q.answer, q.difficulty, c.id
+            FROM questions q
+            LEFT JOIN categories c ON c.id = CASE
+                WHEN q.category GLOB '[0-9]*'
+                    AND q.category NOT GLOB '*[^0-9]*'
+                THEN CAST(q.category AS INTEGER)
+            END
+        """))
+        connection.execute(text("DROP TABLE questions"))
+        connection.execute(text(
+            "ALTER TABLE questions_migrated RENAME TO questions"
+        ))
+        return
+
+    if not isinstance(column["type"], Integer):
+        connection.execute(text(
+            "ALTER TABLE questions ALTER COLUMN category TYPE INTEGER "
+            "USING CASE WHEN category ~ '^[0-9]+$' "
+            "THEN category::integer END"
+        ))
+    if not has_foreign_key:
+        connection.execute(text(
+            "UPDATE questions SET category = NULL WHERE category NOT IN "
+            "(SELECT id FROM categories)"
+        ))
+        connection.execute(text(
+            "ALTER TABLE questions ADD CONSTRAINT category "
+            "FOREIGN KEY (category) REFERENCES categories (id) "
+            "ON UPDATE CASCADE ON DELETE SET NULL"
+        ))
+
+
+def category_indexes(connection):
+    """
+    Indexes the questions by (category, id): listing a category in id
+    order, counting per category and loading the quiz index. Listing
+    all questions in id order uses the primary key.
+    """
+    metadata = MetaData()
+    questions = Table("questions", metadata,
+                      Column("id", Integer, primary_key=True),
+                      Column("category", Integer))
+    Index("ix_questions_category_id",
+          questions.c.category, questions.c.id).create(connection,
+                                                       checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, "create tables", create_tables),
+    (2, "integer category foreign key", integer_category),
+    (3, "category indexes", category_indexes),
+]
+
+
+def applied_versions(connection):
+    schema_migrations.create(connection, checkfirst=True)
+    return {
+        version
+        for version, in connection.execute(select(schema_migrations.c.version))
+    }
+
+
+def migrate(connection):
+    """
+    Runs the pending migrations in the connection's transaction, and
+    returns the versions applied.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:id)"),
+                           {"id": ADVISORY_LOCK_ID})
+
+    applied = applied_versions(connection)
+    pending = [(version, name, step) for version, name, step in MIGRATIONS
+               if version not in applied]
+
+    for version, name, step in pending:
+        step(connection)
+        connection.execute(schema_migrations.insert(),
+                           {"version": version, "name": name})
+
+    return [version for version, name, step in pending]
+
+
+def upgrade(engine):
+    """
+    Runs the pending migrations of an engine's database in one
+    transaction.
+    """
+    with engine.begin() as connection:
+        return migrate(connection)
+
+
+if __name__ == "__main__":
+    from models import DB_PATH
+
+    applied = upgrade(create_engine(sys.argv[1] if len(sys.argv) > 1
+                                    else DB_PATH))
+    print(f"applied migrations: {applied}" if applied
+          else "the database is up to date")
@@ -1,7 +1,13 @@
 from dotenv import load_dotenv
+from functools import wraps
 import os
-from sqlalchemy import Column, String, Integer
+import time
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, event
+from flask import current_app, g
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+
+from migrations import upgrade
 
 
 load_dotenv()
@@ -11,25 +17,202 @@ DB_HOST = os.getenv("DB_HOST", "127.0.0.1:5432")
 # DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 DB_NAME = os.getenv("DB_NAME", "trivia")
 DB_PATH = f"postgresql+psycopg2://{DB_HOST}/{DB_NAME}"
+# Optional read replica, e.g. postgresql+psycopg2://replica:5432/trivia
+DB_REPLICA_PATH = os.getenv("DB_REPLICA_PATH")
+DB_PROFILE = os.getenv("DB_PROFILE", "development")
+
+"""
+Engine profiles
+    the settings setup_db applies for each DB_PROFILE. Any of them can be
+    overridden with the app config key of the same name.
+"""
+
+ENGINE_PROFILES = {
+    "development": {
+        # SQL queries are not printed: the slow query log
+        # (DB_SLOW_QUERY_MS) replaces the echo. Set it to True to see
+        # every query on the terminal.
+        "SQLALCHEMY_ECHO": False,
+        "DEBUG": True,
+        "DB_POOL_SIZE": 5,
+        "DB_MAX_OVERFLOW": 10,
+        "DB_POOL_TIMEOUT": 30,
+        "DB_POOL_RECYCLE": -1,
+        "DB_POOL_PRE_PING": False,
+        "DB_STATEMENT_TIMEOUT_MS": None,
+        "DB_REPLICA_STICKY_SECONDS": 0,
+        "DB_MIGRATE_ON_START": True,
+        # Log the queries taking at least this many milliseconds (None:
+        # never), with their EXPLAIN plan on PostgreSQL.
+        "DB_SLOW_QUERY_MS": 100,
+        "DB_EXPLAIN_SLOW_QUERIES": True,
+    },
+    "production": {
+        "SQLALCHEMY_ECHO": False,
+        "DEBUG": False,
+        "DB_POOL_SIZE": 10,
+        "DB_MAX_OVERFLOW": 20,
+        "DB_POOL_TIMEOUT": 5,
+        "DB_POOL_RECYCLE": 1800,
+        "DB_POOL_PRE_PING": True,
+        "DB_STATEMENT_TIMEOUT_MS": 5000,
+        # Reads go to the primary for this long after a write, so a
+        # client sees its own changes despite the replication lag.
+        "DB_REPLICA_STICKY_SECONDS": 2,
+        # Migrations run on deploy (python migrations.py), so starting
+        # a worker opens no database connection.
+        "DB_MIGRATE_ON_START": False,
+        "DB_SLOW_QUERY_MS": 500,
+        "DB_EXPLAIN_SLOW_QUERIES": True,
+    },
+}
+
+
+def engine_options(database_path, settings):
+    """
+    Returns the create_engine arguments for a database and profile.
+    """
+    if database_path.startswith("sqlite"):
+        # SQLite has no connection pool to size nor statement timeout.
+        return {}
+
+    options = {
+        "pool_size": settings["DB_POOL_SIZE"],
+        "max_overflow": settings["DB_MAX_OVERFLOW"],
+        "pool_timeout": settings["DB_POOL_TIMEOUT"],
+        "pool_recycle": settings["DB_POOL_RECYCLE"],
+        "pool_pre_ping": settings["DB_POOL_PRE_PING"],
+    }
+    if settings["DB_STATEMENT_TIMEOUT_MS"] and \
+            database_path.startswith("postgresql"):
+        options["connect_args"] = {
+            "options": "-c statement_timeout="
+                       f"{int(settings['DB_STATEMENT_TIMEOUT_MS'])}"
+        }
+    return options
+
+
+"""
+Read replica routing
+    views decorated with read_only send their queries to the "replica"
+    bind when one is configured. Anything flushed goes to the primary,
+    and so do all reads for DB_REPLICA_STICKY_SECONDS after a write.
+"""
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _reads_from_replica():
+            replica = self._db.engines.get("replica")
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+def _reads_from_replica():
+    if not g or not g.get("read_only"):
+        return False
+    sticky = current_app.config.get("DB_REPLICA_STICKY_SECONDS") or 0
+    last_write = current_app.extensions.get("db_last_write", 0)
+    return time.monotonic() - last_write >= sticky
+
+
+def read_only(view):
+    """
+    Marks a view as only reading from the database.
+    """
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        g.read_only = True
+        return view(*args, **kwargs)
+    return decorated
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _record_write(session, flush_context):
+    current_app.extensions["db_last_write"] = time.monotonic()
 
-db = SQLAlchemy()
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, and brings the
+    database schema up to date (see migrations.py) when the profile's
+    DB_MIGRATE_ON_START is set
 """
 
 
+def profile_settings(config):
+    """
+    Returns the settings of the DB_PROFILE selected in a config mapping,
+    overridden by the config.
+    """
+    profile = config.get("DB_PROFILE", DB_PROFILE)
+    return {
+        key: config.get(key, default)
+        for key, default in ENGINE_PROFILES[profile].items()
+    }
+
+
 def setup_db(app, database_path=DB_PATH):
+    settings = profile_settings(app.config)
+    replica_path = app.config.get("DB_REPLICA_PATH", DB_REPLICA_PATH)
+
+    app.config.update(settings)
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    # See the SQL queries being printed on the terminal
-    app.config["SQLALCHEMY_ECHO"] = True
-    app.config["DEBUG"] = True
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path,
+                                                             settings)
+    if replica_path:
+        app.config["SQLALCHEMY_BINDS"] = {
+            "replica": {
+                "url": replica_path,
+                **engine_options(replica_path, settings)
+            }
+        }
     db.app = app
     db.init_app(app)
+    if settings["DB_MIGRATE_ON_START"]:
+        with app.app_context():
+            upgrade(db.engine)
+
+
+def dispose_engines_after_fork(app):
+    """
+    Replaces the connection pools of the app's engines in every process
+    forked from this one, which must not share the parent's connections.
+    The parent's connections are left open for the parent.
+    """
     with app.app_context():
-        db.create_all()
+        engines = list(db.engines.values())
+
+    def replace_pools():
+        for engine in engines:
+            engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=replace_pools)
+
+
+"""
+Question listeners
+    in-process structures derived from the questions (search index, quiz
+    index, read model...) register a listener on the app to be called
+    after a change is committed, with the event name ("insert", "update",
+    "delete", or "reset" when they should reload) and the formatted
+    question.
+"""
+
+
+def register_question_listener(app, listener):
+    app.extensions.setdefault("question_listeners", []).append(listener)
+
+
+def notify_question_listeners(event, question=None):
+    for listener in current_app.extensions.get("question_listeners", ()):
+        listener(event, question)
 
 
 """
@@ -44,9 +227,16 @@ class Question(db.Model):
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey("categories.id", name="category",
+                                          onupdate="CASCADE",
+                                          ondelete="SET NULL"))
     difficulty = Column(Integer)
 
+    # Created by the migrations; see migrations.py
+    __table_args__ = (
+        Index("ix_questions_category_id", "category", "id"),
+    )
+
     def __init__(self, question, answer, category, difficulty):
         self.question = question
         self.answer = answer
@@ -55,14 +245,21 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        question = self.format()
         db.session.commit()
+        notify_question_listeners("insert", question)
 
     def update(self):
+        question = self.format()
         db.session.commit()
+        notify_question_listeners("update", question)
 
     def delete(self):
+        question = self.format()
         db.session.delete(self)
         db.session.commit()
+        notify_question_listeners("delete", question)
 
     def format(self):
         return {
@@ -1,27 +1,100 @@
 from dotenv import load_dotenv
+import gzip
 import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 import json
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Integer, create_engine, inspect, text
 
 from flaskr import create_app
-from models import setup_db, Question
+from flaskr.admission import (
+    AdmissionControl, DeadlineExceeded, clear_deadline, start_deadline
+)
+from flaskr.counters import QuestionCounts
+from flaskr.memory import MemoryQuestionStore
+from flaskr.sessions import MemoryQuizSessionStore
+from flaskr.suggest import SuggestIndex
+from migrations import upgrade
+from models import (
+    DB_PATH, db, dispose_engines_after_fork, engine_options, profile_settings,
+    register_question_listener, setup_db, Question
+)
 
 
 load_dotenv()
 
+# TEST_STORAGE_BACKEND=memory runs the tests against the in-memory store,
+# without a database server; the tests reading the database are skipped.
+MEMORY_STORAGE = os.getenv("TEST_STORAGE_BACKEND") == "memory"
+MEMORY_CONFIG = {
+    "STORAGE_BACKEND": "memory",
+    "MEMORY_STORE_DUMP": os.path.join(os.path.dirname(__file__),
+                                      "trivia.psql")
+}
+requires_database = unittest.skipIf(MEMORY_STORAGE,
+                                    "reads the database directly")
+
+
+class ASGITestClient:
+    """
+    Gives the ASGI test client the interface of the Flask test client,
+    so every test also runs against create_asgi_app.
+    """
+
+    def __init__(self, app):
+        from starlette.testclient import TestClient
+        self.client = TestClient(app)
+
+    def open(self, method, path, json=None, data=None, content_type=None,
+             headers=None):
+        headers = dict(headers or {})
+        if content_type:
+            headers["Content-Type"] = content_type
+        response = self.client.request(method, path, json=json,
+                                       content=data, headers=headers)
+        response.data = response.content
+        response.mimetype = response.headers.get("content-type", "") \
+                                            .split(";")[0]
+        return response
+
+    def get(self, path, **kwargs):
+        return self.open("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open("POST", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open("DELETE", path, **kwargs)
+
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.app = create_app(MEMORY_CONFIG if MEMORY_STORAGE else None)
         self.client = self.app.test_client
         self.DB_NAME = os.getenv("DB_TEST_NAME", "trivia_test")
         self.DB_HOST = os.getenv("DB_HOST", "127.0.0.1:5432")
         self.DB_PATH = f"postgresql+psycopg2://{self.DB_HOST}/{self.DB_NAME}"
-        setup_db(self.app, self.DB_PATH)
+        if not MEMORY_STORAGE:
+            setup_db(self.app, self.DB_PATH)
+
+        # TEST_APP_MODE=asgi runs the requests against create_asgi_app
+        if os.getenv("TEST_APP_MODE") == "asgi":
+            from flaskr.asgi import create_asgi_app
+            client = ASGITestClient(
+                create_asgi_app(MEMORY_CONFIG if MEMORY_STORAGE else None,
+                                database_path=self.DB_PATH)
+            )
+            self.client = lambda: client
 
         self.new_question = {
             "question": "123",
@@ -35,6 +108,9 @@ class TriviaTestCase(unittest.TestCase):
             "difficulty": 1
         }
 
+        if MEMORY_STORAGE:
+            return
+
         # binds the app to the current context
         with self.app.app_context():
             self.db = SQLAlchemy()
@@ -46,12 +122,189 @@ class TriviaTestCase(unittest.TestCase):
         """Executed after reach test"""
         pass
 
+    def configured_client(self, config):
+        """Returns a test client of an app with the given settings."""
+        if MEMORY_STORAGE:
+            config = {**MEMORY_CONFIG, **config}
+        if os.getenv("TEST_APP_MODE") == "asgi":
+            from flaskr.asgi import create_asgi_app
+            return ASGITestClient(
+                create_asgi_app(config, database_path=self.DB_PATH)
+            )
+        if MEMORY_STORAGE:
+            return create_app(config).test_client()
+        app = create_app(config)
+        setup_db(app, self.DB_PATH)
+        return app.test_client()
+
+    def join_index_reloads(self):
+        """Waits for the in-memory indexes reloading in the background."""
+        for thread in threading.enumerate():
+            if thread.name == "index-reload":
+                thread.join()
+
     """
     DONE
     Write at least one test for each test for successful
     operation and for expected errors.
     """
 
+    # ---------------------------------------#
+    # Test configuration
+    # ---------------------------------------#
+    def test_production_profile(self):
+        settings = profile_settings({"DB_PROFILE": "production",
+                                     "DB_POOL_SIZE": 3})
+        options = engine_options(DB_PATH, settings)
+
+        self.assertEqual(settings["SQLALCHEMY_ECHO"], False)
+        self.assertEqual(settings["DEBUG"], False)
+        self.assertEqual(options["pool_size"], 3)
+        self.assertEqual(options["connect_args"],
+                         {"options": "-c statement_timeout=5000"})
+
+    def test_both_apps_take_debug_from_the_profile(self):
+        from flaskr.asgi import create_asgi_app
+        for profile, debug in (("development", True), ("production", False)):
+            config = {"STORAGE_BACKEND": "memory", "DB_PROFILE": profile}
+
+            self.assertIs(create_app(config).debug, debug)
+            self.assertIs(create_asgi_app(config).debug, debug)
+            self.assertIs(create_app({**config, "DEBUG": not debug}).debug,
+                          not debug)
+
+    def test_migrations_run_on_start_only_when_asked(self):
+        directory = tempfile.mkdtemp()
+        for migrate in (False, True):
+            path = f"sqlite:///{directory}/trivia_{migrate}.db"
+            create_app({"DB_PROFILE": "production",
+                        "DB_MIGRATE_ON_START": migrate,
+                        "SQLALCHEMY_DATABASE_URI": path})
+
+            self.assertEqual(
+                "questions" in inspect(create_engine(path)).get_table_names(),
+                migrate
+            )
+        shutil.rmtree(directory)
+
+    @requires_database
+    def test_engines_are_replaced_after_fork(self):
+        app = create_app({"DB_PROFILE": "production"})
+        setup_db(app, self.DB_PATH)
+        dispose_engines_after_fork(app)
+        with app.app_context():
+            pool = db.engine.pool
+
+        pid = os.fork()
+        if pid == 0:
+            with app.app_context():
+                os._exit(0 if db.engine.pool is not pool else 1)
+        _, status = os.waitpid(pid, 0)
+
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        with app.app_context():
+            self.assertIs(db.engine.pool, pool)
+
+    @requires_database
+    def test_fast_json_encoder_sends_the_same_bytes(self):
+        clients = []
+        for fast in (True, False):
+            app = create_app({"DB_PROFILE": "production",
+                              "JSON_FAST_ENCODER": fast})
+            setup_db(app, self.DB_PATH)
+            clients.append(app.test_client())
+
+        res = clients[0].post("/questions", json={**self.new_question,
+                                                  "question": "Café?"})
+        question_id = json.loads(res.data)["created_question_id"]
+
+        for path in ["/categories?counts=true",
+                     "/questions?page=2",
+                     f"/questions?after={question_id - 1}",
+                     "/categories/1/questions",
+                     "/categories/10000/questions"]:
+            res, expected = (client.get(path) for client in clients)
+            self.assertEqual(res.status_code, expected.status_code)
+            self.assertEqual(res.data, expected.data)
+
+        clients[0].delete(f"/questions/{question_id}")
+
+    def test_migrations_upgrade_a_database_in_place(self):
+        directory = tempfile.mkdtemp()
+        engine = create_engine(f"sqlite:///{directory}/old.db")
+        with engine.begin() as connection:
+            # The schema created by the app before the migrations.
+            connection.execute(text(
+                "CREATE TABLE categories (id INTEGER PRIMARY KEY, "
+                "type VARCHAR)"))
+            connection.execute(text(
+                "CREATE TABLE questions (id INTEGER PRIMARY KEY, "
+                "question VARCHAR, answer VARCHAR, category VARCHAR, "
+                "difficulty INTEGER)"))
+            connection.execute(text(
+                "INSERT INTO categories VALUES (1, 'Science')"))
+            connection.execute(text(
+                "INSERT INTO questions VALUES (1, 'Q?', 'A', '1', 2), "
+                "(2, 'Q?', 'A', '7', 2), (3, 'Q?', 'A', 'abc', 2), "
+                "(4, 'Q?', 'A', '1x', 2), (5, 'Q?', 'A', '', 2)"))
+
+        self.assertEqual(upgrade(engine), [1, 2, 3])
+        self.assertEqual(upgrade(engine), [])
+
+        inspector = inspect(engine)
+        category = next(column
+                        for column in inspector.get_columns("questions")
+                        if column["name"] == "category")
+
+        self.assertIsInstance(category["type"], Integer)
+        self.assertEqual(inspector.get_foreign_keys("questions")[0]
+                         ["referred_table"], "categories")
+        self.assertIn("ix_questions_category_id",
+                      [index["name"]
+                       for index in inspector.get_indexes("questions")])
+        with engine.connect() as connection:
+            self.assertEqual(connection.execute(text(
+                "SELECT id, category FROM questions ORDER BY id")).all(),
+                [(1, 1), (2, None), (3, None), (4, None), (5, None)])
+
+        engine.dispose()
+        shutil.rmtree(directory)
+
+    def test_memory_storage(self):
+        client = create_app(MEMORY_CONFIG).test_client()
+
+        res = client.get("/categories?counts=true")
+        data = json.loads(res.data)
+
+        self.assertEqual(data["categories"]["1"], "Science")
+        self.assertEqual(data["counts"]["1"], 3)
+
+        res = client.post("/questions", json={**self.new_question,
+                                              "category": 10000})
+
+        self.assertEqual(res.status_code, 422)
+
+        res = client.post("/questions/bulk",
+                          data="question,answer,difficulty,category\n"
+                               "Memory?,123,1,1\n"
+                               "Memory?,123,1,10000\n",
+                          content_type="text/csv")
+        data = json.loads(res.data)
+
+        self.assertEqual(data["inserted"], 1)
+        self.assertEqual(data["errors"][0]["row"], 2)
+
+        res = client.post("/questions/search", json={"searchTerm": "memory"})
+        question_id = json.loads(res.data)["questions"][0]["id"]
+        res = client.get(f"/questions/export?min_id={question_id}")
+
+        self.assertEqual(json.loads(res.data)["question"], "Memory?")
+
+        res = client.delete(f"/questions/{question_id}?return=minimal")
+        res = client.get(f"/questions?after={question_id - 1}")
+
+        self.assertEqual(res.status_code, 404)
+
     # ---------------------------------------#
     # Test categories
     # ---------------------------------------#
@@ -62,6 +315,58 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data["success"], True)
         self.assertTrue(len(data["categories"]))
+
+    def test_retrieve_categories_with_question_counts(self):
+        res = self.client().get("/categories?counts=true")
+        counts = json.loads(res.data)["counts"]
+        total = json.loads(self.client().get("/questions").data)[
+            "total_questions"]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(counts), set(json.loads(res.data)["categories"]))
+        self.assertEqual(sum(counts.values()), total)
+
+        res = self.client().post("/questions", json=self.new_question)
+        question_id = json.loads(res.data)["created_question_id"]
+        res = self.client().get("/categories?counts=true")
+
+        self.assertEqual(json.loads(res.data)["counts"]["1"], counts["1"] + 1)
+        self.assertEqual(json.loads(self.client().get(
+            "/categories/1/questions").data)["total_questions"],
+            counts["1"] + 1)
+
+        self.client().delete(f"/questions/{question_id}?return=minimal")
+        res = self.client().get("/categories?counts=true")
+
+        self.assertEqual(json.loads(res.data)["counts"], counts)
+
+    def test_stale_counts_are_served_while_one_request_reloads(self):
+        counts = QuestionCounts(reconcile_interval=0)
+        session = object()
+        reading, release = threading.Event(), threading.Event()
+        loads = iter([{1: 2}, {1: 3}])
+
+        def read(session):
+            rows = next(loads)
+            if rows[1] == 3:
+                reading.set()
+                release.wait(5)
+            return rows
+
+        counts._read = read
+        self.assertEqual(counts.total(session), 2)
+
+        with ThreadPoolExecutor(1) as pool:
+            reload = pool.submit(counts.total, session)
+            reading.wait(5)
+            # The lock is free while the reload reads the rows.
+            self.assertEqual(counts.total(session), 2)
+            counts.question_changed("insert", {"id": 9, "category": 1})
+            release.set()
+
+            # Overtaken by the insert, the reload is dropped.
+            self.assertEqual(reload.result(), 3)
+
     # ---------------------------------------#
     # Test questions
     # ---------------------------------------#
@@ -78,6 +383,32 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIsInstance(data['categories'], dict)
         self.assertEqual(data["current_category"], None)
 
+    def test_304_conditional_request_until_questions_change(self):
+        res = self.client().get("/questions?page=1")
+        etag = res.headers["ETag"]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Cache-Control"], "no-cache")
+
+        res = self.client().get(
+                                "/questions?page=1",
+                                headers={"If-None-Match": etag}
+                                )
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b"")
+
+        res = self.client().post("/questions", json=self.new_question)
+        question_id = json.loads(res.data)["created_question_id"]
+        res = self.client().get(
+                                "/questions?page=1",
+                                headers={"If-None-Match": etag}
+                                )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+        self.client().delete(f"/questions/{question_id}")
+
     def test_404_sent_requesting_questions_beyond_valid_page(self):
         res = self.client().get("/questions?page=10000")
         data = json.loads(res.data)
@@ -86,6 +417,81 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Resource Not Found")
 
+    def test_retrieve_questions_with_cursor(self):
+        res = self.client().get("/questions?after=0&limit=5")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(len(data["questions"]), 5)
+        self.assertEqual(data["next_cursor"], data["questions"][-1]["id"])
+        self.assertTrue(data["total_questions"])
+
+        res = self.client().get(
+                                f"/questions?after={data['next_cursor']}"
+                                "&limit=5"
+                                )
+        next_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(all(
+            question["id"] > data["next_cursor"]
+            for question in next_data["questions"]
+        ))
+
+    def test_retrieve_questions_with_sparse_fields(self):
+        res = self.client().get("/questions?fields=question"
+                                "&include_categories=false")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("categories", data)
+        self.assertTrue(all(set(question) == {"id", "question"}
+                            for question in data["questions"]))
+
+        res = self.client().get("/categories/1/questions?fields=answer")
+        data = json.loads(res.data)
+
+        self.assertTrue(all(set(question) == {"id", "answer"}
+                            for question in data["questions"]))
+
+    def test_400_retrieve_questions_with_unknown_field(self):
+        res = self.client().get("/questions?fields=id,secret")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
+    def test_compressed_questions(self):
+        if MEMORY_STORAGE:
+            app = create_app({**MEMORY_CONFIG, "DB_PROFILE": "production"})
+        else:
+            app = create_app({"DB_PROFILE": "production"})
+            setup_db(app, self.DB_PATH)
+        client = app.test_client()
+
+        plain = client.get("/questions")
+        res = client.get("/questions", headers={"Accept-Encoding": "gzip"})
+
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", res.headers["Vary"])
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+        self.assertEqual(res.headers["ETag"],
+                         plain.headers["ETag"][:-1] + '-gzip"')
+
+        res = client.get("/questions", headers={
+            "Accept-Encoding": "gzip",
+            "If-None-Match": res.headers["ETag"]
+        })
+
+        self.assertEqual(res.status_code, 304)
+
+        res = client.get("/questions?limit=1&include_categories=false",
+                         headers={"Accept-Encoding": "gzip"})
+
+        self.assertNotIn("Content-Encoding", res.headers)
+
+    @requires_database
     def test_delete_question(self):
         with self.app.app_context():
             new_question = Question(
@@ -119,6 +525,54 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Unprocessable resource")
 
+    def test_delete_many_questions(self):
+        question_ids = [
+            json.loads(self.client().post(
+                "/questions?return=minimal", json=self.new_question
+            ).data)["created_question_id"]
+            for _ in range(2)
+        ]
+        res = self.client().delete(
+                                "/questions/bulk",
+                                json={"ids": question_ids + [100000]}
+                                )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["deleted"], question_ids)
+        self.assertEqual(data["not_found"], [100000])
+
+        res = self.client().delete("/questions/bulk",
+                                   json={"ids": question_ids})
+
+        self.assertEqual(json.loads(res.data)["not_found"], question_ids)
+
+    def test_422_delete_many_questions_without_ids(self):
+        res = self.client().delete("/questions/bulk", json={"ids": ["1"]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+    def test_minimal_responses(self):
+        res = self.client().post("/questions?return=minimal",
+                                 json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["created_question_id"])
+        self.assertNotIn("total_questions", data)
+
+        res = self.client().delete(
+            f"/questions/{data['created_question_id']}?return=minimal"
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertNotIn("questions", data)
+
     def test_add_new_question(self):
         res = self.client().post("/questions", json=self.new_question)
         data = json.loads(res.data)
@@ -140,6 +594,128 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Unprocessable resource")
 
+    def test_422_add_new_question_with_unknown_category(self):
+        for category in (99, "bad", None, True):
+            res = self.client().post("/questions",
+                                     json={**self.new_question,
+                                           "category": category})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(data["success"], False)
+
+    @requires_database
+    def test_bulk_import_questions(self):
+        rows = [
+            json.dumps({**self.new_question, "question": "Bulk 1"}),
+            "not json",
+            json.dumps({**self.new_question, "difficulty": 9}),
+            json.dumps({**self.new_question, "question": "Bulk 2"})
+        ]
+        res = self.client().post(
+                                "/questions/bulk",
+                                data="\n".join(rows),
+                                content_type="application/x-ndjson"
+                                )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["inserted"], 2)
+        self.assertEqual(data["failed"], 2)
+        self.assertEqual([error["row"] for error in data["errors"]], [2, 3])
+
+        with self.app.app_context():
+            for question in Question.query.filter(
+                    Question.question.in_(["Bulk 1", "Bulk 2"])).all():
+                question.delete()
+
+    @requires_database
+    def test_bulk_import_questions_from_csv(self):
+        body = "question,answer,difficulty,category\n" \
+               "Bulk CSV,123,1,1\n" \
+               "Bulk CSV,123,1,10000\n"
+        res = self.client().post(
+                                "/questions/bulk",
+                                data=body,
+                                content_type="text/csv"
+                                )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["inserted"], 1)
+        self.assertEqual(data["errors"][0]["row"], 2)
+
+        with self.app.app_context():
+            for question in Question.query.filter(
+                    Question.question == "Bulk CSV").all():
+                question.delete()
+
+    def test_415_bulk_import_with_unsupported_content_type(self):
+        res = self.client().post("/questions/bulk", json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 415)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Unsupported Media Type")
+
+    def test_export_questions(self):
+        res = self.client().get("/questions/export?category=2")
+        rows = [json.loads(line) for line in res.data.splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(
+            set(rows[0]),
+            {"id", "question", "answer", "difficulty", "category"}
+        )
+
+        res = self.client().get(
+                                f"/questions/export?format=csv"
+                                f"&min_id={rows[1]['id']}"
+                                f"&max_id={rows[2]['id']}"
+                                )
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(lines[0], "id,question,answer,difficulty,category")
+        self.assertEqual(len(lines), 3)
+
+    def test_memory_export_reads_the_rows_lazily(self):
+        store = MemoryQuestionStore(export_batch_size=2)
+        store.load([(1, "Science")],
+                   [{"id": question_id, "question": f"Q{question_id}?",
+                     "answer": "A", "category": 1, "difficulty": 1}
+                    for question_id in range(1, 7)])
+
+        chunks = store.export("ndjson", min_id=2)
+        first = next(chunks)
+        # Deleted past the rows read: left out of the rest.
+        with Flask(__name__).app_context():
+            store.delete(5)
+        rows = [json.loads(line)
+                for line in (first + "".join(chunks)).splitlines()]
+
+        self.assertEqual([row["id"] for row in rows], [2, 3, 4, 6])
+
+    def test_400_export_questions_with_unknown_format(self):
+        res = self.client().get("/questions/export?format=xml")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Bad Request")
+
+    def test_400_export_questions_with_not_valid_filter(self):
+        for query in ("category=abc", "min_id=x", "max_id=1.5"):
+            res = self.client().get(f"/questions/export?{query}")
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data["success"], False)
+            self.assertEqual(data["message"], "Bad Request")
+
     def test_search_questions_with_result(self):
         res = self.client().post(
                                 "/questions/search",
@@ -168,6 +744,134 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["total_questions"], 0)
         self.assertEqual(data["current_category"], None)
 
+    def test_422_search_questions_without_term(self):
+        for body in ('{"searchTerm": ""}', "{}", "null"):
+            res = self.client().post("/questions/search", data=body,
+                                     content_type="application/json")
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(data["success"], False)
+            self.assertEqual(data["message"], "Unprocessable resource")
+
+    def test_search_questions_ranked_by_relevance(self):
+        res = self.client().post(
+                                "/questions/search",
+                                json={"searchTerm": "TITLE"}
+                                )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], 2)
+        # "the title of" matches a whole word, "entitled" only a substring.
+        self.assertEqual(
+            [question["id"] for question in data["questions"]],
+            [6, 5]
+        )
+
+    def test_search_index_follows_created_and_deleted_questions(self):
+        search = {"searchTerm": "zyzzyva"}
+        # Load the search index before changing the data.
+        self.client().post("/questions/search", json=search)
+
+        res = self.client().post(
+                                "/questions",
+                                json={**self.new_question,
+                                      "question": "What is a Zyzzyva?"}
+                                )
+        question_id = json.loads(res.data)["created_question_id"]
+        res = self.client().post("/questions/search", json=search)
+        data = json.loads(res.data)
+
+        self.assertEqual(data["total_questions"], 1)
+        self.assertEqual(data["questions"][0]["id"], question_id)
+
+        self.client().delete(f"/questions/{question_id}")
+        res = self.client().post("/questions/search", json=search)
+        data = json.loads(res.data)
+
+        self.assertEqual(data["total_questions"], 0)
+
+    def test_suggest_questions(self):
+        res = self.client().get("/questions/suggest?prefix=Who%20DISC")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertIn("discovered", data["completions"])
+        self.assertIn("Who discovered penicillin?",
+                      [question["question"]
+                       for question in data["questions"]])
+
+        res = self.client().post("/questions",
+                                 json={**self.new_question,
+                                       "question": "Who zygotized this?"})
+        question_id = json.loads(res.data)["created_question_id"]
+        res = self.client().get("/questions/suggest?prefix=zygo&limit=1")
+        data = json.loads(res.data)
+
+        self.assertEqual(data["completions"], ["zygotized"])
+        self.assertEqual(data["questions"][0]["id"], question_id)
+
+        self.client().delete(f"/questions/{question_id}")
+        res = self.client().get("/questions/suggest?prefix=zygo")
+        data = json.loads(res.data)
+
+        self.assertEqual(data["completions"], [])
+        self.assertEqual(data["questions"], [])
+
+    def test_suggest_index_with_truncated_postings(self):
+        index = SuggestIndex(max_postings=2)
+        index.load([(1, "alpha beta"), (2, "alpha"), (3, "alpha"),
+                    (4, "alpha beta"), (5, "beta")])
+
+        # "alpha" keeps the ids 1 and 2: question 4 may not be checked
+        # against it, so it is not suggested.
+        self.assertEqual(index.suggest("alpha be", 10), (["beta"], [1]))
+        self.assertEqual(index.suggest("be", 10), (["beta"], [1, 4]))
+
+        index = SuggestIndex(max_postings=None)
+        index.load([(1, "alpha beta"), (2, "alpha"), (3, "alpha"),
+                    (4, "alpha beta"), (5, "beta")])
+
+        self.assertEqual(index.suggest("alpha be", 10), (["beta"], [1, 4]))
+
+    @requires_database
+    def test_suggest_index_reloads_in_the_background(self):
+        app = create_app({"SUGGEST_INDEX_MAX_AGE": 0})
+        setup_db(app, self.DB_PATH)
+        client = app.test_client()
+        client.get("/questions/suggest?prefix=quokk")
+        self.join_index_reloads()
+
+        # Written by another worker: the app's index does not see it.
+        with self.app.app_context():
+            question = Question(question="Who quokkaed?", answer="A",
+                                difficulty=1, category=1)
+            question.insert()
+            question_id = question.id
+
+        # Answered from the current index while it is reloaded.
+        res = client.get("/questions/suggest?prefix=quokk")
+        self.assertEqual(json.loads(res.data)["completions"], [])
+
+        self.join_index_reloads()
+        res = client.get("/questions/suggest?prefix=quokk")
+        data = json.loads(res.data)
+
+        self.assertEqual(data["completions"], ["quokkaed"])
+        self.assertEqual(data["questions"][0]["id"], question_id)
+
+        with self.app.app_context():
+            db.session.get(Question, question_id).delete()
+
+    def test_400_suggest_questions_without_prefix(self):
+        res = self.client().get("/questions/suggest?prefix=%20")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
     def test_get_questions_by_category(self):
         res = self.client().get("/categories/2/questions")
         data = json.loads(res.data)
@@ -187,6 +891,234 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Resource Not Found")
+
+    @requires_database
+    def test_read_model_serves_the_same_responses(self):
+        app = create_app({"READ_MODEL_ENABLED": True})
+        setup_db(app, self.DB_PATH)
+        client = app.test_client
+
+        for path in ["/categories",
+                     "/questions?page=2",
+                     "/questions?after=5&limit=3",
+                     "/categories/2/questions",
+                     "/categories/10000/questions"]:
+            res = client().get(path)
+            expected = self.client().get(path)
+            self.assertEqual(res.status_code, expected.status_code)
+            self.assertEqual(json.loads(res.data), json.loads(expected.data))
+
+        res = client().post("/questions", json=self.new_question)
+        question_id = json.loads(res.data)["created_question_id"]
+        res = client().get(f"/questions?after={question_id - 1}")
+        data = json.loads(res.data)
+
+        self.assertEqual(data["questions"][0]["id"], question_id)
+
+        client().delete(f"/questions/{question_id}")
+        res = client().get(f"/questions?after={question_id - 1}")
+
+        self.assertEqual(res.status_code, 404)
+
+    @requires_database
+    def test_group_commit(self):
+        app = create_app({"GROUP_COMMIT_ENABLED": True,
+                          "GROUP_COMMIT_MAX_DELAY_MS": 50})
+        setup_db(app, self.DB_PATH)
+        questions = [{**self.new_question, "question": f"Group {n}?"}
+                     for n in range(8)]
+        questions[3] = {**self.new_question, "question": {"not": "text"}}
+
+        with ThreadPoolExecutor(len(questions)) as pool:
+            responses = list(pool.map(
+                lambda question: app.test_client().post(
+                    "/questions?return=minimal", json=question
+                ),
+                questions
+            ))
+        app.extensions["group_commit"].close()
+        question_ids = [json.loads(res.data)["created_question_id"]
+                        for res in responses if res.status_code == 200]
+
+        with app.app_context():
+            created = dict(db.session.query(Question.id, Question.question)
+                                     .filter(Question.id.in_(question_ids)))
+            Question.query.filter(Question.id.in_(question_ids)) \
+                          .delete(synchronize_session=False)
+            db.session.commit()
+
+        self.assertEqual([res.status_code for res in responses],
+                         [200, 200, 200, 422, 200, 200, 200, 200])
+        self.assertEqual(len(created), 7)
+        self.assertEqual(created[question_ids[0]], "Group 0?")
+        self.assertEqual(created[question_ids[-1]], "Group 7?")
+
+    @requires_database
+    def test_503_group_commit_queue_full(self):
+        app = create_app({"GROUP_COMMIT_ENABLED": True,
+                          "GROUP_COMMIT_MAX_BATCH": 1,
+                          "GROUP_COMMIT_MAX_QUEUE": 1,
+                          "GROUP_COMMIT_ENQUEUE_TIMEOUT_MS": 0})
+        setup_db(app, self.DB_PATH)
+        writer = app.extensions["group_commit"]
+        committing, release = threading.Event(), threading.Event()
+
+        def hold_writer(event, question):
+            committing.set()
+            release.wait(5)
+
+        register_question_listener(app, hold_writer)
+
+        def create():
+            return app.test_client().post("/questions?return=minimal",
+                                          json=self.new_question)
+
+        with ThreadPoolExecutor(2) as pool:
+            # The first question holds the writer, the second fills the
+            # queue.
+            first = pool.submit(create)
+            committing.wait(5)
+            second = pool.submit(create)
+            while not writer.pending():
+                time.sleep(0.001)
+            res = create()
+            release.set()
+            created = [first.result(), second.result()]
+        writer.close()
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data["message"], "Service Unavailable")
+        self.assertEqual(res.headers["Retry-After"], "1")
+        self.assertEqual([res.status_code for res in created], [200, 200])
+
+        res = app.test_client().get("/metrics")
+
+        self.assertIn('endpoint="create_question",reason="write_queue"} 1',
+                      res.data.decode())
+
+        for res in created:
+            question_id = json.loads(res.data)["created_question_id"]
+            app.test_client().delete(f"/questions/{question_id}")
+
+    @requires_database
+    def test_group_commit_timeout_and_failure(self):
+        app = create_app({"GROUP_COMMIT_ENABLED": True,
+                          "GROUP_COMMIT_MAX_BATCH": 1,
+                          "GROUP_COMMIT_RESULT_TIMEOUT_MS": 50})
+        setup_db(app, self.DB_PATH)
+        writer = app.extensions["group_commit"]
+        committing, release = threading.Event(), threading.Event()
+        question = {**self.new_question, "question": "Timed out?"}
+
+        def hold_writer(event, question):
+            committing.set()
+            release.wait(5)
+
+        register_question_listener(app, hold_writer)
+
+        def create():
+            return app.test_client().post("/questions?return=minimal",
+                                          json=question)
+
+        with ThreadPoolExecutor(1) as pool:
+            # The first question is committed but holds the writer; the
+            # second times out in the queue and is dropped.
+            first = pool.submit(create)
+            committing.wait(5)
+            res = create()
+            release.set()
+            first = first.result()
+        writer.close()
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(first.status_code, 503)
+        with app.app_context():
+            created = Question.query \
+                              .filter(Question.question == "Timed out?")
+            self.assertEqual(created.count(), 1)
+            created.delete(synchronize_session=False)
+            db.session.commit()
+
+        def fail(batch):
+            raise RuntimeError("no database")
+
+        writer._commit = fail
+        res = create()
+        writer.close()
+
+        self.assertEqual(res.status_code, 422)
+
+    # ---------------------------------------#
+    # Test bootstrap and batch
+    # ---------------------------------------#
+    def test_bootstrap(self):
+        res = self.client().get("/bootstrap")
+        data = json.loads(res.data)
+        expected = json.loads(self.client().get("/questions").data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["categories"], expected["categories"])
+        self.assertEqual(data["questions"], expected["questions"])
+        self.assertEqual(data["total_questions"], expected["total_questions"])
+        self.assertEqual(sum(data["counts"].values()),
+                         data["total_questions"])
+
+    def test_batch(self):
+        requests = [
+            {"path": "/categories"},
+            {"path": "/questions?page=2"},
+            {"method": "POST", "path": "/questions/search",
+             "body": {"searchTerm": "title"}},
+            {"path": "/categories"},
+            {"path": "/categories/10000/questions"},
+            {"method": "POST", "path": "/questions", "body": self.new_question}
+        ]
+        res = self.client().post("/batch", json={"requests": requests})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual([response["status"]
+                          for response in data["responses"]],
+                         [200, 200, 200, 200, 404, 400])
+        for request, response in zip(requests[:3], data["responses"]):
+            send = getattr(self.client(), request.get("method", "GET").lower())
+            expected = send(request["path"], json=request.get("body"))
+            self.assertEqual(response["body"], json.loads(expected.data))
+
+    def test_422_batch_without_requests(self):
+        res = self.client().post("/batch", json={"requests": []})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+    def test_nested_batch_keeps_the_slot_of_its_batch(self):
+        from flask import request
+        release = AdmissionControl.release
+        released = []
+
+        def record_release(admission, endpoint):
+            # The number of sub-requests of the batch releasing its slot.
+            released.append(len(request.get_json()["requests"]))
+            release(admission, endpoint)
+
+        nested = {"method": "POST", "path": "/batch",
+                  "body": {"requests": [{"path": "/categories"}]}}
+        with mock.patch.object(AdmissionControl, "release", autospec=True,
+                               side_effect=record_release):
+            res = self.app.test_client().post("/batch", json={
+                "requests": [nested, {"path": "/categories"}]
+            })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([response["status"]
+                          for response in data["responses"]], [400, 200])
+        self.assertEqual(released, [2])
+
     # ---------------------------------------#
     # Test quiz
     # ---------------------------------------#
@@ -202,6 +1134,164 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data["success"], True)
 
+    def test_quiz_skips_previous_questions(self):
+        res = self.client().get("/categories/2/questions")
+        previous_questions = [
+            question["id"] for question in json.loads(res.data)["questions"]
+        ]
+        new_quiz_play = {
+                        "previous_questions": previous_questions[1:],
+                        "quiz_category": {"type": "Art", "id": 2}
+                        }
+        res = self.client().post("/quizzes", json=new_quiz_play)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["question"]["id"], previous_questions[0])
+
+        new_quiz_play["previous_questions"] = previous_questions
+        res = self.client().post("/quizzes", json=new_quiz_play)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["question"], None)
+
+    def test_quiz_sees_created_and_deleted_questions(self):
+        res = self.client().get("/categories/1/questions?limit=100")
+        previous_questions = [
+            question["id"] for question in json.loads(res.data)["questions"]
+        ]
+        new_quiz_play = {
+                        "previous_questions": previous_questions,
+                        "quiz_category": {"type": "Science", "id": 1}
+                        }
+        # Load the quiz index before changing the data.
+        self.client().post("/quizzes", json=new_quiz_play)
+
+        res = self.client().post("/questions", json=self.new_question)
+        question_id = json.loads(res.data)["created_question_id"]
+        res = self.client().post("/quizzes", json=new_quiz_play)
+        data = json.loads(res.data)
+
+        self.assertEqual(data["question"]["id"], question_id)
+
+        self.client().delete(f"/questions/{question_id}")
+        res = self.client().post("/quizzes", json=new_quiz_play)
+        data = json.loads(res.data)
+
+        self.assertEqual(data["question"], None)
+
+    def test_quiz_deck(self):
+        res = self.client().get("/categories/1/questions?limit=100")
+        science = [
+            question["id"] for question in json.loads(res.data)["questions"]
+        ]
+        deck = {
+               "quiz_category": {"type": "Science", "id": 1},
+               "previous_questions": science[:1],
+               "size": 2,
+               "seed": 42
+               }
+        res = self.client().post("/quizzes/deck", json=deck)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["total_questions"], 2)
+        self.assertEqual(data["seed"], 42)
+        ids = [question["id"] for question in data["questions"]]
+        self.assertEqual(len(set(ids)), 2)
+        self.assertTrue(set(ids) <= set(science[1:]))
+
+        res = self.client().post("/quizzes/deck", json=deck)
+        self.assertEqual(
+            [question["id"] for question in json.loads(res.data)["questions"]],
+            ids
+        )
+
+        deck["size"] = 50
+        res = self.client().post("/quizzes/deck", json=deck)
+        data = json.loads(res.data)
+
+        self.assertEqual(sorted(question["id"]
+                                for question in data["questions"]),
+                         sorted(science[1:]))
+
+    def test_422_quiz_deck_too_large(self):
+        res = self.client().post("/quizzes/deck", json={"size": 1000})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Unprocessable resource")
+
+    def test_quiz_session(self):
+        res = self.client().post(
+                                "/quizzes/sessions",
+                                json={"quiz_category": {"type": "Art",
+                                                        "id": 2}}
+                                )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        token = data["session_token"]
+
+        played = []
+        for _ in range(4):
+            res = self.client().post(f"/quizzes/sessions/{token}/next")
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            played.append(data["question"]["id"])
+
+        res = self.client().post(f"/quizzes/sessions/{token}/next")
+        data = json.loads(res.data)
+
+        self.assertEqual(len(set(played)), 4)
+        self.assertEqual(data["question"], None)
+
+        res = self.client().delete(f"/quizzes/sessions/{token}")
+        self.assertEqual(res.status_code, 200)
+
+    def test_quiz_session_draws_are_atomic(self):
+        sessions = MemoryQuizSessionStore()
+        token = sessions.create(None).token
+
+        def draw(category, excluded):
+            # Concurrent draws see the same played questions.
+            question_id = next((question_id for question_id in range(1, 9)
+                                if question_id not in excluded), None)
+            time.sleep(0.001)
+            return {"id": question_id} if question_id else None
+
+        with ThreadPoolExecutor(8) as pool:
+            drawn = list(pool.map(lambda _: sessions.draw_next(token, draw),
+                                  range(8)))
+
+        self.assertEqual(sorted(question["id"] for question in drawn),
+                         list(range(1, 9)))
+        self.assertIsNone(sessions.draw_next(token, draw))
+        with self.assertRaises(KeyError):
+            sessions.draw_next("not-a-token", draw)
+
+    def test_404_quiz_session_with_not_valid_token(self):
+        res = self.client().post("/quizzes/sessions/not-a-token/next")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Resource Not Found")
+
+    def test_422_quiz_session_with_not_valid_category(self):
+        for category in ({"id": [1]}, {"id": "2"}, {"id": True}, 2):
+            res = self.client().post("/quizzes/sessions",
+                                     json={"quiz_category": category})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(data["success"], False)
+            self.assertEqual(data["message"], "Unprocessable resource")
+
     def test_422_quiz_if_not_enough_data(self):
         new_quiz_play = {"previous_questions": []}
         res = self.client().post("/quizzes", json=new_quiz_play)
@@ -211,6 +1301,169 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Unprocessable resource")
 
+    # ---------------------------------------#
+    # Test metrics
+    # ---------------------------------------#
+    def test_metrics(self):
+        res = self.client().get("/questions")
+
+        self.assertIn("db;dur=", res.headers["Server-Timing"])
+
+        res = self.client().get("/metrics")
+        text = res.data.decode()
+        labels = 'endpoint="retrieve_questions",method="GET"'
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "text/plain")
+        self.assertIn("# TYPE trivia_http_request_duration_seconds "
+                      "histogram", text)
+        self.assertIn("trivia_http_request_duration_seconds_bucket"
+                      f'{{{labels},le="+Inf"}}', text)
+        self.assertIn(f"trivia_http_requests_total{{{labels},"
+                      'status="200"}', text)
+        self.assertIn(f"trivia_db_queries_per_request_count{{{labels}}}",
+                      text)
+
+    # ---------------------------------------#
+    # Test profiling
+    # ---------------------------------------#
+    @requires_database
+    def test_query_stats(self):
+        client = self.configured_client({"PROFILE_TOKEN": "secret",
+                                         "DB_SLOW_QUERY_MS": 0})
+        with self.assertLogs("flaskr.profiling", "WARNING") as logs:
+            client.get("/questions?page=2")
+
+        self.assertIn("LIMIT ? OFFSET ?", "\n".join(logs.output))
+
+        res = client.get("/admin/queries?limit=50",
+                         headers={"X-Profile-Token": "secret"})
+        data = json.loads(res.data)
+        queries = {query["fingerprint"]: query for query in data["queries"]}
+        page = [query for fingerprint, query in queries.items()
+                if fingerprint.endswith("FROM questions ORDER BY "
+                                        "questions.id LIMIT ? OFFSET ?")]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(page[0]["calls"], 1)
+        self.assertEqual(page[0]["slow_calls"], 1)
+        self.assertEqual(page[0]["parameters"], "(int*2)")
+
+        res = client.get("/admin/queries?sort=slowest",
+                         headers={"X-Profile-Token": "secret"})
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_403_query_stats_without_token(self):
+        res = self.client().get("/admin/queries")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data["message"], "Forbidden")
+
+        res = self.configured_client({"PROFILE_TOKEN": "secret"}).get(
+            "/admin/queries", headers={"X-Profile-Token": "guess"}
+        )
+
+        self.assertEqual(res.status_code, 403)
+
+    def test_profile_request(self):
+        client = self.configured_client({"PROFILE_TOKEN": "secret"})
+
+        for mode in ("cprofile", "sample"):
+            res = client.post("/questions/search",
+                              json={"searchTerm": "title"},
+                              headers={"X-Profile": mode,
+                                       "X-Profile-Token": "secret"})
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.mimetype, "text/plain")
+            self.assertEqual(res.headers["X-Profile-Status"], "200")
+            self.assertTrue(res.data.startswith(f"{mode} profile".encode()))
+
+        self.assertIn(b"search_questions", client.post(
+            "/questions/search", json={"searchTerm": "title"},
+            headers={"X-Profile": "cprofile", "X-Profile-Token": "secret"}
+        ).data)
+
+        res = client.get("/questions", headers={"X-Profile": "cprofile"})
+
+        self.assertEqual(res.status_code, 403)
+
+    # ---------------------------------------#
+    # Test admission control
+    # ---------------------------------------#
+    def test_429_rate_limit(self):
+        client = self.configured_client({"RATE_LIMIT_PER_SECOND": 0.01,
+                                         "RATE_LIMIT_BURST": 2})
+        for _ in range(2):
+            res = client.get("/categories")
+            self.assertEqual(res.status_code, 200)
+
+        res = client.get("/categories")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Too Many Requests")
+        self.assertGreaterEqual(int(res.headers["Retry-After"]), 1)
+
+        res = client.get("/metrics")
+
+        self.assertIn('trivia_http_requests_shed_total{'
+                      'endpoint="retrieve_categories",reason="rate_limit"} 1',
+                      res.data.decode())
+
+    def test_503_concurrency_limit(self):
+        client = self.configured_client({
+            "ROUTE_CONCURRENCY_LIMITS": {"retrieve_questions": 0}
+        })
+        res = client.get("/questions")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data["message"], "Service Unavailable")
+        self.assertEqual(res.headers["Retry-After"], "1")
+
+        res = client.get("/categories")
+
+        self.assertEqual(res.status_code, 200)
+
+    @requires_database
+    def test_503_deadline_exceeded(self):
+        client = self.configured_client({"REQUEST_DEADLINE_MS": 0.001})
+        res = client.post("/quizzes", json={
+            "previous_questions": [],
+            "quiz_category": {"type": "Science", "id": 1}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data["success"], False)
+        self.assertIn("Retry-After", res.headers)
+
+        res = client.get("/metrics")
+
+        self.assertIn('endpoint="add_quiz",reason="deadline"} 1',
+                      res.data.decode())
+
+    def test_deadline_applies_only_to_attached_engines(self):
+        attached = create_engine("sqlite://")
+        other = create_engine("sqlite://")
+        AdmissionControl(deadline_ms=0.001).attach(attached)
+        AdmissionControl(deadline_ms=None).attach(other)
+
+        start_deadline(0.001)
+        time.sleep(0.001)
+        try:
+            with other.connect() as connection:
+                self.assertEqual(connection.scalar(text("SELECT 1")), 1)
+            with attached.connect() as connection:
+                with self.assertRaises(DeadlineExceeded):
+                    connection.execute(text("SELECT 1"))
+        finally:
+            clear_deadline()
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
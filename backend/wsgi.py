@@ -0,0 +1,53 @@
+"""
+Production entry point of the WSGI application, for preforking servers:
+
+    gunicorn --preload --workers 4 wsgi:app
+
+The app is built when this module is imported: once in the master with
+`--preload`, so the workers are forked ready to serve. The production
+profile (the default here, see DB_PROFILE) does not migrate the schema
+on start, so building the app opens no database connection; run
+`python migrations.py` when deploying, or set DB_MIGRATE_ON_START=1.
+
+Every forked worker replaces the connection pools, which must not share
+the sockets of the process that created them, and the time taken to
+start is logged and exported as `trivia_cold_start_seconds`.
+"""
+import os
+import sys
+import time
+
+started = time.perf_counter()
+
+# Imported after the clock starts: loading Flask and SQLAlchemy is
+# most of the cold start.
+from flaskr import create_app  # noqa: E402
+from models import dispose_engines_after_fork  # noqa: E402
+
+
+def env_flag(name):
+    value = os.getenv(name)
+    if value is None:
+        return None
+    return value.lower() in ("1", "true", "yes")
+
+
+def build_app():
+    config = {"DB_PROFILE": os.getenv("DB_PROFILE", "production")}
+    if env_flag("DB_MIGRATE_ON_START") is not None:
+        config["DB_MIGRATE_ON_START"] = env_flag("DB_MIGRATE_ON_START")
+
+    app = create_app(config)
+    dispose_engines_after_fork(app)
+
+    cold_start = time.perf_counter() - started
+    metrics = app.extensions.get("metrics")
+    if metrics is not None:
+        metrics.record_cold_start(cold_start)
+    print(f"trivia: app ready in {cold_start * 1000:.0f} ms "
+          f"(pid {os.getpid()})", file=sys.stderr, flush=True)
+
+    return app
+
+
+app = build_app()